@@ -0,0 +1,230 @@
+# bench/media_server.py
+# Local HTTP server with synthetic media for the pipeline benchmark. Everything is made
+# up from the URL, so nothing is stored and any size or count is free:
+#
+#   /bench/video/<id>?size=N&proto=http|hls|dash|split[&rate=B]   page for the stub extractor
+#   /bench/audio/<id>?seconds=T                              an audio-only video (WAV)
+#   /bench/playlist/<id>?count=N&size=M                     N tiny videos, paged
+#
+# proto=split offers separate video and audio streams, for ffmpeg to merge. The stub
+# extractor (yt_dlp_plugins/extractor/bench_media.py) reads the matching /bench/api/...
+# JSON; delay=S on a page URL holds each of its API responses back S seconds, for a
+# slow extraction or playlist enumeration, and flaky=N fails a playlist's page N with a
+# 503, once. feed=1 lists a playlist newest first, as a channel's own feed; grow()
+# adds entries to a playlist while the server runs. Media endpoints:
+#   /bench/media/<name>?size=N[&rate=B]   N bytes (Range supported), at most B bytes/s
+#   /bench/hls/<id>.m3u8?size=N&seg=S     HLS media playlist of S-byte segments
+#   /bench/frag/<id>/<i>?size=S           one DASH fragment
+#   /bench/wav/<id>.wav?seconds=T         a sine tone, 16-bit mono PCM
+
+import os
+import io
+import json
+import math
+import time
+import wave
+import struct
+import threading
+import http.server
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+CHUNK = 64 * 1024
+PAGE_SIZE = 100
+_BLOCK = os.urandom(CHUNK)
+
+
+def sine_wav(seconds: float, rate: int = 22050) -> bytes:
+    frames = int(seconds * rate)
+    tone = [int(12000 * math.sin(2 * math.pi * 440 * i / rate)) for i in range(rate)]
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        second = struct.pack(f"<{rate}h", *tone)
+        for start in range(0, frames, rate):
+            w.writeframes(second[:2 * min(rate, frames - start)])
+    return buf.getvalue()
+
+
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MediaServer"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split("/") if p][1:]   # without "bench"
+        try:
+            if parts[:1] == ["api"]:
+                time.sleep(float(q.get("delay", 0)))
+            if parts[:1] == ["api"] and parts[1] in ("video", "audio"):
+                self._json(self.server.video_info(parts[1], parts[2], q))
+            elif parts[:2] == ["api", "playlist"] and self.server.fails_once(parts[2], q):
+                self._send(503, "text/plain", b"try again")
+            elif parts[:2] == ["api", "playlist"]:
+                self._json(self.server.playlist_page(parts[2], q))
+            elif parts[:1] == ["media"]:
+                self._bytes(int(q["size"]), "video/mp4", int(q.get("rate", 0)))
+            elif parts[:1] == ["hls"]:
+                self._send(200, "application/vnd.apple.mpegurl", self.server.hls_playlist(parts[1], q).encode())
+            elif parts[:1] == ["frag"]:
+                self._bytes(int(q["size"]), "video/mp4")
+            elif parts[:1] == ["wav"]:
+                self._send(200, "audio/wav", self.server.wav(float(q.get("seconds", 10))))
+            else:
+                self._send(404, "text/plain", b"not found")
+        except (KeyError, IndexError, ValueError):
+            self._send(400, "text/plain", b"bad request")
+        except (BrokenPipeError, ConnectionResetError):
+            pass   # the client canceled
+
+    def _send(self, status: int, ctype: str, data: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _json(self, obj):
+        self._send(200, "application/json", json.dumps(obj).encode())
+
+    def _bytes(self, size: int, ctype: str, rate: int = 0):
+        start, end = 0, size - 1
+        rng = self.headers.get("Range", "")
+        if rng.startswith("bytes="):
+            first, _, last = rng[6:].partition("-")
+            start = int(first or 0)
+            end = min(end, int(last)) if last else end
+        if start >= size:
+            self._send(416, "text/plain", b"range not satisfiable")
+            return
+        self.send_response(206 if rng else 200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if rng:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        left = end - start + 1
+        while left > 0:
+            n = min(CHUNK, left)
+            self.wfile.write(_BLOCK[:n])
+            left -= n
+            if rate:
+                time.sleep(n / rate)
+
+
+class MediaServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), MediaHandler)
+        self.base = f"http://127.0.0.1:{self.server_port}/bench"
+        self._wav: dict[float, bytes] = {}
+        self._failed: set[str] = set()
+        self._counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> "MediaServer":
+        threading.Thread(target=self.serve_forever, name="media-server", daemon=True).start()
+        return self
+
+    # --- page URLs, for the scenarios
+    def video_url(self, video_id: str, size: int, proto: str = "http", rate: int = 0,
+                  delay: float = 0) -> str:
+        query = {"size": size, "proto": proto, **({"rate": rate} if rate else {}),
+                 **({"delay": delay} if delay else {})}
+        return f"{self.base}/video/{video_id}?{urlencode(query)}"
+
+    def audio_url(self, video_id: str, seconds: float) -> str:
+        return f"{self.base}/audio/{video_id}?seconds={seconds}"
+
+    def playlist_url(self, playlist_id: str, count: int, size: int, delay: float = 0,
+                     flaky: int | None = None, feed: bool = False) -> str:
+        query = {"count": count, "size": size, **({"delay": delay} if delay else {}),
+                 **({"flaky": flaky} if flaky is not None else {}), **({"feed": 1} if feed else {})}
+        return f"{self.base}/playlist/{playlist_id}?{urlencode(query)}"
+
+    # --- what the stub extractor reads
+    def video_info(self, kind: str, video_id: str, q: dict) -> dict:
+        info = {"id": video_id, "title": f"bench {video_id}"}
+        if kind == "audio":
+            seconds = float(q.get("seconds", 10))
+            info["formats"] = [{"format_id": "wav", "url": f"{self.base}/wav/{video_id}.wav?seconds={seconds}",
+                                "ext": "wav", "vcodec": "none", "acodec": "pcm_s16le", "abr": 352,
+                                "filesize": len(self.wav(seconds))}]
+            return info
+        size, proto = int(q["size"]), q.get("proto", "http")
+        if proto == "hls":
+            seg = min(size, 1024 * 1024)
+            fmt = {"url": f"{self.base}/hls/{video_id}.m3u8?size={size}&seg={seg}", "protocol": "m3u8_native"}
+        elif proto == "dash":
+            seg = min(size, 1024 * 1024)
+            count = max(1, -(-size // seg))
+            fmt = {"url": f"{self.base}/frag/{video_id}/", "fragment_base_url": f"{self.base}/frag/{video_id}/",
+                   "protocol": "http_dash_segments",
+                   "fragments": [{"path": f"{i}?size={min(seg, size - i * seg)}"} for i in range(count)]}
+        elif proto == "split":
+            rate = f"&rate={q['rate']}" if q.get("rate") else ""
+            audio = max(1, size // 8)
+            info["formats"] = [
+                {"format_id": "video", "url": f"{self.base}/media/{video_id}-v.mp4?size={size}{rate}",
+                 "ext": "mp4", "protocol": "http", "vcodec": "avc1.64001f", "acodec": "none", "height": 720,
+                 "filesize": size},
+                {"format_id": "audio", "url": f"{self.base}/media/{video_id}-a.m4a?size={audio}{rate}",
+                 "ext": "m4a", "protocol": "http", "vcodec": "none", "acodec": "mp4a.40.2", "abr": 128,
+                 "filesize": audio},
+            ]
+            return info
+        else:
+            rate = f"&rate={q['rate']}" if q.get("rate") else ""
+            fmt = {"url": f"{self.base}/media/{video_id}.mp4?size={size}{rate}", "protocol": "http"}
+        info["formats"] = [{"format_id": proto, "ext": "mp4", "vcodec": "avc1.64001f", "acodec": "mp4a.40.2",
+                            "height": 720, "filesize": size, **fmt}]
+        return info
+
+    def playlist_page(self, playlist_id: str, q: dict) -> dict:
+        size, page = int(q["size"]), int(q.get("page", 0))
+        with self._lock:
+            count = self._counts.get(playlist_id, int(q["count"]))
+        ids = range(page * PAGE_SIZE, min(count, (page + 1) * PAGE_SIZE))
+        if q.get("feed"):
+            ids = [count - 1 - i for i in ids]
+        return {"id": playlist_id, "title": f"bench playlist {playlist_id}", "count": count,
+                "page_size": PAGE_SIZE, "channel_id": playlist_id if q.get("feed") else None,
+                "entries": [{"id": f"{playlist_id}-{i}", "url": self.video_url(f"{playlist_id}-{i}", size)}
+                            for i in ids]}
+
+    def grow(self, playlist_id: str, count: int):
+        """From now on the playlist has count entries, whatever its URL says."""
+        with self._lock:
+            self._counts[playlist_id] = count
+
+    def fails_once(self, playlist_id: str, q: dict) -> bool:
+        if q.get("flaky") is None or q.get("page", "0") != q["flaky"]:
+            return False
+        with self._lock:
+            if playlist_id in self._failed:
+                return False
+            self._failed.add(playlist_id)
+        return True
+
+    def hls_playlist(self, name: str, q: dict) -> str:
+        video_id = name.rsplit(".", 1)[0]
+        size, seg = int(q["size"]), int(q["seg"])
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(max(1, -(-size // seg))):
+            lines += ["#EXTINF:4.0,", f"{self.base}/media/{video_id}-{i}.ts?size={min(seg, size - i * seg)}"]
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def wav(self, seconds: float) -> bytes:
+        with self._lock:
+            data = self._wav.get(seconds)
+            if data is None:
+                data = self._wav[seconds] = sine_wav(seconds)
+        return data
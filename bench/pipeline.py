@@ -0,0 +1,401 @@
+# bench/pipeline.py
+# Offline benchmark of the download pipeline, against a local media server.
+#
+#   python bench/pipeline.py                            # every scenario, headless
+#   python bench/pipeline.py tiny cancel --gui --offscreen
+#   python bench/pipeline.py --scale 0.1 --output run.json --compare baseline.json
+#
+# media_server.py makes up progressive files, HLS playlists, DASH fragments, audio and
+# paged playlists from the URL; yt-dlp picks up the stub extractors in
+# yt_dlp_plugins/extractor as a plugin, so nothing touches a real site. Headless runs
+# drive YtDlpRunner and DownloadScheduler directly; --gui runs the main window's
+# download_queue in Qt. Each run of a scenario is a fresh interpreter and reports:
+#   items_per_s, mb_per_s      finished items and downloaded bytes per wall-clock second
+#   peak_rss_mb                peak resident memory (peak_child_rss_mb: worker processes)
+#   stall_ms, stall_max_ms     total and worst lateness of a 10 ms tick, counting ticks over
+#                              5 ms late: the Qt event loop with --gui, else a thread
+#   log_kb                     log text written; with --gui, log_pane_kb is what the pane holds
+#   cancel_s, cancel_max_s     cancel request to CANCELED, per item (cancel scenario)
+# With --compare, exits 1 if a median regressed by more than --tolerance.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+MiB = 1024 * 1024
+
+# kind: what is queued; scale: the fields --scale multiplies.
+SCENARIOS = {
+    "tiny": {"kind": "video", "count": 1000, "size": 16 * 1024, "workers": 8, "scale": ["count"]},
+    "huge": {"kind": "video", "count": 3, "size": 256 * MiB, "protos": ["http", "hls", "dash"],
+             "workers": 3, "scale": ["size"]},
+    "playlist": {"kind": "playlist", "count": 2, "entries": 1000, "size": 4 * 1024, "workers": 8,
+                 "scale": ["entries"]},
+    "audio": {"kind": "audio", "count": 40, "seconds": 30, "workers": 4, "scale": ["count"],
+              "options": {"extract_audio": True, "audio_format": "mp3"}},
+    "cancel": {"kind": "video", "count": 16, "size": 64 * MiB, "rate": 4 * MiB, "workers": 4,
+               "cancel_running_after": 1.0, "cancel_after": 3.0, "scale": ["count"]},
+}
+HIGHER_IS_BETTER = ("items_per_s", "mb_per_s")
+LOWER_IS_BETTER = ("peak_rss_mb", "stall_ms", "stall_max_ms", "log_pane_kb", "cancel_max_s")
+# Smaller changes than these are noise, whatever the percentage.
+NOISE = {"peak_rss_mb": 5.0, "stall_ms": 100.0, "stall_max_ms": 25.0, "log_pane_kb": 16.0, "cancel_max_s": 0.05}
+
+
+def scaled(spec: dict, scale: float) -> dict:
+    spec = dict(spec)
+    for key in spec["scale"]:
+        spec[key] = max(1 if key != "size" else 64 * 1024, round(spec[key] * scale))
+    return spec
+
+
+def scenario_urls(srv, name: str, spec: dict) -> list[str]:
+    if spec["kind"] == "playlist":
+        return [srv.playlist_url(f"{name}{i}", spec["entries"], spec["size"]) for i in range(spec["count"])]
+    if spec["kind"] == "audio":
+        return [srv.audio_url(f"{name}{i}", spec["seconds"]) for i in range(spec["count"])]
+    protos = spec.get("protos", ["http"])
+    return [srv.video_url(f"{name}{i}", spec["size"], protos[i % len(protos)], spec.get("rate", 0))
+            for i in range(spec["count"])]
+
+
+# -----------------------------
+# Child: one scenario run
+# -----------------------------
+class Meter:
+    """What the pipeline reports through its signals; safe to call from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items: dict[int, object] = {}
+        self.log_chars = 0
+        self.cancel_latency: list[float] = []
+
+    def add(self, items: list):
+        with self._lock:
+            self.items.update((it.id, it) for it in items)
+
+    def on_added(self, parent_id: int, children: list):
+        self.add(children)
+
+    def on_log(self, text: str):
+        with self._lock:
+            self.log_chars += len(text)
+
+    def on_state(self, item_id: int, state: str):
+        if state != "canceled":
+            return
+        with self._lock:
+            item = self.items.get(item_id)
+            if item is not None and item.token.canceled_at is not None:
+                self.cancel_latency.append(time.time() - item.token.canceled_at)
+
+    def connect(self, signals, *how):
+        """`how`: Qt's connection type, for the GUI's signals."""
+        signals.log.connect(self.on_log, *how)
+        signals.items_added.connect(self.on_added, *how)
+        signals.item_state.connect(self.on_state, *how)
+
+
+class StallMeter:
+    """Lateness of a 10 ms tick: how long an event loop in this process would be held up."""
+
+    TICK = 0.010
+    LATE = 0.005
+
+    def __init__(self):
+        self.last: float | None = None
+        self.total = 0.0
+        self.max = 0.0
+
+    def tick(self):
+        now = time.monotonic()
+        if self.last is not None:
+            late = now - self.last - self.TICK
+            if late > self.LATE:
+                self.total += late
+                self.max = max(self.max, late)
+        self.last = now
+
+    def run(self, stop: threading.Event):
+        while not stop.wait(self.TICK):
+            self.tick()
+
+
+def peak_rss_mb(who) -> float:
+    import resource
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / MiB if sys.platform == "darwin" else peak / 1024   # bytes on macOS, KiB elsewhere
+
+
+def summarize(meter: Meter, elapsed: float, downloaded: int, stall: StallMeter) -> dict:
+    import resource
+    from ytdlp_core import ItemState
+    videos = [it for it in meter.items.values() if not it.children]
+    states: dict[str, int] = {}
+    for it in videos:
+        states[it.state] = states.get(it.state, 0) + 1
+    done = states.get(ItemState.DONE, 0)
+    lat = meter.cancel_latency
+    return {
+        "items": len(videos), "states": states, "elapsed_s": round(elapsed, 3),
+        "items_per_s": round(done / elapsed, 2), "mb_per_s": round(downloaded / MiB / elapsed, 2),
+        "peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "peak_child_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "stall_ms": round(stall.total * 1000, 1), "stall_max_ms": round(stall.max * 1000, 1),
+        "log_kb": round(meter.log_chars / 1024, 1),
+        "cancel_s": round(statistics.mean(lat), 3) if lat else None,
+        "cancel_max_s": round(max(lat), 3) if lat else None,
+    }
+
+
+def job_options(spec: dict, out_dir: str, overrides: dict):
+    from ytdlp_core import DownloadOptions
+    return DownloadOptions.from_dict({"out_dir": out_dir, "use_archive": False, "retry_attempts": 0,
+                                      "workers": spec["workers"], **spec.get("options", {}), **overrides})
+
+
+def run_headless(job: dict, out_dir: str) -> dict:
+    from ytdlp_core import (
+        CoreSignals, ItemState, DownloadItem, InfoCache, ProgressAggregator, YdlSessionPool, PostProcessPool,
+        FragmentTuner, YtDlpRunner, DownloadScheduler, DownloadProcessPool, ProcessRunner, StagingArea,
+    )
+    spec = job["spec"]
+    options = job_options(spec, out_dir, job["options"])
+    signals = CoreSignals()
+    meter = Meter()
+    meter.connect(signals)
+    items = [DownloadItem(url=url) for url in job["urls"]]
+    meter.add(items)
+
+    pool = YdlSessionPool()
+    progress = ProgressAggregator()
+    postprocess = PostProcessPool()
+    processes = DownloadProcessPool() if options.isolate_downloads else None
+    staging = StagingArea(options.staging_root()) if options.staging else None
+    runner_cls, isolate = (ProcessRunner, {"processes": processes}) if processes else (YtDlpRunner, {})
+    runner = runner_cls(signals, lambda: False, cache=InfoCache(), pool=pool, progress=progress,
+                        postprocess=postprocess, fragments=FragmentTuner() if options.fragments == 0 else None,
+                        format_rule=options.parsed_format_rule(), staging=staging, **isolate)
+    scheduler = DownloadScheduler(signals, workers=options.workers, host_limit=options.host_limit,
+                                  retry=options.retry_policy(), policy=options.schedule)
+    for item in items:
+        scheduler.submit(item)
+
+    def cancel_running():
+        for item in items:
+            if item.state in ItemState.ACTIVE:
+                scheduler.cancel_item(item)
+
+    timers = []
+    if spec.get("cancel_running_after"):
+        timers.append(threading.Timer(spec["cancel_running_after"], cancel_running))
+    if spec.get("cancel_after"):
+        timers.append(threading.Timer(spec["cancel_after"], scheduler.cancel_all))
+    stall = StallMeter()
+    stop = threading.Event()
+    threading.Thread(target=stall.run, args=(stop,), daemon=True).start()
+    started = time.monotonic()
+    for t in timers:
+        t.start()
+    scheduler.run(runner, options.to_ydl_opts())
+    elapsed = time.monotonic() - started
+    stop.set()
+    for t in timers:
+        t.cancel()
+    downloaded = progress.snapshot().bytes_done
+    pool.close_all()
+    postprocess.close()
+    if processes is not None:
+        processes.close()
+    if staging is not None:
+        staging.close()
+    return summarize(meter, elapsed, downloaded, stall)
+
+
+def run_gui(job: dict, out_dir: str) -> dict:
+    from PySide6.QtCore import Qt, QTimer
+    from PySide6.QtWidgets import QApplication
+    import ytdlp_gui
+    from ytdlp_core import ItemState, DownloadItem
+
+    spec = job["spec"]
+    app = QApplication(sys.argv[:1])
+    w = ytdlp_gui.MainWindow()
+    w.apply_options(job_options(spec, out_dir, job["options"]))
+    meter = Meter()
+    meter.connect(w.signals, Qt.DirectConnection)
+    items = [DownloadItem(url=url) for url in job["urls"]]
+    meter.add(items)
+    w.queue.add_items(items)
+
+    stall = StallMeter()
+    ticker = QTimer()
+    ticker.setTimerType(Qt.PreciseTimer)
+    ticker.setInterval(int(StallMeter.TICK * 1000))
+    ticker.timeout.connect(stall.tick)
+    result: dict = {}
+    started = [0.0]
+
+    def start():
+        started[0] = time.monotonic()
+        ticker.start()
+        w.start_download()
+
+    def cancel_running():
+        if w.scheduler:
+            for item in items:
+                if item.state in ItemState.ACTIVE:
+                    w.scheduler.cancel_item(item)
+
+    def finished():
+        elapsed = time.monotonic() - started[0]
+        ticker.stop()
+        w.flush_log()
+        doc = w.log.document()
+        result.update(summarize(meter, elapsed, w.progress_stats.snapshot().bytes_done, stall))
+        result["log_pane_kb"] = round(doc.characterCount() * 2 / 1024, 1)   # QString is UTF-16
+        result["log_pane_lines"] = doc.blockCount()
+        app.quit()
+
+    w.signals.finished.connect(finished)
+    QTimer.singleShot(0, start)
+    if spec.get("cancel_running_after"):
+        QTimer.singleShot(int(spec["cancel_running_after"] * 1000), cancel_running)
+    if spec.get("cancel_after"):
+        QTimer.singleShot(int(spec["cancel_after"] * 1000), w.cancel)
+    w.show()
+    app.exec()
+    return result
+
+
+def child(gui: bool):
+    sys.path.insert(0, ROOT)
+    job = json.load(sys.stdin)
+    with tempfile.TemporaryDirectory() as out_dir:
+        warning = job_options(job["spec"], out_dir, job["options"]).audio_warning()
+        if warning:
+            result = {"skipped": warning}
+        else:
+            result = run_gui(job, out_dir) if gui else run_headless(job, out_dir)
+    print("\n" + json.dumps(result), flush=True)   # yt-dlp's progress lines end without one
+    os._exit(0)   # skip interpreter teardown (Qt, pool threads); nothing is left to flush
+
+
+# -----------------------------
+# Parent: server, runs, report
+# -----------------------------
+def run_once(name: str, spec: dict, urls: list[str], args, home: str) -> dict:
+    env = dict(os.environ, HOME=home, XDG_DATA_HOME=os.path.join(home, "data"))
+    if args.offscreen:
+        env["QT_QPA_PLATFORM"] = "offscreen"
+    cmd = [sys.executable, os.path.abspath(__file__), "--child"] + (["--gui"] if args.gui else [])
+    job = {"name": name, "spec": spec, "urls": urls, "options": dict(args.option)}
+    out = subprocess.run(cmd, input=json.dumps(job), env=env, capture_output=True, text=True, timeout=3600)
+    lines = [ln for ln in out.stdout.splitlines() if ln.startswith("{")]
+    if not lines:
+        raise RuntimeError(f"{name}: benchmark child failed:\n{out.stderr[-4000:]}")
+    return json.loads(lines[-1])
+
+
+def medians(runs: list[dict]) -> dict:
+    keys = [k for k, v in runs[0].items() if isinstance(v, (int, float))]
+    return {k: round(statistics.median(r[k] for r in runs if r.get(k) is not None), 3)
+            for k in keys if any(r.get(k) is not None for r in runs)}
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    found = []
+    for name, res in report["scenarios"].items():
+        old_median = baseline.get("scenarios", {}).get(name, {}).get("median")
+        if not old_median or not res.get("median"):
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            new, old = res["median"].get(metric), old_median.get(metric)
+            if new is None or not old or abs(new - old) < NOISE.get(metric, 0.0):
+                continue
+            change = (new - old) / old
+            if (-change if metric in HIGHER_IS_BETTER else change) > tolerance:
+                found.append(f"{name}.{metric}: {old:g} -> {new:g} ({change:+.0%})")
+    return found
+
+
+def option_arg(text: str) -> tuple[str, object]:
+    key, sep, value = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError("expected KEY=VALUE")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline download pipeline benchmark.")
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--runs", type=int, default=1, help="runs per scenario; medians are reported")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply item counts and sizes (e.g. 0.1)")
+    parser.add_argument("--option", type=option_arg, action="append", default=[], metavar="KEY=VALUE",
+                        help="profile option for every run, e.g. isolate_downloads=true (repeatable)")
+    parser.add_argument("--gui", action="store_true", help="run through the main window (needs PySide6)")
+    parser.add_argument("--offscreen", action="store_true", help="use Qt's offscreen platform (CI)")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", metavar="JSON", help="results of an earlier run to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression (default: 0.2 = 20%%)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args.gui)
+        return 0
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    from media_server import MediaServer
+    from yt_dlp.version import __version__ as yt_dlp_version
+    srv = MediaServer().start()
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "mode": "gui" if args.gui else "headless",
+              "scale": args.scale, "options": dict(args.option), "python": platform.python_version(),
+              "platform": platform.platform(), "yt_dlp": yt_dlp_version, "scenarios": {}}
+    with tempfile.TemporaryDirectory() as home:
+        for name in args.scenarios or SCENARIOS:
+            spec = scaled(SCENARIOS[name], args.scale)
+            urls = scenario_urls(srv, name, spec)
+            runs = [run_once(name, spec, urls, args, home) for _ in range(args.runs)]
+            done = [r for r in runs if "skipped" not in r]
+            report["scenarios"][name] = {"spec": spec, "runs": runs, "median": medians(done) if done else {}}
+            if not done:
+                print(f"{name:<9} skipped: {runs[0]['skipped']}")
+                continue
+            m = report["scenarios"][name]["median"]
+            print(f"{name:<9} {m['items_per_s']:8.1f} items/s {m['mb_per_s']:8.1f} MB/s  "
+                  f"rss {m['peak_rss_mb']:6.0f} MB  stall {m['stall_ms']:6.0f} ms (max {m['stall_max_ms']:.0f})  "
+                  f"log {m.get('log_pane_kb', m['log_kb']):.0f} KB"
+                  + (f"  cancel max {m['cancel_max_s']:.2f}s" if m.get("cancel_max_s") is not None else ""))
+    srv.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if not args.compare:
+        return 0
+    with open(args.compare, encoding="utf-8") as f:
+        baseline = json.load(f)
+    found = regressions(report, baseline, args.tolerance)
+    for line in found:
+        print(f"REGRESSION {line}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
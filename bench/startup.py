@@ -0,0 +1,139 @@
+# bench/startup.py
+# Cold-start benchmark with a regression budget.
+#
+#   python bench/startup.py                  # 5 runs, compare medians to startup_budget.json
+#   python bench/startup.py --runs 10 --offscreen --output startup.json
+#
+# Each run starts a fresh interpreter and records, relative to process spawn:
+#   import_s           ytdlp_gui imported (PySide6 + engine, but not yt_dlp)
+#   first_paint_s      first paint event of the main window
+#   yt_dlp_ready_s     background preload of yt_dlp finished
+#   first_extraction_s first extract_info done (local HTTP server, generic extractor)
+# Exits 1 if any median exceeds its budget.
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import threading
+import http.server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BUDGET_PATH = os.path.join(HERE, "startup_budget.json")
+METRICS = ("import_s", "first_paint_s", "yt_dlp_ready_s", "first_extraction_s")
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_clip(directory: str) -> http.server.ThreadingHTTPServer:
+    with open(os.path.join(directory, "clip.mp4"), "wb") as f:
+        f.write(os.urandom(4096))
+
+    def handler(*args, **kwargs):
+        return QuietHandler(*args, directory=directory, **kwargs)
+
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def child():
+    t0 = float(os.environ["STARTUP_BENCH_T0"])
+    url = os.environ["STARTUP_BENCH_URL"]
+    sys.path.insert(0, ROOT)
+    marks: dict[str, float] = {}
+
+    import ytdlp_gui
+    marks["import_s"] = time.time() - t0
+    assert "yt_dlp" not in sys.modules, "yt_dlp must not be imported at module load"
+
+    from PySide6.QtCore import QObject, QEvent, QTimer
+    from PySide6.QtWidgets import QApplication
+    from ytdlp_core import CoreSignals, YdlSessionPool, YtDlpRunner, preload_yt_dlp
+
+    app = QApplication(sys.argv[:1])
+    w = ytdlp_gui.MainWindow()
+
+    def finish():
+        print(json.dumps(marks), flush=True)
+        os._exit(0)
+
+    def first_task():
+        preload_yt_dlp().join()
+        marks["yt_dlp_ready_s"] = time.time() - t0
+        pool = YdlSessionPool(max_idle=0)
+        runner = YtDlpRunner(CoreSignals(), lambda: False, pool=pool)
+        with pool.lease({"quiet": True, "no_warnings": True}) as ydl:
+            runner.extract(ydl, url)
+        marks["first_extraction_s"] = time.time() - t0
+        finish()
+
+    class PaintWatcher(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and "first_paint_s" not in marks:
+                marks["first_paint_s"] = time.time() - t0
+                threading.Thread(target=first_task, daemon=True).start()
+            return False
+
+    watcher = PaintWatcher()
+    w.installEventFilter(watcher)
+    w.show()
+    QTimer.singleShot(60_000, finish)
+    app.exec()
+
+
+def run_once(url: str, offscreen: bool) -> dict:
+    env = dict(os.environ, STARTUP_BENCH_T0=repr(time.time()), STARTUP_BENCH_URL=url)
+    if offscreen:
+        env["QT_QPA_PLATFORM"] = "offscreen"
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"],
+                         env=env, capture_output=True, text=True, timeout=120)
+    lines = [ln for ln in out.stdout.splitlines() if ln.startswith("{")]
+    if not lines:
+        raise RuntimeError(f"benchmark child failed:\n{out.stderr}")
+    return json.loads(lines[-1])
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--offscreen", action="store_true", help="use Qt's offscreen platform (CI)")
+    parser.add_argument("--budget", default=BUDGET_PATH)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child()
+        return 0
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        srv = serve_clip(tmp)
+        url = f"http://127.0.0.1:{srv.server_port}/clip.mp4"
+        runs = [run_once(url, args.offscreen) for _ in range(args.runs)]
+        srv.shutdown()
+
+    with open(args.budget, encoding="utf-8") as f:
+        budget = json.load(f)
+    medians = {m: statistics.median(r[m] for r in runs if m in r) for m in METRICS}
+    over = {m: v for m, v in medians.items() if m in budget and v > budget[m]}
+
+    result = {"runs": runs, "median": medians, "budget": budget, "over_budget": over}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    for m in METRICS:
+        flag = "  OVER BUDGET" if m in over else ""
+        print(f"{m:<20} {medians[m]:6.3f}s  (budget {budget.get(m, float('nan')):.3f}s){flag}")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
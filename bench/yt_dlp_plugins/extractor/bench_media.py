@@ -0,0 +1,36 @@
+# Stub extractors for bench/media_server.py, loaded by yt-dlp as a plugin while
+# bench/ is on sys.path (bench/pipeline.py runs from there). They fetch the server's
+# JSON description the way a real extractor fetches a page, so extraction still costs
+# an HTTP round trip through the session.
+
+from yt_dlp.extractor.common import InfoExtractor
+from yt_dlp.utils import OnDemandPagedList, update_url_query
+
+
+class BenchMediaIE(InfoExtractor):
+    IE_NAME = "bench"
+    _VALID_URL = r"https?://127\.0\.0\.1:\d+/bench/(?:video|audio)/(?P<id>[\w-]+)"
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        api = url.replace("/bench/", "/bench/api/", 1)
+        return self._download_json(api, video_id, note=False)
+
+
+class BenchPlaylistIE(InfoExtractor):
+    IE_NAME = "bench:playlist"
+    _VALID_URL = r"https?://127\.0\.0\.1:\d+/bench/playlist/(?P<id>[\w-]+)"
+
+    def _real_extract(self, url):
+        playlist_id = self._match_id(url)
+        api = url.replace("/bench/", "/bench/api/", 1)
+        first = self._download_json(api, playlist_id, note=False)
+
+        def page(n):
+            data = first if n == 0 else self._download_json(
+                update_url_query(api, {"page": n}), playlist_id, note=False)
+            for entry in data["entries"]:
+                yield self.url_result(entry["url"], BenchMediaIE, entry["id"])
+
+        entries = OnDemandPagedList(page, first["page_size"])
+        return self.playlist_result(entries, playlist_id, first["title"], channel_id=first.get("channel_id"))
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.join(ROOT, "bench")
+# bench/ holds the local media server and, as a yt-dlp plugin, its stub extractors;
+# it has to be on sys.path before yt-dlp loads its extractors.
+sys.path[:0] = [ROOT, BENCH]
+
+
+@pytest.fixture(scope="session")
+def media_server():
+    from media_server import MediaServer
+    srv = MediaServer().start()
+    yield srv
+    srv.shutdown()
@@ -0,0 +1,161 @@
+"""
+Cancel latency per phase, against the local media server (bench/media_server.py).
+
+Each test cancels one item while it is in a phase and checks that it settles as
+CANCELED within that phase's bound: one HTTP request while extracting or enumerating
+a playlist, one read block while downloading, and no wait at all for post-processing
+(the pool's process or ffmpeg is killed).
+"""
+
+import os
+import time
+import threading
+
+import pytest
+
+from ytdlp_core import (
+    CoreSignals, ItemState, DownloadItem, YdlSessionPool, PostProcessPool, YtDlpRunner, DownloadScheduler,
+)
+
+MiB = 1024 * 1024
+REQUEST_DELAY = 1.0   # seconds the server holds back each API response
+READ_BLOCK = 1.0      # yt-dlp sizes its read blocks to about a second of data
+SLACK = 0.5           # polling, thread hand-offs and a loaded test machine
+RUN_TIMEOUT = 30.0
+
+posix_only = pytest.mark.skipif(os.name != "posix", reason="needs a POSIX shell")
+
+
+def in_state(state: str, after: float = 0.3):
+    """A cancel condition: the item has been in `state` for `after` seconds."""
+    seen: dict[int, float] = {}
+
+    def when(item: DownloadItem) -> bool:
+        if item.state != state:
+            return False
+        first = seen.setdefault(item.id, time.monotonic())
+        return time.monotonic() - first >= after
+
+    return when
+
+
+def run_and_cancel(items: list[DownloadItem], opts: dict, cancel_when, postprocess=None) -> dict[int, float]:
+    """
+    Run items on one worker and cancel each one once cancel_when(item) is true.
+    Returns the seconds from cancel request to CANCELED, per item id. Whatever is
+    still queued once they have all settled (playlist entries) is dropped.
+    """
+    signals = CoreSignals()
+    settled: dict[int, float] = {}
+
+    def on_state(item_id: int, state: str):
+        if state == ItemState.CANCELED:
+            settled.setdefault(item_id, time.time())
+
+    signals.item_state.connect(on_state)
+    pool = YdlSessionPool()
+    runner = YtDlpRunner(signals, lambda: False, pool=pool, postprocess=postprocess)
+    scheduler = DownloadScheduler(signals, workers=1)
+    for item in items:
+        scheduler.submit(item)
+    stop = threading.Event()
+
+    def watch():
+        left = list(items)
+        while not stop.wait(0.02):
+            for item in [it for it in left if cancel_when(it)]:
+                scheduler.cancel_item(item)
+                left.remove(item)
+            if not left and all(it.id in settled for it in items):
+                scheduler.cancel_all()
+                return
+
+    threading.Thread(target=watch, daemon=True).start()
+    thread = threading.Thread(target=scheduler.run, args=(runner, opts), daemon=True)
+    thread.start()
+    thread.join(RUN_TIMEOUT)
+    stop.set()
+    hung = thread.is_alive()
+    if hung:
+        scheduler.cancel_all()
+        thread.join(5.0)
+    pool.close_all()
+    assert not hung, "the queue did not finish after the cancel"
+    return {it.id: settled[it.id] - it.token.canceled_at for it in items
+            if it.id in settled and it.token.canceled_at is not None}
+
+
+def ydl_opts(out_dir, **extra) -> dict:
+    return {"outtmpl": os.path.join(str(out_dir), "%(id)s.%(ext)s"), "quiet": True, "no_warnings": True,
+            "noprogress": True, **extra}
+
+
+def assert_canceled(item: DownloadItem, latency: dict[int, float], bound: float):
+    assert item.state == ItemState.CANCELED
+    assert item.id in latency, "no CANCELED state was emitted"
+    assert latency[item.id] <= bound, f"canceled after {latency[item.id]:.2f}s, bound {bound:.2f}s"
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path):
+    """An ffmpeg that reports a version and otherwise hangs, like a long merge."""
+    bin_dir = tmp_path / "ffmpeg-bin"
+    bin_dir.mkdir()
+    script = ('#!/bin/sh\n'
+              'case " $* " in\n'
+              '  *" -version "*) echo "ffmpeg version 7.1 Copyright (c) 2000-2024"; exit 0;;\n'
+              '  *" -bsfs "*) echo "Bitstream filters:"; echo "aac_adtstoasc"; exit 0;;\n'
+              'esac\n'
+              'exec sleep 60\n')
+    for name in ("ffmpeg", "ffprobe"):
+        path = bin_dir / name
+        path.write_text(script)
+        path.chmod(0o755)
+    return str(bin_dir)
+
+
+def test_cancel_during_extraction(media_server, tmp_path):
+    item = DownloadItem(url=media_server.video_url("extract", 64 * 1024, delay=REQUEST_DELAY))
+    latency = run_and_cancel([item], ydl_opts(tmp_path), in_state(ItemState.EXTRACTING))
+    assert_canceled(item, latency, REQUEST_DELAY + SLACK)
+    assert not any(tmp_path.iterdir()), "the download started after the cancel"
+
+
+def test_cancel_during_playlist_enumeration(media_server, tmp_path):
+    count = 1000
+    parent = DownloadItem(url=media_server.playlist_url("enumerate", count, 1024, delay=REQUEST_DELAY))
+    latency = run_and_cancel([parent], ydl_opts(tmp_path), lambda it: it.children > 0)
+    assert_canceled(parent, latency, REQUEST_DELAY + SLACK)
+    assert parent.children < count, "the whole playlist was enumerated after the cancel"
+
+
+def test_cancel_during_download(media_server, tmp_path):
+    item = DownloadItem(url=media_server.video_url("download", 64 * MiB, rate=2 * MiB))
+    latency = run_and_cancel([item], ydl_opts(tmp_path), in_state(ItemState.DOWNLOADING))
+    assert_canceled(item, latency, READ_BLOCK + SLACK)
+    assert not (tmp_path / "download.mp4").exists()
+
+
+@posix_only
+def test_cancel_during_postprocessing(media_server, tmp_path):
+    item = DownloadItem(url=media_server.video_url("postprocess", 64 * 1024))
+    opts = ydl_opts(tmp_path, postprocessors=[
+        {"key": "Exec", "exec_cmd": "sleep 30; echo {}", "when": "post_process"}])
+    postprocess = PostProcessPool(workers=1)
+    try:
+        latency = run_and_cancel([item], opts, in_state(ItemState.POSTPROCESSING, after=1.0), postprocess)
+    finally:
+        postprocess.close()
+    assert_canceled(item, latency, SLACK)
+
+
+@posix_only
+def test_cancel_during_merge(media_server, tmp_path, fake_ffmpeg):
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    item = DownloadItem(url=media_server.video_url("merge", 256 * 1024, proto="split"))
+    opts = ydl_opts(out_dir, format="video+audio", ffmpeg_location=fake_ffmpeg)
+    started = time.monotonic()
+    latency = run_and_cancel([item], opts, in_state(ItemState.POSTPROCESSING))
+    assert_canceled(item, latency, SLACK)
+    assert time.monotonic() - started < 30, "the merge ran to its end"
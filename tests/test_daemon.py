@@ -0,0 +1,20 @@
+"""DownloadDaemon: what submit() accepts."""
+
+import pytest
+
+from ytdlp_core import DownloadOptions
+from ytdlp_daemon import DownloadDaemon
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    daemon = DownloadDaemon(DownloadOptions(out_dir=str(tmp_path)))
+    daemon.start()
+    yield daemon
+    daemon.close()
+
+
+@pytest.mark.parametrize("priority", [True, False, 1.5, "2", None])
+def test_priority_must_be_an_integer(daemon, priority):
+    with pytest.raises(ValueError, match="priority"):
+        daemon.submit("https://example.com/video", priority=priority)
@@ -0,0 +1,31 @@
+"""DiskBudget: the free-space check before a download starts."""
+
+import os
+
+from ytdlp_core import (
+    CoreSignals, ItemState, DownloadItem, DiskBudget, YdlSessionPool, YtDlpRunner, DownloadScheduler,
+)
+
+
+def test_reserve_in_a_folder_that_does_not_exist_yet(tmp_path):
+    missing = str(tmp_path / "new" / "%(uploader)s")
+    budget = DiskBudget(margin=0)
+    assert budget.reserve("small", 1024, missing) is None
+    problem = budget.reserve("huge", 1 << 60, missing)
+    assert problem and problem.startswith("Not enough free space")
+
+
+def test_download_into_a_templated_folder(media_server, tmp_path):
+    # An explicit format, so the space check runs in format selection.
+    item = DownloadItem(url=media_server.video_url("nested", 64 * 1024))
+    signals = CoreSignals()
+    pool = YdlSessionPool()
+    runner = YtDlpRunner(signals, lambda: False, pool=pool)
+    scheduler = DownloadScheduler(signals, workers=1)
+    scheduler.submit(item)
+    scheduler.run(runner, {"outtmpl": os.path.join(str(tmp_path), "new", "%(title)s", "%(id)s.%(ext)s"),
+                           "format": "best", "quiet": True, "no_warnings": True, "noprogress": True})
+    pool.close_all()
+
+    assert item.state == ItemState.DONE, item.error
+    assert (tmp_path / "new" / "bench nested" / "nested.mp4").exists()
@@ -0,0 +1,42 @@
+"""QueueJournal: what a restart gets back from queue.db."""
+
+import sqlite3
+
+from ytdlp_core import QueueJournal, DownloadItem, ItemState
+
+
+def test_priority_survives_a_restart(tmp_path):
+    path = str(tmp_path / "queue.db")
+    journal = QueueJournal(path)
+    low, high = DownloadItem(url="https://example.com/a"), DownloadItem(url="https://example.com/b")
+    journal.add([low, high])
+    high.priority = 3
+    journal.update(high)
+    journal.close()
+
+    restored = {it.url: it for it in QueueJournal(path).load_unfinished()}
+    assert restored[low.url].priority == 0
+    assert restored[high.url].priority == 3
+    assert restored[high.url].state == ItemState.PENDING
+
+
+def test_journal_without_priority_column(tmp_path):
+    # A queue.db written before priority was stored.
+    path = str(tmp_path / "queue.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, url TEXT NOT NULL, parent_id INTEGER, "
+                 "title TEXT, ie_key TEXT, extra_info TEXT, state TEXT NOT NULL, "
+                 "children INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)")
+    conn.execute("INSERT INTO items VALUES "
+                 "(1, 'https://example.com/old', NULL, NULL, NULL, NULL, 'pending', 0, 0)")
+    conn.commit()
+    conn.close()
+
+    journal = QueueJournal(path)
+    [old] = journal.load_unfinished()
+    assert old.url == "https://example.com/old" and old.priority == 0
+    old.priority = 2
+    journal.update(old)
+    journal.close()
+    [old] = QueueJournal(path).load_unfinished()
+    assert old.priority == 2
@@ -0,0 +1,78 @@
+"""PostProcessPool: deferred postprocessors, and the download archive they finish."""
+
+import os
+import time
+
+import pytest
+
+from ytdlp_core import (
+    CoreSignals, ItemState, DownloadItem, YdlSessionPool, PostProcessPool, DownloadProcessPool, YtDlpRunner,
+    ProcessRunner, DownloadScheduler, read_archive,
+)
+
+posix_only = pytest.mark.skipif(os.name != "posix", reason="needs a POSIX shell")
+
+
+@pytest.fixture(scope="module")
+def postprocess():
+    pool = PostProcessPool(workers=2)
+    yield pool
+    pool.close()
+
+
+def run_one(item: DownloadItem, opts: dict, postprocess: PostProcessPool, isolate: bool):
+    signals = CoreSignals()
+    pool = YdlSessionPool()
+    processes = DownloadProcessPool() if isolate else None
+    runner_cls, extra = (ProcessRunner, {"processes": processes}) if isolate else (YtDlpRunner, {})
+    runner = runner_cls(signals, lambda: False, pool=pool, postprocess=postprocess, **extra)
+    scheduler = DownloadScheduler(signals, workers=1)
+    scheduler.submit(item)
+    try:
+        scheduler.run(runner, opts)
+    finally:
+        pool.close_all()
+        if processes is not None:
+            processes.close()
+
+
+@posix_only
+@pytest.mark.parametrize("isolate", [False, True], ids=["in-process", "process"])
+@pytest.mark.parametrize("cmd, state", [("true {}", ItemState.DONE), ("exit 3", ItemState.FAILED)])
+def test_archive_records_only_finished_files(media_server, tmp_path, postprocess, isolate, cmd, state):
+    archive = tmp_path / "archive.txt"
+    video_id = f"archived-{state}-{isolate}"
+    item = DownloadItem(url=media_server.video_url(video_id, 64 * 1024))
+    opts = {"outtmpl": os.path.join(str(tmp_path), "%(id)s.%(ext)s"), "download_archive": str(archive),
+            "quiet": True, "no_warnings": True, "noprogress": True,
+            "postprocessors": [{"key": "Exec", "exec_cmd": cmd, "when": "post_process"}]}
+    run_one(item, opts, postprocess, isolate)
+
+    assert item.state == state, item.error
+    assert (f"benchmedia {video_id}" in read_archive(str(archive))) == (state == ItemState.DONE)
+
+
+def exec_job(pool: PostProcessPool, path, cmd: str):
+    params = {"quiet": True, "postprocessors": [{"key": "Exec", "exec_cmd": cmd, "when": "post_process"}]}
+    return pool.submit(params, {"id": path.stem, "filepath": str(path), "ext": path.suffix[1:]})
+
+
+@posix_only
+def test_processes_are_reused_until_a_cancel(tmp_path):
+    path = tmp_path / "file.mp4"
+    path.write_bytes(b"x")
+    pool = PostProcessPool(workers=1)
+    try:
+        for _ in range(3):
+            assert exec_job(pool, path, "true {}").result(timeout=30) == str(path)
+        assert pool.started == 1
+
+        slow = exec_job(pool, path, "sleep 30; echo {}")
+        time.sleep(1.0)
+        pool.cancel(slow)
+        with pytest.raises(Exception):
+            slow.result(timeout=5)
+        assert exec_job(pool, path, "true {}").result(timeout=30) == str(path)
+        assert pool.started == 2
+    finally:
+        pool.close()
@@ -0,0 +1,104 @@
+"""Retries: classify_error on the messages yt-dlp and the pipeline produce, and the scheduler's retries."""
+
+import os
+import time
+import socket
+import threading
+
+import pytest
+
+from ytdlp_core import (
+    classify_error, CoreSignals, ItemState, DownloadItem, RetryPolicy, YdlSessionPool, YtDlpRunner,
+    DownloadScheduler,
+)
+
+
+@pytest.mark.parametrize("msg, kind", [
+    ("ERROR: [youtube] abc: Unable to download webpage: HTTP Error 429: Too Many Requests", "throttled"),
+    ("ERROR: unable to download video data: HTTP Error 503: Service Unavailable", "transient"),
+    ("ERROR: [generic] Unable to download webpage: HTTP Error 502: Bad Gateway", "transient"),
+    ("ERROR: [download] Got error: The read operation timed out", "transient"),
+    ("ERROR: Unable to download webpage: <urlopen error [Errno 104] Connection reset by peer>", "transient"),
+    ("ERROR: Unable to download webpage: <urlopen error [Errno -3] Temporary failure in name resolution>",
+     "transient"),
+    ("ERROR: [download] Got error: [SSL: UNEXPECTED_EOF_WHILE_READING] EOF occurred in violation of protocol",
+     "transient"),
+    ("ERROR: Unable to download webpage: _ssl.c:989: The handshake operation timed out", "transient"),
+    ("Download process did not respond for 60s; killed", "transient"),
+    ("ERROR: unable to download video data: HTTP Error 403: Forbidden", "permanent"),
+    ("ERROR: [generic] Unable to download webpage: HTTP Error 404: Not Found", "permanent"),
+    ("ERROR: Unable to download webpage: <urlopen error [SSL: CERTIFICATE_VERIFY_FAILED] "
+     "certificate verify failed: unable to get local issuer certificate (_ssl.c:1006)>", "permanent"),
+    ("[SSL: CERTIFICATE_VERIFY_FAILED]", "permanent"),
+    ("Not enough free space in /tmp: about 1.2 GB needed, 500.0 MB free", "permanent"),
+    ("ERROR: [bench] x: Requested format is not available (format 503)", "permanent"),
+    ("ERROR: [youtube] abc: Private video. Sign in if you've been granted access to this video", "permanent"),
+    ("ERROR: Unsupported URL: https://example.com/", "permanent"),
+])
+def test_classify_error(msg, kind):
+    assert classify_error(msg) == kind
+
+
+@pytest.mark.parametrize("msg, kind", [
+    ("ERROR: [download] video-404: Got error: The read operation timed out", "transient"),
+    ("ERROR: [bench] 503: Unable to extract title", "permanent"),
+    ("ERROR: [bench] item 429 of 500: Unable to extract title", "permanent"),
+])
+def test_bare_numbers_are_not_status_codes(msg, kind):
+    # An id, a size or a format code that looks like a status code says nothing.
+    assert classify_error(msg) == kind
+
+
+def test_retried_playlist_queues_each_entry_once(media_server, tmp_path):
+    # Two pages; the second fails once, after the first page's entries were queued.
+    count = 150
+    parent = DownloadItem(url=media_server.playlist_url("flaky", count, 1024, flaky=1))
+    signals = CoreSignals()
+    added: list[DownloadItem] = []
+    signals.items_added.connect(lambda parent_id, children: added.extend(children))
+    pool = YdlSessionPool()
+    runner = YtDlpRunner(signals, lambda: False, pool=pool)
+    scheduler = DownloadScheduler(signals, workers=4, retry=RetryPolicy(attempts=2, base_delay=0.1, jitter=0))
+    scheduler.submit(parent)
+    scheduler.run(runner, {"outtmpl": os.path.join(str(tmp_path), "%(id)s.%(ext)s"), "quiet": True,
+                           "no_warnings": True, "noprogress": True})
+    pool.close_all()
+
+    assert parent.state == ItemState.DONE and parent.attempts == 1
+    urls = [child.url for child in added]
+    assert len(urls) == len(set(urls)) == count
+    assert all(child.state == ItemState.DONE for child in added)
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.parametrize("how", ["cancel_item", "discard"])
+def test_dropping_an_item_that_waits_for_a_retry(tmp_path, how):
+    # Connection refused is transient: the item waits a minute for its retry.
+    item = DownloadItem(url=f"http://127.0.0.1:{closed_port()}/bench/video/gone")
+    signals = CoreSignals()
+    pool = YdlSessionPool()
+    runner = YtDlpRunner(signals, lambda: False, pool=pool)
+    scheduler = DownloadScheduler(signals, workers=1, retry=RetryPolicy(attempts=3, base_delay=60, jitter=0))
+    scheduler.submit(item)
+    thread = threading.Thread(target=scheduler.run, args=(runner, {"quiet": True, "no_warnings": True}),
+                              daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not (item.attempts == 1 and item.state == ItemState.PENDING) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert item.attempts == 1 and item.state == ItemState.PENDING, "the item was not waiting for a retry"
+
+    getattr(scheduler, how)(item)
+    thread.join(2.0)
+    alive = thread.is_alive()
+    if alive:
+        scheduler.cancel_all()
+        thread.join(5.0)
+    pool.close_all()
+    assert not alive, "the queue waited for the retry of a dropped item"
+    assert item.attempts == 1
@@ -0,0 +1,62 @@
+"""SourceSync: what a sync queues from a playlist, and from a channel's newest-first feed."""
+
+import pytest
+
+from ytdlp_core import CoreSignals, SourceStore, SourceSync, YdlSessionPool, YtDlpRunner
+
+
+@pytest.fixture
+def sync(tmp_path):
+    pool = YdlSessionPool()
+    store = SourceStore(str(tmp_path / "sources.db"))
+
+    def run(url: str, first_limit: int | None = None):
+        runner = YtDlpRunner(CoreSignals(), lambda: False, pool=pool)
+        syncer = SourceSync(runner, store, first_limit=first_limit)
+        queued = []
+        [result] = syncer.run([url], {}, queued.extend)
+        assert not result.error, result.error
+        return sorted(item.url.split("/")[-1].split("?")[0] for item in queued), result
+
+    yield run
+    pool.close_all()
+
+
+def ids(name: str, numbers) -> list[str]:
+    return sorted(f"{name}-{i}" for i in numbers)
+
+
+def test_playlist_that_grows_at_the_end(media_server, sync):
+    url = media_server.playlist_url("grows", 150, 1024)
+    queued, _ = sync(url)
+    assert queued == ids("grows", range(150))
+
+    media_server.grow("grows", 153)
+    queued, result = sync(url)
+    assert queued == ids("grows", range(150, 153))
+    assert not result.stopped
+
+    queued, _ = sync(url)
+    assert queued == []
+
+
+def test_first_sync_of_a_playlist_queues_its_newest(media_server, sync):
+    url = media_server.playlist_url("limited", 150, 1024)
+    queued, _ = sync(url, first_limit=3)
+    assert queued == ids("limited", range(147, 150))
+
+    # The older entries were remembered, not left for the next sync.
+    media_server.grow("limited", 151)
+    queued, _ = sync(url, first_limit=3)
+    assert queued == ids("limited", [150])
+
+
+def test_feed_stops_at_the_first_known_entry(media_server, sync):
+    url = media_server.playlist_url("feed", 150, 1024, feed=True)
+    queued, _ = sync(url, first_limit=3)
+    assert queued == ids("feed", range(147, 150))
+
+    media_server.grow("feed", 152)
+    queued, result = sync(url)
+    assert queued == ids("feed", [150, 151])
+    assert result.stopped and result.scanned == 3
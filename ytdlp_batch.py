@@ -0,0 +1,282 @@
+# ytdlp_batch.py
+# Headless batch mode: the same download pipeline as the GUI, without Qt.
+#
+#   python ytdlp_gui.py --batch urls.txt --profile profile.json
+#   python ytdlp_batch.py --batch - < urls.txt
+#   python ytdlp_gui.py --sync --profile profile.json      # what is new in saved sources
+#
+# Machine-readable events go to stdout as JSON lines ("sync", "added", "estimate", "state",
+# "progress", "summary"); the human-readable log goes to stderr.
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+
+from ytdlp_core import (
+    app_data_dir, iter_urls, url_list_kind, read_archive, classify_error, normalize_url,
+    CoreSignals, ItemState, DownloadItem, DownloadOptions, UrlImporter, InfoCache, ProgressAggregator,
+    SourceStore, SourceSync, CancelToken, SCHEDULE_POLICIES,
+    YdlSessionPool, PostProcessPool, BandwidthLimiter, FragmentTuner, Tracer, YtDlpRunner, DownloadScheduler,
+    DownloadProcessPool, ProcessRunner, StagingArea,
+)
+
+
+def read_items(path: str, archive_path: str | None) -> tuple[list[DownloadItem], str]:
+    """
+    Queue items for a URL list (text, CSV or JSON; '-' reads text from stdin), minus
+    duplicates and videos already in the archive. Also returns the import summary.
+    """
+    items: list[DownloadItem] = []
+    importer = UrlImporter(archive=read_archive(archive_path))
+    if path == "-":
+        stats = importer.run(iter_urls(sys.stdin), items.extend)
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            stats = importer.run(iter_urls(f, url_list_kind(path)), items.extend)
+    return items, f"Read {stats.read} URL(s): {stats.summary()}"
+
+
+class JsonLines:
+    """Thread-safe JSON-lines writer."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, **fields):
+        line = json.dumps({"event": event, "ts": round(time.time(), 3), **fields})
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="ytdlp_gui.py --batch",
+        description="Download a list of URLs without the GUI.",
+    )
+    parser.add_argument("--batch", metavar="FILE",
+                        help="URL list: text (one per line), .csv/.tsv or .json ('-' for stdin)")
+    parser.add_argument("--sync", action="store_true",
+                        help="queue what is new in the saved sources since their last sync")
+    parser.add_argument("--add-source", metavar="URL", action="append", default=[],
+                        help="save a channel or playlist URL for --sync (repeatable)")
+    parser.add_argument("--remove-source", metavar="URL", action="append", default=[],
+                        help="forget a saved source (repeatable)")
+    parser.add_argument("--list-sources", action="store_true", help="print the saved sources and exit")
+    parser.add_argument("--sync-first", type=int, metavar="N",
+                        help="on a source's first sync, queue only its N newest entries (0: none)")
+    parser.add_argument("--sync-workers", type=int, default=8, metavar="N",
+                        help="sources enumerated in parallel (default: 8)")
+    parser.add_argument("--profile", metavar="JSON",
+                        help="options saved from the GUI with \"Save profile…\"")
+    parser.add_argument("--out", metavar="DIR", help="override the profile's output folder")
+    parser.add_argument("--workers", type=int, help="override the number of parallel downloads")
+    parser.add_argument("--schedule", choices=SCHEDULE_POLICIES,
+                        help="queue order (default: the profile's, else fifo); shortest and mix "
+                             "estimate sizes ahead of the downloads")
+    parser.add_argument("--trace", metavar="FILE", help="append per-phase timing spans (JSON lines)")
+    parser.add_argument("--metrics", metavar="FILE", help="write Prometheus-format metrics")
+    parser.add_argument("--progress-interval", type=float, default=1.0, metavar="SEC",
+                        help="seconds between progress events (default: 1)")
+    return parser
+
+
+def manage_sources(store: SourceStore, args, out: "JsonLines"):
+    if args.add_source:
+        n = store.add(args.add_source)
+        print(f"Saved {n} new source(s).", file=sys.stderr)
+    if args.remove_source:
+        n = store.remove(args.remove_source)
+        print(f"Removed {n} source(s).", file=sys.stderr)
+    if args.list_sources:
+        for src in store.sources():
+            out.emit("source", url=src.url, title=src.title, last_sync=src.last_sync,
+                     last_new=src.last_new, known=src.known)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    out = JsonLines(sys.stdout)
+    sources = SourceStore(os.path.join(app_data_dir(), "sources.db"))
+    if args.add_source or args.remove_source or args.list_sources:
+        manage_sources(sources, args, out)
+        if args.list_sources or not (args.batch or args.sync):
+            return 0
+    if not (args.batch or args.sync):
+        parser.error("--batch or --sync is required")
+
+    try:
+        options = DownloadOptions.load(args.profile) if args.profile else DownloadOptions()
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Invalid profile: {e}", file=sys.stderr)
+        return 2
+    if args.out:
+        options.out_dir = args.out
+    if args.workers:
+        options.workers = args.workers
+    if args.schedule:
+        options.schedule = args.schedule
+    if options.schedule not in SCHEDULE_POLICIES:
+        print(f"Invalid profile: unknown schedule {options.schedule!r}", file=sys.stderr)
+        return 2
+    try:
+        format_rule = options.parsed_format_rule()
+    except ValueError as e:
+        print(f"Invalid format rule: {e}", file=sys.stderr)
+        return 2
+    if not os.path.isdir(options.out_dir):
+        print(f"Output folder does not exist: {options.out_dir}", file=sys.stderr)
+        return 2
+    warning = options.audio_warning()
+    if warning:
+        print(f"WARNING: {warning}", file=sys.stderr)
+
+    imported: list[DownloadItem] = []
+    if args.batch:
+        try:
+            imported, summary = read_items(args.batch, options.archive_path())
+        except (OSError, ValueError, csv.Error) as e:
+            print(f"Cannot read URL list: {e}", file=sys.stderr)
+            return 2
+        print(summary, file=sys.stderr)
+
+    if args.trace or args.metrics:
+        tracer = Tracer(args.trace, args.metrics)
+    elif options.record_metrics:
+        tracer = Tracer.in_app_data()
+    else:
+        tracer = None
+
+    items: dict[int, DownloadItem] = {item.id: item for item in imported}
+
+    signals = CoreSignals()
+    signals.log.connect(lambda text: (sys.stderr.write(text), sys.stderr.flush()))
+    signals.error.connect(lambda msg: sys.stderr.write(f"ERROR: {msg}\n"))
+
+    def on_state(item_id: int, state: str):
+        item = items.get(item_id)
+        out.emit("state", id=item_id, url=item.url if item else None, state=state)
+
+    def on_added(parent_id: int, children: list):
+        for child in children:
+            items[child.id] = child
+        out.emit("added", parent=parent_id,
+                 items=[{"id": c.id, "url": c.url, "title": c.title} for c in children])
+
+    signals.item_state.connect(on_state)
+    signals.items_added.connect(on_added)
+    signals.item_estimated.connect(lambda item_id, size: out.emit("estimate", id=item_id, size=size))
+
+    canceled = threading.Event()
+    pool = YdlSessionPool()
+    if args.sync:
+        try:
+            sync_sources(sources, args, options, items, signals, pool, tracer, out)
+        except KeyboardInterrupt:
+            canceled.set()
+            pool.close_all()
+            return 130
+
+    progress = ProgressAggregator()
+    postprocess = PostProcessPool()
+    processes = DownloadProcessPool() if options.isolate_downloads else None
+    staging = StagingArea(options.staging_root()) if options.staging else None
+    runner_cls, isolate = (ProcessRunner, {"processes": processes}) if processes else (YtDlpRunner, {})
+    runner = runner_cls(signals, canceled.is_set, cache=InfoCache(disk_dir=app_data_dir("info-cache")),
+                        pool=pool, progress=progress, postprocess=postprocess,
+                        bandwidth=BandwidthLimiter(*options.rate_budget()),
+                        fragments=FragmentTuner() if options.fragments == 0 else None,
+                        format_rule=format_rule, tracer=tracer, staging=staging, **isolate)
+    scheduler = DownloadScheduler(signals, workers=options.workers, host_limit=options.host_limit,
+                                  retry=options.retry_policy(), policy=options.schedule)
+    out.emit("added", parent=None, items=[{"id": it.id, "url": it.url, "title": ""} for it in items.values()])
+    for item in list(items.values()):
+        scheduler.submit(item)
+
+    started = time.monotonic()
+    run = threading.Thread(target=scheduler.run, args=(runner, options.to_ydl_opts()), daemon=True)
+    run.start()
+    try:
+        while run.is_alive():
+            run.join(args.progress_interval)
+            pending = sum(1 for it in list(items.values()) if it.state == ItemState.PENDING)
+            st = progress.snapshot(pending_items=pending)
+            out.emit("progress", active=st.active, pending=pending, completed=st.completed,
+                     bytes_done=st.bytes_done, bytes_remaining=st.bytes_remaining,
+                     throughput=round(st.throughput, 1), eta=st.eta and round(st.eta, 1),
+                     items_per_min=round(st.items_per_min, 2))
+    except KeyboardInterrupt:
+        canceled.set()
+        scheduler.cancel_all()
+        run.join()
+    finally:
+        pool.close_all()
+        postprocess.close()
+        if processes is not None:
+            processes.close()
+        if staging is not None:
+            staging.close()
+        if tracer is not None:
+            tracer.close()
+
+    counts: dict[str, int] = {}
+    for item in items.values():
+        counts[item.state] = counts.get(item.state, 0) + 1
+    failed = [it for it in items.values() if it.state == ItemState.FAILED]
+    out.emit("summary", elapsed=round(time.monotonic() - started, 2), states=counts,
+             failed=[it.url for it in failed],
+             errors=[{"url": it.url, "kind": classify_error(it.error), "attempts": it.attempts,
+                      "error": it.error} for it in failed],
+             schedule=scheduler.report)
+    if canceled.is_set():
+        return 130
+    return 1 if counts.get(ItemState.FAILED) else 0
+
+
+def sync_sources(store: SourceStore, args, options: DownloadOptions, items: dict[int, DownloadItem],
+                 signals: CoreSignals, pool: YdlSessionPool, tracer: Tracer | None, out: JsonLines):
+    """Add what is new in the saved sources to items (skipping URLs already there)."""
+    urls = [src.url for src in store.sources()]
+    if not urls:
+        print("No saved sources; add some with --add-source URL.", file=sys.stderr)
+        return
+    queued = {normalize_url(it.url) for it in items.values()}
+    lock = threading.Lock()
+
+    def on_items(batch: list[DownloadItem]):
+        with lock:
+            for item in batch:
+                key = normalize_url(item.url)
+                if key not in queued:
+                    queued.add(key)
+                    items[item.id] = item
+
+    runner = YtDlpRunner(signals, lambda: False, pool=pool, tracer=tracer)
+    sync = SourceSync(runner, store, read_archive(options.archive_path()), workers=args.sync_workers,
+                      first_limit=args.sync_first)
+    token = CancelToken()
+    started = time.monotonic()
+    try:
+        results = sync.run(urls, options.to_ydl_opts(), on_items, token)
+    except KeyboardInterrupt:
+        token.cancel()
+        raise
+    for r in results:
+        print(f"Sync: {r.summary()}", file=sys.stderr)
+    new = sum(r.new for r in results)
+    failed = sum(1 for r in results if r.error)
+    print(f"Synced {len(results)} source(s) in {time.monotonic() - started:.1f}s: "
+          f"{new} new item(s), {failed} failed.", file=sys.stderr)
+    out.emit("sync", sources=[{"url": r.url, "title": r.title, "new": r.new, "scanned": r.scanned,
+                               "stopped": r.stopped, "elapsed": round(r.elapsed, 2), "error": r.error}
+                              for r in results])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
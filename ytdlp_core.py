@@ -0,0 +1,4538 @@
+# ytdlp_core.py
+# Download engine shared by the GUI (ytdlp_gui.py) and the headless batch mode
+# (ytdlp_batch.py). Must not import PySide6.
+
+import os
+import re
+import sys
+import csv
+import copy
+import errno
+import json
+import time
+import heapq
+import bisect
+import types
+import random
+import shutil
+import signal
+import sqlite3
+import subprocess
+import hashlib
+import functools
+import statistics
+import itertools
+import multiprocessing
+import queue as queue_mod
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields, asdict
+
+
+# -----------------------------
+# Lazy yt-dlp import
+# -----------------------------
+# `import yt_dlp` pulls in the extractor registry, networking stack, cookie and
+# downloader modules. Nothing at module level needs it, so the GUI can paint first
+# and warm it up in the background with preload_yt_dlp().
+_yt_dlp = None
+
+
+def ytdlp():
+    """The yt_dlp module, imported on first use."""
+    global _yt_dlp
+    if _yt_dlp is None:
+        import yt_dlp
+        _yt_dlp = yt_dlp
+    return _yt_dlp
+
+
+def preload_yt_dlp() -> threading.Thread:
+    """Import yt_dlp (and build its extractor list) on a background thread."""
+    def load():
+        ytdlp().extractor.gen_extractor_classes()
+
+    t = threading.Thread(target=load, name="yt-dlp-preload", daemon=True)
+    t.start()
+    return t
+
+
+# -----------------------------
+# Utilities
+# -----------------------------
+def safe_strip_lines(text: str) -> list[str]:
+    return [ln.strip() for ln in text.splitlines() if ln.strip()]
+
+
+def human_bytes(n: float | None) -> str:
+    if n is None:
+        return "?"
+    units = ["B", "KB", "MB", "GB", "TB"]
+    u = 0
+    n = float(n)
+    while n >= 1024 and u < len(units) - 1:
+        n /= 1024
+        u += 1
+    return f"{n:.2f} {units[u]}"
+
+
+def human_duration(seconds: float | None) -> str:
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m"
+
+
+def parse_rate_limit(s: str) -> int | None:
+    """
+    Convert strings like "500K", "2M", "1.5M", "3G" to bytes/sec.
+    Returns None if empty/invalid.
+    """
+    s = s.strip()
+    if not s:
+        return None
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMG])?B?", s, re.IGNORECASE)
+    if not m:
+        return None
+    val = float(m.group(1))
+    unit = (m.group(2) or "").upper()
+    mult = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}.get(unit, 1)
+    return int(val * mult)
+
+
+def parse_rate_schedule(s: str) -> list[tuple[int, int, int | None]]:
+    """
+    Parse time-of-day rate windows like "09:00-18:00=1M, 22:00-07:00=unlimited".
+    Returns (start minute, end minute, bytes/sec or None) tuples; a window may wrap
+    past midnight. Invalid entries are ignored.
+    """
+    windows = []
+    for part in re.split(r"[,;]", s):
+        m = re.fullmatch(r"\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(\S*)\s*", part)
+        if not m:
+            continue
+        h1, m1, h2, m2 = (int(g) for g in m.groups()[:4])
+        if h1 > 24 or h2 > 24 or m1 > 59 or m2 > 59:
+            continue
+        rate = m.group(5)
+        if rate.lower() in ("", "0", "unlimited", "none"):
+            limit = None
+        else:
+            limit = parse_rate_limit(rate)
+            if limit is None:
+                continue
+        windows.append(((h1 * 60 + m1) % 1440, (h2 * 60 + m2) % 1440, limit))
+    return windows
+
+
+def bundled_ffmpeg_dir() -> str | None:
+    """
+    If packaged (PyInstaller), returns the directory containing bundled ffmpeg/ffprobe.
+    If running from source, returns None.
+
+    Expected bundled locations:
+      .../YourApp.app/Contents/MacOS/ffmpeg
+      .../YourApp.app/Contents/MacOS/ffprobe
+    """
+    exe_dir = os.path.dirname(sys.executable)  # .../.app/Contents/MacOS
+    ffmpeg_path = os.path.join(exe_dir, "ffmpeg")
+    ffprobe_path = os.path.join(exe_dir, "ffprobe")
+
+    if os.path.exists(ffmpeg_path) and os.access(ffmpeg_path, os.X_OK):
+        # ffprobe is optional, but recommended to bundle as well
+        if os.path.exists(ffprobe_path) and os.access(ffprobe_path, os.X_OK):
+            return exe_dir
+        # still usable with ffmpeg alone:
+        return exe_dir
+
+    return None
+
+
+def best_effort_system_ffmpeg_dir() -> str | None:
+    """
+    Dev fallback: if system ffmpeg exists, return its directory (for yt-dlp 'ffmpeg_location').
+    """
+    sys_ffmpeg = shutil.which("ffmpeg")
+    if not sys_ffmpeg:
+        return None
+    return os.path.dirname(sys_ffmpeg)
+
+
+def default_ffmpeg_dir() -> str | None:
+    """The bundled ffmpeg directory, else the system one, else None."""
+    return bundled_ffmpeg_dir() or best_effort_system_ffmpeg_dir()
+
+
+# "Extract audio" targets: the source codec (see codec_family) FFmpegExtractAudio can
+# stream-copy into the target, and the ffmpeg encoders that can produce it otherwise.
+AUDIO_TARGETS: dict[str, tuple[str | None, tuple[str, ...]]] = {
+    "mp3": ("mp3", ("libmp3lame",)),
+    "m4a": ("aac", ("aac", "libfdk_aac")),
+    "aac": ("aac", ("aac", "libfdk_aac")),
+    "opus": ("opus", ("libopus",)),
+    "vorbis": ("vorbis", ("libvorbis",)),
+    "flac": ("flac", ("flac",)),
+    "alac": ("alac", ("alac",)),
+    "wav": (None, ("pcm_s16le",)),
+}
+
+_ENCODER_LINE = re.compile(r"^\s*A[A-Z.]{5}\s+(\S+)", re.M)
+
+
+@dataclass(frozen=True)
+class FfmpegCaps:
+    """What the ffmpeg in one location can do, as far as audio extraction cares."""
+
+    ffmpeg: str | None = None
+    ffprobe: str | None = None
+    version: str = ""
+    encoders: frozenset[str] = frozenset()   # audio encoders, e.g. "libmp3lame"
+
+    def can_encode(self, target: str) -> bool:
+        _, needed = AUDIO_TARGETS.get(target, (None, ()))
+        return self.ffmpeg is not None and any(e in self.encoders for e in needed)
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_caps(location: str | None) -> FfmpegCaps:
+    """
+    Probe ffmpeg/ffprobe in location (a directory; None searches PATH). Runs ffmpeg
+    once per location and process; later calls are answered from the cache.
+    """
+    def find(name: str) -> str | None:
+        if location is None:
+            return shutil.which(name)
+        path = os.path.join(location, name)
+        return path if os.access(path, os.X_OK) else None
+
+    ffmpeg = find("ffmpeg")
+    if ffmpeg is None:
+        return FfmpegCaps(ffprobe=find("ffprobe"))
+    try:
+        version = subprocess.run([ffmpeg, "-hide_banner", "-version"], capture_output=True,
+                                 text=True, timeout=10).stdout
+        encoders = subprocess.run([ffmpeg, "-hide_banner", "-encoders"], capture_output=True,
+                                  text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return FfmpegCaps(ffprobe=find("ffprobe"))
+    m = re.match(r"ffmpeg version (\S+)", version)
+    return FfmpegCaps(ffmpeg, find("ffprobe"), m.group(1) if m else "",
+                      frozenset(_ENCODER_LINE.findall(encoders.partition(" ------")[2])))
+
+
+def preload_ffmpeg_caps() -> threading.Thread:
+    """Probe the default ffmpeg on a background thread, so later ffmpeg_caps() calls are cached."""
+    t = threading.Thread(target=lambda: ffmpeg_caps(default_ffmpeg_dir()), name="ffmpeg-probe", daemon=True)
+    t.start()
+    return t
+
+
+def app_data_dir(*parts: str) -> str:
+    """
+    Per-user directory for caches and state, created on demand.
+      macOS: ~/Library/Application Support/yt-dlp-gui
+      other: $XDG_DATA_HOME/yt-dlp-gui (default ~/.local/share)
+    """
+    if sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    path = os.path.join(base, "yt-dlp-gui", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# Query parameters that only track where a link was shared from.
+TRACKING_PARAMS = {"fbclid", "gclid", "si", "feature", "pp", "ab_channel"}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of a URL for cache keys and dedupe: lowercase scheme/host,
+    no fragment, no tracking parameters, sorted query.
+    """
+    # Hand-rolled rather than urlsplit/parse_qsl: this runs for every pasted URL, and
+    # keeping the query's original encoding is fine for a comparison key.
+    url = url.strip()
+    scheme, sep, rest = url.partition("://")
+    if not sep or not scheme.isalpha():
+        return url
+    rest = rest.partition("#")[0]
+    rest, _, query = rest.partition("?")
+    host, _, path = rest.partition("/")
+    if not host:
+        return url
+    key = f"{scheme.lower()}://{host.lower()}/{path}"
+    if query:
+        params = sorted(
+            p for p in query.split("&")
+            if p and (name := p.partition("=")[0]) not in TRACKING_PARAMS and not name.startswith("utm_")
+        )
+        if params:
+            key += "?" + "&".join(params)
+    return key
+
+
+def url_host(url: str) -> str:
+    """Lowercase host of url without a leading "www.", for per-site limits."""
+    host = url.strip().partition("://")[2].partition("/")[0].partition("?")[0]
+    host = host.rpartition("@")[2].partition(":")[0].lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+# -----------------------------
+# Signals / Models
+# -----------------------------
+class EventHook:
+    """Minimal stand-in for a Qt signal: emit() calls every connected callback."""
+
+    def __init__(self):
+        self._callbacks: list = []
+
+    def connect(self, callback):
+        self._callbacks.append(callback)
+
+    def emit(self, *args):
+        for callback in self._callbacks:
+            callback(*args)
+
+
+class CoreSignals:
+    """
+    Events the engine reports while it works. The GUI passes its Qt WorkerSignals,
+    which has the same attribute names; headless callers use this plain version.
+    """
+
+    def __init__(self):
+        self.log = EventHook()            # str
+        self.formats_ready = EventHook()  # list of (format_id, display)
+        self.item_started = EventHook()   # url
+        self.item_done = EventHook()      # url
+        self.item_state = EventHook()     # item id, ItemState value
+        self.items_added = EventHook()    # parent item id, list[DownloadItem]
+        self.item_estimated = EventHook() # item id, estimated bytes or None
+        self.error = EventHook()          # str
+        self.finished = EventHook()
+
+
+class ItemState:
+    PENDING = "pending"
+    EXTRACTING = "extracting"
+    DOWNLOADING = "downloading"
+    POSTPROCESSING = "post-processing"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELED = "canceled"
+
+    ACTIVE = (EXTRACTING, DOWNLOADING, POSTPROCESSING)
+
+
+class CancelToken:
+    """
+    Cancellation for one item or, as the parent of its items' tokens, a whole queue.
+
+    Work polls `canceled` at its safe points: HTTP requests (see YdlSessionPool),
+    playlist entries, downloaded chunks and postprocessor steps. Work that cannot
+    poll, such as an ffmpeg child process, registers an on_cancel() callback that
+    kills it. Callbacks run once, on the canceling thread; canceling a parent does
+    not run its children's callbacks (DownloadScheduler.cancel_all cancels those).
+    """
+
+    def __init__(self, parent: "CancelToken | None" = None):
+        self.parent = parent
+        self._at: float | None = None
+        self._callbacks: list = []
+        self._lock = threading.Lock()
+
+    @property
+    def canceled(self) -> bool:
+        return self.canceled_at is not None
+
+    @property
+    def canceled_at(self) -> float | None:
+        """time.time() of the cancel request (this token's or its parent's), else None."""
+        if self._at is not None or self.parent is None:
+            return self._at
+        return self.parent.canceled_at
+
+    def cancel(self):
+        with self._lock:
+            if self._at is not None:
+                return
+            self._at = time.time()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback):
+        """Call callback() on cancel(); immediately if this token is already canceled."""
+        with self._lock:
+            if self._at is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def check(self):
+        if self.canceled:
+            raise ytdlp().utils.DownloadError("Canceled by user")
+
+
+_item_ids = itertools.count(1)
+
+
+def reserve_item_ids(above: int):
+    """Make new DownloadItem ids start after `above` (e.g. ids restored from the journal)."""
+    global _item_ids
+    _item_ids = itertools.count(above + 1)
+
+
+@dataclass
+class DownloadItem:
+    url: str
+    id: int = field(default_factory=lambda: next(_item_ids))
+    state: str = ItemState.PENDING
+    progress: float = 0.0
+    speed: float | None = None
+    token: CancelToken = field(default_factory=CancelToken, repr=False, compare=False)
+    title: str = ""
+    # Set on items produced by playlist expansion:
+    parent_id: int | None = None
+    ie_key: str | None = None
+    extra_info: dict | None = None   # playlist fields for the output template
+    info: dict | None = None         # full entry, when the playlist already provided one
+    children: int = 0                # number of entries, once expanded
+    priority: int = 0                # runs earlier (see JobQueue); each step up doubles its bandwidth share
+    size: int | None = None          # estimated bytes to download (see YtDlpRunner.estimate_size)
+    audio: str = ""                  # "copy" or "re-encode" once audio extraction knows
+    attempts: int = 0                # failed tries so far (see RetryPolicy)
+    error: str = ""                  # last failure
+    opts: dict | None = None         # yt-dlp options of its own (a daemon job's profile), else the queue's
+
+
+# -----------------------------
+# Info-extraction cache
+# -----------------------------
+# Extracted info is only useful while its stream URLs are valid. YouTube signs them
+# for ~6h, many other sites for much less, so default to a short TTL and shorten it
+# further when the format URLs carry an explicit expiry.
+DEFAULT_INFO_TTL = 30 * 60
+EXPIRY_MARGIN = 120
+
+_EXPIRE_RE = re.compile(r"[?&/]expires?[=/](\d{10})\b")
+
+
+def info_expiry(info: dict, ttl: float, now: float) -> float:
+    expires = now + ttl
+    for f in (info.get("formats") or []):
+        m = _EXPIRE_RE.search(f.get("url") or "")
+        if m:
+            expires = min(expires, int(m.group(1)) - EXPIRY_MARGIN)
+    return expires
+
+
+class InfoCache:
+    """
+    Thread-safe cache of raw (unprocessed) info dicts, keyed by normalized URL.
+
+    Entries live in a bounded in-memory LRU and, if disk_dir is given, in one JSON
+    file per URL so a restart can still skip extraction. Only single-video results
+    are cached; playlists and live streams are always extracted fresh.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = DEFAULT_INFO_TTL,
+                 disk_dir: str | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._mem: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            # Reads every entry; keep it off the startup path.
+            threading.Thread(target=self.prune_disk, name="info-cache-prune", daemon=True).start()
+
+    @staticmethod
+    def cacheable(info: dict | None) -> bool:
+        return bool(info) and info.get("_type", "video") == "video" and not info.get("is_live")
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def get(self, url: str) -> dict | None:
+        """Return a private copy of the cached info for url, or None if missing/stale."""
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry and entry[0] > now:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            if entry:
+                del self._mem[key]
+
+        info = self._read_disk(key, now)
+        with self._lock:
+            if info is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, info[0], info[1])
+        return copy.deepcopy(info[1])
+
+    def put(self, url: str, info: dict):
+        if not self.cacheable(info):
+            return
+        key = normalize_url(url)
+        now = time.time()
+        expires = info_expiry(info, self.ttl, now)
+        if expires <= now:
+            return
+        info = ytdlp().YoutubeDL.sanitize_info(info)
+        with self._lock:
+            self._remember(key, expires, info)
+        self._write_disk(key, expires, info)
+
+    def invalidate(self, url: str):
+        key = normalize_url(url)
+        with self._lock:
+            self._mem.pop(key, None)
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def _remember(self, key: str, expires: float, info: dict):
+        self._mem[key] = (expires, info)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def _read_disk(self, key: str, now: float) -> tuple[float, dict] | None:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != key or data.get("expires", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return data["expires"], data["info"]
+
+    def _write_disk(self, key: str, expires: float, info: dict):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "expires": expires, "info": info}, f)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def prune_disk(self):
+        """Delete expired on-disk entries."""
+        now = time.time()
+        try:
+            names = os.listdir(self.disk_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".json"):
+                path = os.path.join(self.disk_dir, name)
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        expired = json.load(f).get("expires", 0) <= now
+                except (OSError, ValueError):
+                    expired = True
+                if expired:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._mem),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+
+# -----------------------------
+# Queue journal
+# -----------------------------
+class QueueJournal:
+    """
+    Crash-safe record of the queue in a local SQLite database (WAL mode).
+
+    Callers only enqueue operations; a background thread applies them in batches,
+    one transaction per batch, keeping just the latest state per item. Hundreds of
+    state changes per second therefore cost the UI thread nothing but a queue put.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS items (
+            id          INTEGER PRIMARY KEY,
+            url         TEXT NOT NULL,
+            parent_id   INTEGER,
+            title       TEXT NOT NULL DEFAULT '',
+            ie_key      TEXT,
+            extra_info  TEXT,
+            state       TEXT NOT NULL,
+            children    INTEGER NOT NULL DEFAULT 0,
+            updated_at  REAL NOT NULL,
+            priority    INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS items_state ON items (state);
+    """
+    # Columns added since the first schema, for journals written by older versions.
+    MIGRATIONS = (("priority", "ALTER TABLE items ADD COLUMN priority INTEGER NOT NULL DEFAULT 0"),)
+    COLUMNS = "id, url, parent_id, title, ie_key, extra_info, state, children, priority"
+    BATCH = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._ops: queue_mod.SimpleQueue = queue_mod.SimpleQueue()
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        have = {row[1] for row in conn.execute("PRAGMA table_info(items)")}
+        with conn:
+            for column, sql in self.MIGRATIONS:
+                if column not in have:
+                    conn.execute(sql)
+        conn.close()
+        self._thread = threading.Thread(target=self._writer, name="queue-journal", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- producers (any thread)
+    def add(self, items: list[DownloadItem]):
+        if items:
+            self._ops.put(("upsert", [self._row(it) for it in items]))
+
+    def update(self, item: DownloadItem):
+        self._ops.put(("upsert", [self._row(item)]))
+
+    def remove(self, items: list[DownloadItem]):
+        if items:
+            self._ops.put(("delete", [it.id for it in items]))
+
+    def clear(self):
+        self._ops.put(("clear", None))
+
+    def close(self):
+        self._ops.put(("stop", None))
+        self._thread.join(timeout=10)
+
+    @staticmethod
+    def _row(item: DownloadItem) -> tuple:
+        extra = json.dumps(item.extra_info) if item.extra_info else None
+        return (item.id, item.url, item.parent_id, item.title, item.ie_key, extra,
+                item.state, item.children, time.time(), item.priority)
+
+    # --- writer thread
+    def _writer(self):
+        conn = self._connect()
+        stop = False
+        while not stop:
+            ops = [self._ops.get()]
+            while len(ops) < self.BATCH:
+                try:
+                    ops.append(self._ops.get_nowait())
+                except queue_mod.Empty:
+                    break
+            upserts: dict[int, tuple] = {}
+            with conn:
+                for kind, payload in ops:
+                    if kind == "upsert":
+                        for row in payload:
+                            upserts[row[0]] = row
+                    elif kind == "delete":
+                        self._flush(conn, upserts)
+                        conn.executemany("DELETE FROM items WHERE id = ?", [(i,) for i in payload])
+                    elif kind == "clear":
+                        upserts.clear()
+                        conn.execute("DELETE FROM items")
+                    elif kind == "stop":
+                        stop = True
+                self._flush(conn, upserts)
+        conn.close()
+
+    @staticmethod
+    def _flush(conn: sqlite3.Connection, upserts: dict[int, tuple]):
+        if upserts:
+            conn.executemany(
+                "INSERT OR REPLACE INTO items (id, url, parent_id, title, ie_key, extra_info, state, "
+                "children, updated_at, priority) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                list(upserts.values()))
+            upserts.clear()
+
+    # --- startup
+    def load_unfinished(self) -> list[DownloadItem]:
+        """
+        Items that never reached "done" (reset to pending), plus the playlist parents
+        they hang under. Finished items without unfinished entries are pruned.
+        """
+        conn = self._connect()
+        try:
+            rows = {r[0]: r for r in conn.execute(
+                f"SELECT {self.COLUMNS} FROM items WHERE state != ?", (ItemState.DONE,))}
+            missing = {r[2] for r in rows.values() if r[2] is not None and r[2] not in rows}
+            while missing:
+                marks = ",".join("?" * len(missing))
+                found = conn.execute(
+                    f"SELECT {self.COLUMNS} FROM items WHERE id IN ({marks})", list(missing)).fetchall()
+                for r in found:
+                    rows[r[0]] = r
+                missing = {r[2] for r in found if r[2] is not None and r[2] not in rows}
+            with conn:
+                conn.execute("CREATE TEMP TABLE keep (id INTEGER PRIMARY KEY)")
+                conn.executemany("INSERT INTO keep VALUES (?)", [(i,) for i in rows])
+                conn.execute("DELETE FROM items WHERE id NOT IN (SELECT id FROM keep)")
+        finally:
+            conn.close()
+
+        items = []
+        for r in sorted(rows.values()):
+            item_id, url, parent_id, title, ie_key, extra, state, children, priority = r
+            items.append(DownloadItem(
+                url=url, id=item_id, title=title, parent_id=parent_id, ie_key=ie_key,
+                extra_info=json.loads(extra) if extra else None, children=children, priority=priority,
+                state=ItemState.DONE if state == ItemState.DONE else ItemState.PENDING,
+            ))
+        if items:
+            reserve_item_ids(max(it.id for it in items))
+        return items
+
+
+# -----------------------------
+# Bulk URL import
+# -----------------------------
+URL_LIST_KINDS = {".csv": "csv", ".tsv": "tsv", ".json": "json", ".jsonl": "json", ".ndjson": "json"}
+# Column names (CSV header) and object keys (JSON) that hold the URL.
+URL_FIELDS = ("url", "webpage_url", "link", "href")
+
+
+def url_list_kind(path: str) -> str:
+    """"csv", "tsv", "json" or "text", from the file extension."""
+    return URL_LIST_KINDS.get(os.path.splitext(path)[1].lower(), "text")
+
+
+def iter_urls(stream, kind: str = "text"):
+    """
+    URLs from a URL list, lazily.
+
+    text: one per line; blank lines and # comments are skipped.
+    csv/tsv: the column named like URL_FIELDS, else the first cell containing "://".
+    json: an array, or JSON lines; each value a URL string or an object with a URL_FIELDS key.
+    """
+    if kind in ("csv", "tsv"):
+        column = None
+        for row in csv.reader(stream, delimiter="\t" if kind == "tsv" else ","):
+            if column is None:
+                names = [c.strip().lower() for c in row]
+                column = next((names.index(f) for f in URL_FIELDS if f in names), -1)
+                if column >= 0:
+                    continue
+            if column >= 0:
+                cell = row[column] if column < len(row) else ""
+            else:
+                cell = next((c for c in row if "://" in c), "")
+            if cell.strip():
+                yield cell.strip()
+    elif kind == "json":
+        text = stream.read()
+        values = json.loads(text) if text.lstrip().startswith("[") else (
+            json.loads(ln) for ln in text.splitlines() if ln.strip())
+        for v in values:
+            if isinstance(v, dict):
+                v = next((v[f] for f in URL_FIELDS if isinstance(v.get(f), str)), "")
+            if isinstance(v, str) and v.strip():
+                yield v.strip()
+    else:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+class ExtractorMatcher:
+    """
+    Canonical dedupe keys from yt-dlp's extractor matching: youtu.be/ID, watch?v=ID
+    and a share link with tracking parameters all become "youtube ID", the download
+    archive's format. URLs only the generic extractor takes keep normalize_url().
+
+    Trying all ~1800 extractors costs ~6 ms per URL, so the winner is cached per host
+    and URL shape (first path segment with IDs masked, depth, query parameter names).
+    A cached extractor is re-checked with its own suitable() before it is used.
+    """
+
+    def __init__(self):
+        self._classes: list | None = None
+        self._by_shape: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        self.scans = 0
+
+    @staticmethod
+    def _shape(url: str) -> tuple:
+        rest = url.partition("://")[2].partition("#")[0]
+        rest, _, query = rest.partition("?")
+        path = rest.partition("/")[2]
+        seg = path.partition("/")[0]
+        if seg.isdigit():
+            seg = "#"
+        elif len(seg) >= 8 or any(c.isdigit() for c in seg):
+            seg = "@"
+        names = tuple(sorted({p.partition("=")[0] for p in query.split("&") if p}))
+        return url_host(url), seg.lower(), min(path.count("/"), 3), names
+
+    def _extractor(self, url: str):
+        shape = self._shape(url)
+        ie = self._by_shape.get(shape)
+        if ie is not None and ie.suitable(url):
+            return ie
+        with self._lock:
+            if self._classes is None:
+                self._classes = list(ytdlp().extractor.gen_extractor_classes())
+        self.scans += 1
+        ie = next((c for c in self._classes if c.suitable(url)), None)
+        if ie is not None:
+            self._by_shape[shape] = ie
+        return ie
+
+    def key(self, url: str) -> str:
+        if "://" not in url:
+            return url   # e.g. "ytsearch5:..."
+        ie = self._extractor(url)
+        if ie is not None and ie.ie_key() != "Generic":
+            video_id = ie.get_temp_id(url)
+            if video_id:
+                return f"{ie.ie_key().lower()} {video_id}"
+        return normalize_url(url)
+
+
+def read_archive(path: str | None) -> set[str]:
+    """Entries ("extractor id") of a yt-dlp download archive; empty if there is none."""
+    if not path:
+        return set()
+    try:
+        with open(path, encoding="utf-8") as f:
+            return {ln.strip() for ln in f if ln.strip()}
+    except OSError:
+        return set()
+
+
+@dataclass
+class ImportStats:
+    read: int = 0
+    added: int = 0
+    duplicates: int = 0
+    archived: int = 0
+    elapsed: float = 0.0
+
+    def summary(self) -> str:
+        return (f"{self.added} new, {self.duplicates} duplicate(s), "
+                f"{self.archived} already downloaded, in {self.elapsed:.1f}s")
+
+
+class UrlImporter:
+    """
+    Turns a URL list into queue items on the calling (worker) thread.
+
+    Each URL gets an ExtractorMatcher key; URLs whose key is already queued (`known`),
+    in the download archive or earlier in the list are dropped. New items go to
+    on_batch(items) every batch_size items or batch_interval seconds, so the queue
+    fills while a large file is still being read and the UI inserts rows in bulk.
+    """
+
+    def __init__(self, matcher: ExtractorMatcher | None = None, known=(), archive: set[str] | None = None,
+                 batch_size: int = 500, batch_interval: float = 0.5):
+        self.matcher = matcher or ExtractorMatcher()
+        self._seen: set[str] = {self.matcher.key(url) for url in known}
+        self._archive = archive or set()
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+    def run(self, urls, on_batch, token: CancelToken | None = None) -> ImportStats:
+        stats = ImportStats()
+        start = last_flush = time.monotonic()
+        batch: list[DownloadItem] = []
+        for url in urls:
+            if token is not None and token.canceled:
+                break
+            stats.read += 1
+            key = self.matcher.key(url)
+            if key in self._archive:
+                stats.archived += 1
+                continue
+            if key in self._seen:
+                stats.duplicates += 1
+                continue
+            self._seen.add(key)
+            batch.append(DownloadItem(url=url))
+            if len(batch) >= self.batch_size or time.monotonic() - last_flush >= self.batch_interval:
+                stats.added += len(batch)
+                on_batch(batch)
+                batch = []
+                last_flush = time.monotonic()
+        if batch:
+            stats.added += len(batch)
+            on_batch(batch)
+        stats.elapsed = time.monotonic() - start
+        return stats
+
+
+# -----------------------------
+# Progress aggregation
+# -----------------------------
+@dataclass
+class ProgressEvent:
+    item_id: int
+    phase: str                    # ItemState value
+    downloaded: int = 0           # bytes of the current file
+    total: int | None = None      # size of the current file, if known
+    speed: float | None = None
+    filename: str = ""
+
+
+@dataclass
+class QueueStats:
+    active: int
+    bytes_done: int
+    bytes_remaining: int          # known sizes plus an estimate for items not started
+    throughput: float             # moving average, bytes/sec
+    eta: float | None
+    items_per_min: float
+    completed: int
+    changed: set[int]             # item ids with new progress since the last snapshot
+
+
+class ProgressAggregator:
+    """
+    Collects progress events from every worker and turns them into queue-level numbers.
+
+    report() is cheap (a dict update under a lock) and is called straight from yt-dlp's
+    progress hooks. The UI calls snapshot() on a timer; all formatting happens there.
+    """
+
+    EWMA_ALPHA = 0.3
+    RATE_WINDOW = 60.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # item id -> [phase, filename, file bytes, file total, bytes of earlier files, speed]
+        self._items: dict[int, list] = {}
+        self._changed: set[int] = set()
+        self._bytes_seen = 0            # monotonic counter of every byte reported
+        self._done_bytes = 0            # bytes of items that finished
+        self._completed = 0
+        self._completions: deque[float] = deque()
+        self._last_snapshot = (time.monotonic(), 0)
+        self._throughput = 0.0
+
+    def report(self, ev: ProgressEvent):
+        with self._lock:
+            rec = self._items.get(ev.item_id)
+            if rec is None:
+                rec = self._items[ev.item_id] = [ev.phase, ev.filename, 0, None, 0, None]
+            if ev.filename and ev.filename != rec[1]:
+                # Next file of the same item (e.g. separate video and audio streams).
+                rec[4] += rec[2]
+                rec[1], rec[2] = ev.filename, 0
+            self._bytes_seen += max(0, ev.downloaded - rec[2])
+            rec[0] = ev.phase
+            rec[2] = ev.downloaded
+            rec[3] = ev.total
+            rec[5] = ev.speed
+            self._changed.add(ev.item_id)
+
+    def set_phase(self, item_id: int, phase: str):
+        with self._lock:
+            rec = self._items.get(item_id)
+            if phase in (ItemState.DONE, ItemState.FAILED, ItemState.CANCELED):
+                if rec is not None:
+                    del self._items[item_id]
+                    if phase == ItemState.DONE:
+                        self._done_bytes += rec[4] + max(rec[2], rec[3] or 0)
+                if phase == ItemState.DONE:
+                    self._completed += 1
+                    self._completions.append(time.monotonic())
+            elif rec is not None:
+                rec[0] = phase
+            else:
+                self._items[item_id] = [phase, "", 0, None, 0, None]
+            self._changed.add(item_id)
+
+    def item_bytes(self, item_id: int) -> tuple[int, int | None]:
+        with self._lock:
+            rec = self._items.get(item_id)
+            if rec is None:
+                return 0, None
+            return rec[4] + rec[2], (rec[4] + rec[3]) if rec[3] else None
+
+    def snapshot(self, pending_items: int = 0) -> QueueStats:
+        now = time.monotonic()
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            in_flight = sum(rec[4] + rec[2] for rec in self._items.values())
+            known_remaining = sum(max(0, rec[3] - rec[2]) for rec in self._items.values() if rec[3])
+            active = sum(1 for rec in self._items.values() if rec[0] in ItemState.ACTIVE)
+
+            last_t, last_bytes = self._last_snapshot
+            dt = now - last_t
+            if dt > 0:
+                rate = (self._bytes_seen - last_bytes) / dt
+                self._throughput = self.EWMA_ALPHA * rate + (1 - self.EWMA_ALPHA) * self._throughput
+            self._last_snapshot = (now, self._bytes_seen)
+
+            while self._completions and self._completions[0] < now - self.RATE_WINDOW:
+                self._completions.popleft()
+            window = min(self.RATE_WINDOW, max(1.0, now - (self._completions[0] if self._completions else now)))
+            items_per_min = len(self._completions) * 60.0 / window if self._completions else 0.0
+
+            avg_item = self._done_bytes / self._completed if self._completed else 0
+            remaining = known_remaining + int(pending_items * avg_item)
+            throughput = self._throughput
+            return QueueStats(
+                active=active,
+                bytes_done=self._done_bytes + in_flight,
+                bytes_remaining=remaining,
+                throughput=throughput,
+                eta=remaining / throughput if throughput > 1 and remaining else None,
+                items_per_min=items_per_min,
+                completed=self._completed,
+                changed=changed,
+            )
+
+
+def format_queue_stats(st: QueueStats) -> str:
+    return (
+        f"{st.active} active  |  {human_bytes(st.bytes_done)} done, ~{human_bytes(st.bytes_remaining)} left"
+        f"  |  {human_bytes(st.throughput)}/s  |  ETA {human_duration(st.eta)}"
+        f"  |  {st.items_per_min:.1f} items/min"
+    )
+
+
+# -----------------------------
+# Tracing and metrics
+# -----------------------------
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class _Histogram:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self):
+        self.buckets = [0] * (len(PHASE_BUCKETS) + 1)     # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(PHASE_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Tracer:
+    """
+    Per-item phase spans and queue-level histograms.
+
+    Every span goes to a JSON-lines trace (ts, dur, item, phase, attributes) and into
+    a histogram for its phase: extract, extract_cached, expand, format, download,
+    pp_wait, postprocess, move, item (the whole item, labelled with its final
+    state) and cancel (request to CANCELED, labelled with the phase it interrupted).
+    Extraction is labelled with the extractor and post-processing with the
+    postprocessor, so a slow site or ffmpeg step stands out. write_metrics() dumps
+    the histograms and byte/item counters in the Prometheus text format, e.g. for
+    node_exporter's textfile collector.
+    """
+
+    FLUSH_INTERVAL = 5.0
+
+    @classmethod
+    def in_app_data(cls) -> "Tracer":
+        """trace.jsonl and metrics.prom in the app's metrics directory."""
+        d = app_data_dir("metrics")
+        return cls(os.path.join(d, "trace.jsonl"), os.path.join(d, "metrics.prom"))
+
+    def __init__(self, trace_path: str | None = None, metrics_path: str | None = None):
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self._lock = threading.Lock()
+        self._trace = open(trace_path, "a", encoding="utf-8") if trace_path else None
+        self._hist: dict[tuple[str, str, str], _Histogram] = {}   # (phase, label, value)
+        self._items: dict[str, int] = {}                          # final state -> count
+        self._bytes = 0
+        self._started: dict[int, float] = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, item_id: int | None, phase: str, start: float, end: float,
+               label: tuple[str, str] = ("", ""), **attrs):
+        """Add a finished span; start and end are time.time() values."""
+        dur = max(0.0, end - start)
+        line = None
+        if self._trace is not None:
+            span = {"ts": round(start, 3), "dur": round(dur, 4), "item": item_id, "phase": phase}
+            if label[0]:
+                span[label[0]] = label[1]
+            line = json.dumps({**span, **attrs}, default=str)
+        with self._lock:
+            key = (phase, *label)
+            hist = self._hist.get(key)
+            if hist is None:
+                hist = self._hist[key] = _Histogram()
+            hist.observe(dur)
+            if line is not None:
+                self._trace.write(line + "\n")
+            due = time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    @contextmanager
+    def span(self, item_id: int | None, phase: str, label: tuple[str, str] = ("", ""), **attrs):
+        """Time a block; the yielded dict takes extra attributes."""
+        start = time.time()
+        try:
+            yield attrs
+        finally:
+            self.record(item_id, phase, start, time.time(), label, **attrs)
+
+    def add_bytes(self, n: int):
+        with self._lock:
+            self._bytes += n
+
+    def item_state(self, item: DownloadItem, state: str):
+        """Called on every state change; closes the item's span when it settles."""
+        if state == ItemState.EXTRACTING:
+            self._started.setdefault(item.id, time.time())
+        elif state in (ItemState.DONE, ItemState.FAILED, ItemState.CANCELED):
+            start = self._started.pop(item.id, None)
+            with self._lock:
+                self._items[state] = self._items.get(state, 0) + 1
+            if start is not None:
+                self.record(item.id, "item", start, time.time(), ("state", state), url=item.url)
+
+    def metrics_text(self) -> str:
+        lines = [
+            "# HELP ytdlp_gui_phase_seconds Time spent per download phase.",
+            "# TYPE ytdlp_gui_phase_seconds histogram",
+        ]
+        with self._lock:
+            hists = sorted(self._hist.items())
+            items = sorted(self._items.items())
+            nbytes = self._bytes
+        for (phase, name, value), h in hists:
+            labels = f'phase="{_label(phase)}"' + (f',{name}="{_label(value)}"' if name else "")
+            total = 0
+            for bound, n in zip((*PHASE_BUCKETS, "+Inf"), h.buckets):
+                total += n
+                lines.append(f'ytdlp_gui_phase_seconds_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f"ytdlp_gui_phase_seconds_sum{{{labels}}} {h.sum:.6f}")
+            lines.append(f"ytdlp_gui_phase_seconds_count{{{labels}}} {h.count}")
+        lines += [
+            "# HELP ytdlp_gui_downloaded_bytes_total Bytes downloaded.",
+            "# TYPE ytdlp_gui_downloaded_bytes_total counter",
+            f"ytdlp_gui_downloaded_bytes_total {nbytes}",
+            "# HELP ytdlp_gui_items_total Items finished, by final state.",
+            "# TYPE ytdlp_gui_items_total counter",
+        ]
+        lines += [f'ytdlp_gui_items_total{{state="{state}"}} {n}' for state, n in items]
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        if not self.metrics_path:
+            return
+        tmp = self.metrics_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.metrics_text())
+        os.replace(tmp, self.metrics_path)
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if self._trace is not None:
+                self._trace.flush()
+        try:
+            self.write_metrics()
+        except OSError:
+            pass
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+
+# -----------------------------
+# Bandwidth budget
+# -----------------------------
+class _Stream:
+    __slots__ = ("weight", "share", "tokens", "stamp", "started", "window_bytes", "window_start",
+                 "measured", "last_bytes", "last_file")
+
+    def __init__(self, weight: float, now: float):
+        self.weight = weight
+        self.share: float | None = None     # bytes/sec this stream may use; None = unlimited
+        self.tokens = 0.0
+        self.stamp = now
+        self.started = now
+        self.window_bytes = 0
+        self.window_start = now
+        self.measured = 0.0                 # bytes/sec over the last rebalance window
+        self.last_bytes = 0
+        self.last_file = ""
+
+
+class BandwidthLimiter:
+    """
+    One bandwidth budget for the whole process, however many downloads are running.
+
+    Each stream (a queue item being downloaded) gets a share of the current rate in
+    proportion to its weight, and is held to it by a token bucket: after every chunk
+    yt-dlp reports, the progress hook sleeps until the stream is back inside its share.
+    Shares are recomputed every REBALANCE seconds and are work-conserving: a stream the
+    server feeds more slowly than its share keeps what it uses (plus headroom) and the
+    rest is split among the others.
+
+    The rate is the configured limit, or that of the schedule window covering the
+    current local time. None means unlimited.
+    """
+
+    BURST = 0.5            # seconds of unused share a stream may bank
+    REBALANCE = 1.0
+    HEADROOM = 1.25
+    WARMUP = 2.0           # new streams count as hungry until they have a measured rate
+    MIN_SHARE = 16 * 1024
+
+    def __init__(self, rate: int | None = None, schedule: list[tuple[int, int, int | None]] | None = None):
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._schedule = list(schedule or [])
+        self._streams: dict[int, _Stream] = {}
+        self._next_rebalance = 0.0
+
+    def configure(self, rate: int | None, schedule: list[tuple[int, int, int | None]] | None = None):
+        """Change the budget; running downloads pick it up within a second."""
+        with self._lock:
+            self._rate = rate
+            self._schedule = list(schedule or [])
+            self._next_rebalance = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._rate is not None or bool(self._schedule)
+
+    def current_rate(self, when: float | None = None) -> int | None:
+        t = time.localtime(when)
+        minute = t.tm_hour * 60 + t.tm_min
+        for start, end, rate in self._schedule:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return rate
+        return self._rate
+
+    def open(self, key: int, weight: float = 1.0):
+        with self._lock:
+            self._streams[key] = _Stream(weight, time.monotonic())
+            self._next_rebalance = 0.0
+
+    def close(self, key: int):
+        with self._lock:
+            if self._streams.pop(key, None) is not None:
+                self._next_rebalance = 0.0
+
+    def consume(self, key: int, downloaded: int, filename: str = ""):
+        """
+        Account for a progress report (cumulative bytes of the current file) and sleep
+        if the stream is over its share. Safe to call from several threads per stream
+        (concurrent fragment downloads).
+        """
+        now = time.monotonic()
+        with self._lock:
+            st = self._streams.get(key)
+            if st is None:
+                return
+            if filename != st.last_file:
+                st.last_file, st.last_bytes = filename, 0
+            nbytes = downloaded - st.last_bytes
+            if nbytes <= 0:
+                return
+            st.last_bytes = downloaded
+            st.window_bytes += nbytes
+            if now >= self._next_rebalance:
+                self._rebalance(now)
+            if st.share is None:
+                return
+            st.tokens = min(st.share * self.BURST, st.tokens + (now - st.stamp) * st.share) - nbytes
+            st.stamp = now
+            delay = -st.tokens / st.share if st.tokens < 0 else 0.0
+        if delay:
+            # Capped so cancellation stays responsive; the debt carries over to the next chunk.
+            time.sleep(min(delay, 1.0))
+
+    def _rebalance(self, now: float):
+        self._next_rebalance = now + self.REBALANCE
+        for st in self._streams.values():
+            dt = now - st.window_start
+            if dt > 0:
+                st.measured = st.window_bytes / dt
+            st.window_bytes, st.window_start = 0, now
+
+        rate = self.current_rate()
+        if rate is None:
+            for st in self._streams.values():
+                st.share = None
+            return
+
+        remaining = float(rate)
+        hungry = list(self._streams.values())
+        while hungry:
+            total_weight = sum(st.weight for st in hungry)
+            capped = [
+                st for st in hungry
+                if now - st.started >= self.WARMUP
+                and st.measured * self.HEADROOM < remaining * st.weight / total_weight
+            ]
+            if not capped:
+                for st in hungry:
+                    self._set_share(st, max(self.MIN_SHARE, remaining * st.weight / total_weight), now)
+                break
+            for st in capped:
+                self._set_share(st, max(self.MIN_SHARE, st.measured * self.HEADROOM), now)
+                remaining = max(0.0, remaining - st.share)
+                hungry.remove(st)
+
+    @staticmethod
+    def _set_share(st: _Stream, share: float, now: float):
+        if st.share is None:
+            st.tokens, st.stamp = 0.0, now
+        st.share = share
+
+
+# -----------------------------
+# Fragment download tuning
+# -----------------------------
+class FragmentLease:
+    """The settings one download runs with, and what its progress hooks measured."""
+
+    def __init__(self, host: str, concurrency: int, chunk_size: int):
+        self.host = host
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._bytes: dict[str, int] = {}        # filename -> bytes so far
+        self._fragments: dict[str, int] = {}    # filename -> fragments done
+        self.first: float | None = None
+        self.last: float | None = None
+
+    def params(self) -> dict:
+        """Per-lease yt-dlp params (see YdlSessionPool.lease)."""
+        return {"concurrent_fragment_downloads": self.concurrency,
+                "http_chunk_size": self.chunk_size or None}
+
+    def observe(self, d: dict):
+        """Progress hook."""
+        if d.get("status") not in ("downloading", "finished"):
+            return
+        now = time.monotonic()
+        name = d.get("filename") or ""
+        with self._lock:
+            if self.first is None:
+                self.first = now
+            self.last = now
+            self._bytes[name] = max(self._bytes.get(name, 0), d.get("downloaded_bytes") or 0)
+            if d.get("fragment_count"):
+                self._fragments[name] = max(self._fragments.get(name, 0), d.get("fragment_index") or 0)
+
+    @property
+    def fragmented(self) -> bool:
+        return bool(self._fragments)
+
+    @property
+    def fragments(self) -> int:
+        return sum(self._fragments.values())
+
+    @property
+    def downloaded(self) -> int:
+        return sum(self._bytes.values())
+
+    @property
+    def elapsed(self) -> float:
+        return (self.last - self.first) if self.first is not None else 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.downloaded / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def fragment_time(self) -> float | None:
+        """Average wall time one fragment took (latency plus transfer)."""
+        return self.elapsed * self.concurrency / self.fragments if self.fragments else None
+
+
+class _HostTuning:
+    __slots__ = ("concurrency", "chunk_size", "fragmented", "growing", "best_concurrency",
+                 "best_throughput", "stable")
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.chunk_size = 0
+        self.fragmented: bool | None = None     # unknown until a download from the site ran
+        self.growing = True                     # doubling until the first step without gain
+        self.best_concurrency = concurrency
+        self.best_throughput = 0.0
+        self.stable = 0
+
+
+class FragmentTuner:
+    """
+    Chooses concurrent_fragment_downloads (HLS/DASH) and http_chunk_size (plain HTTP)
+    per site, and refines them from what each finished download measured.
+
+    Fragment concurrency is a hill climb: it doubles while throughput keeps improving by
+    GAIN, then moves one step at a time, returns to the best setting when a step brings
+    nothing, halves after a failed fragmented download, and probes one step up again
+    after PROBE_AFTER stable downloads. All downloads together stay within `budget`
+    connections: a download gets what is left of it, and waits for a connection when
+    none is. Chunks are sized to take about CHUNK_SECONDS at the measured rate.
+
+    yt-dlp reads these settings when a file starts, so they change between downloads,
+    not during one.
+    """
+
+    START = 2
+    MAX_CONCURRENCY = 16
+    GAIN = 1.1
+    PROBE_AFTER = 5
+    MIN_SAMPLE = 1024 * 1024
+    CHUNK_SECONDS = 4.0
+    MIN_CHUNK = 1024 * 1024
+    MAX_CHUNK = 64 * 1024 * 1024
+
+    def __init__(self, budget: int = 16):
+        self.budget = max(1, budget)
+        self._lock = threading.Lock()
+        self._freed = threading.Condition(self._lock)
+        self._hosts: dict[str, _HostTuning] = {}
+        self._in_use = 0
+
+    def acquire(self, host: str, token: CancelToken | None = None) -> FragmentLease | None:
+        """
+        Settings for a download from host, once a connection of the budget is free.
+        Returns None if token is canceled while waiting; the download then stops itself.
+        """
+        with self._lock:
+            while self._in_use >= self.budget:
+                if token is not None and token.canceled:
+                    return None
+                self._freed.wait(0.2)
+            st = self._hosts.setdefault(host, _HostTuning(self.START))
+            want = 1 if st.fragmented is False else st.concurrency
+            concurrency = min(want, self.budget - self._in_use)
+            self._in_use += concurrency
+            return FragmentLease(host, concurrency, st.chunk_size)
+
+    def release(self, lease: FragmentLease, ok: bool) -> str:
+        """Learn from a finished download; returns a log line describing it."""
+        with self._lock:
+            self._in_use -= lease.concurrency
+            self._freed.notify_all()
+            st = self._hosts[lease.host]
+            if lease.downloaded and lease.fragmented:
+                st.fragmented = True
+                self._tune_concurrency(st, lease, ok)
+            elif lease.downloaded:
+                st.fragmented = False
+                if ok and lease.downloaded >= self.MIN_SAMPLE:
+                    st.chunk_size = self._chunk_for(lease.throughput)
+            next_concurrency, next_chunk = st.concurrency, st.chunk_size
+
+        rate = f"{human_bytes(lease.throughput)}/s"
+        if lease.fragmented:
+            ft = lease.fragment_time
+            per_frag = f", {ft * 1000:.0f} ms/fragment" if ft is not None else ""
+            return (f"Fragments ({lease.host}): {lease.concurrency} in parallel, {lease.fragments} done, "
+                    f"{rate}{per_frag}; next: {next_concurrency}\n")
+        chunk = human_bytes(lease.chunk_size) if lease.chunk_size else "none"
+        nxt = human_bytes(next_chunk) if next_chunk else "none"
+        return f"Chunks ({lease.host}): {chunk}, {rate}; next: {nxt}\n"
+
+    def _tune_concurrency(self, st: _HostTuning, lease: FragmentLease, ok: bool):
+        c = lease.concurrency
+        if not ok:
+            st.concurrency = max(1, c // 2)
+            st.best_concurrency = min(st.best_concurrency, st.concurrency)
+            st.growing = False
+            st.stable = 0
+            return
+        if c != st.concurrency or lease.downloaded < self.MIN_SAMPLE:
+            return  # capped by the budget, or too short to say anything
+        thr = lease.throughput
+        if thr >= st.best_throughput * self.GAIN:
+            st.best_concurrency, st.best_throughput = c, thr
+            st.concurrency = min(self.MAX_CONCURRENCY, c * 2 if st.growing else c + 1)
+            st.stable = 0
+        elif c != st.best_concurrency:
+            # More connections bought nothing: go back.
+            st.concurrency = st.best_concurrency
+            st.growing = False
+            st.stable = 0
+        else:
+            st.best_throughput = 0.5 * st.best_throughput + 0.5 * thr
+            st.growing = False
+            st.stable += 1
+            if st.stable >= self.PROBE_AFTER and c < self.MAX_CONCURRENCY:
+                st.concurrency = c + 1
+                st.stable = 0
+
+    def _chunk_for(self, throughput: float) -> int:
+        target = max(self.MIN_CHUNK, min(self.MAX_CHUNK, throughput * self.CHUNK_SECONDS))
+        size = self.MIN_CHUNK
+        while size * 2 <= target:
+            size *= 2
+        return size
+
+
+# -----------------------------
+# YoutubeDL session pool
+# -----------------------------
+# Options that are per call rather than per session; never part of the session key.
+SESSION_VOLATILE_KEYS = ("progress_hooks", "postprocessor_hooks", "post_process_hooks", "lease_params",
+                         "cancel_token", "format_rule", "defer_download_archive")
+
+
+def opts_key(opts: dict) -> str:
+    stable = {k: v for k, v in opts.items() if k not in SESSION_VOLATILE_KEYS}
+    return hashlib.sha1(json.dumps(stable, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+def _handoff_pp(session: "YdlSession"):
+    """
+    A 'post_process' postprocessor that passes the finished download's info to the
+    lease holder's post_process_hooks (see PostProcessPool). A no-op without hooks.
+    """
+    class HandoffPP(ytdlp().postprocessor.PostProcessor):
+        def run(self, info):
+            for hook in session.post_process_hooks:
+                hook(info)
+            return [], info
+
+    return HandoffPP(session.ydl)
+
+
+def _cancellable_urlopen(urlopen, token: CancelToken):
+    """
+    ydl.urlopen that checks token before and after each request. Extractors and
+    downloaders fetch everything through it, so a slow extraction or playlist
+    enumeration stops at its next request instead of running to the end.
+    """
+    def open_checked(req):
+        token.check()
+        resp = urlopen(req)
+        if token.canceled:
+            resp.close()
+            token.check()
+        return resp
+
+    return open_checked
+
+
+# The cancel token of the lease running on this thread, for _CancellablePopen.
+_lease_token = threading.local()
+_ffmpeg_popen_lock = threading.Lock()
+
+
+def _cancellable_ffmpeg():
+    """
+    Make ffmpeg runs of inline postprocessors (FFmpegMerger above all) killable.
+
+    They block in Popen.run() without a hook to poll, so yt_dlp.postprocessor.ffmpeg
+    gets a Popen whose processes are killed when the token of the lease that started
+    them is canceled; the postprocessor then fails and the item settles as canceled.
+    """
+    module = ytdlp().postprocessor.ffmpeg
+    with _ffmpeg_popen_lock:
+        if getattr(module.Popen, "cancellable", False):
+            return
+
+        class _CancellablePopen(module.Popen):
+            cancellable = True
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                token = getattr(_lease_token, "token", None)
+                if token is not None:
+                    token.on_cancel(self.kill)
+
+        module.Popen = _CancellablePopen
+
+
+class YdlSession:
+    """
+    A warm YoutubeDL (cookies loaded, extractors initialized, HTTP connections open)
+    plus the hooks of whoever currently holds the lease.
+    """
+
+    def __init__(self, key: str, opts: dict):
+        self.key = key
+        self.progress_hooks: list = []
+        self.postprocessor_hooks: list = []
+        self.post_process_hooks: list = []
+        self.last_used = time.monotonic()
+        self.ydl = ytdlp().YoutubeDL({k: v for k, v in opts.items() if k not in SESSION_VOLATILE_KEYS})
+        self.ydl.add_progress_hook(self._on_progress)
+        self.ydl.add_postprocessor_hook(self._on_postprocess)
+        self.ydl.add_post_processor(_handoff_pp(self), when="post_process")
+
+    def _on_progress(self, d):
+        for hook in self.progress_hooks:
+            hook(d)
+
+    def _on_postprocess(self, d):
+        for hook in self.postprocessor_hooks:
+            hook(d)
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception:
+            pass
+
+
+class YdlSessionPool:
+    """
+    Reuses YoutubeDL instances across queue items that share the same options.
+
+    A session is leased to one thread at a time (YoutubeDL is not thread-safe), so
+    N workers end up with N warm sessions per option set. opts["lease_params"] are
+    applied to the session's params for the lease only (yt-dlp's downloaders read
+    ydl.params when a file starts), so per-item settings do not split the pool. The
+    holder may also swap ydl.format_selector; it is restored on release. With
+    opts["cancel_token"], every HTTP request of the lease fails and its ffmpeg runs
+    are killed once the token is canceled. opts["defer_download_archive"] leaves the
+    download archive to whoever finishes the files (PostProcessPool). Idle sessions
+    are closed after idle_timeout seconds, when more than max_idle are parked, or by
+    evict().
+    """
+
+    def __init__(self, idle_timeout: float = 300.0, max_idle: int = 8):
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self._idle: list[YdlSession] = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    @contextmanager
+    def lease(self, opts: dict):
+        key = opts_key(opts)
+        session = self._acquire(key, opts)
+        session.progress_hooks = list(opts.get("progress_hooks") or [])
+        session.postprocessor_hooks = list(opts.get("postprocessor_hooks") or [])
+        session.post_process_hooks = list(opts.get("post_process_hooks") or [])
+        overrides = opts.get("lease_params") or {}
+        saved = {k: session.ydl.params[k] for k in overrides if k in session.ydl.params}
+        session.ydl.params.update(overrides)
+        format_selector = session.ydl.format_selector
+        token = opts.get("cancel_token")
+        if token is not None:
+            session.ydl.urlopen = _cancellable_urlopen(session.ydl.urlopen, token)
+            _cancellable_ffmpeg()
+        if opts.get("defer_download_archive"):
+            session.ydl.record_download_archive = lambda info: None
+        outer_token = getattr(_lease_token, "token", None)
+        _lease_token.token = token
+        reusable = False
+        try:
+            yield session.ydl
+            reusable = True
+        except ytdlp().utils.DownloadError:
+            # Ordinary per-URL failure; the instance itself is still fine.
+            reusable = True
+            raise
+        finally:
+            session.progress_hooks = []
+            session.postprocessor_hooks = []
+            session.post_process_hooks = []
+            session.ydl.format_selector = format_selector
+            session.ydl.__dict__.pop("urlopen", None)
+            session.ydl.__dict__.pop("record_download_archive", None)
+            _lease_token.token = outer_token
+            for k in overrides:
+                if k in saved:
+                    session.ydl.params[k] = saved[k]
+                else:
+                    session.ydl.params.pop(k, None)
+            if reusable:
+                self._release(session)
+            else:
+                session.close()
+
+    def _acquire(self, key: str, opts: dict) -> YdlSession:
+        with self._lock:
+            expired = self._take_expired()
+            session = None
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i].key == key:
+                    session = self._idle.pop(i)
+                    self.reused += 1
+                    break
+            else:
+                self.created += 1
+        for old in expired:
+            old.close()
+        # Building a YoutubeDL loads cookies and extractor classes; keep it outside the lock.
+        return session or YdlSession(key, opts)
+
+    def _release(self, session: YdlSession):
+        session.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(session)
+            expired = self._take_expired()
+            while len(self._idle) > self.max_idle:
+                expired.append(self._idle.pop(0))
+        for old in expired:
+            old.close()
+
+    def _take_expired(self) -> list[YdlSession]:
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [s for s in self._idle if s.last_used < cutoff]
+        if expired:
+            self._idle = [s for s in self._idle if s.last_used >= cutoff]
+        return expired
+
+    def evict(self, keep: str | None = None):
+        """Close idle sessions, except those whose key is `keep` (e.g. the current options)."""
+        with self._lock:
+            closing = [s for s in self._idle if s.key != keep]
+            self._idle = [s for s in self._idle if s.key == keep]
+        for s in closing:
+            s.close()
+
+    def close_all(self):
+        self.evict()
+
+
+# -----------------------------
+# Post-processing stage
+# -----------------------------
+def split_post_process(opts: dict) -> tuple[dict, list[dict]]:
+    """
+    Split off the postprocessors that run after the download ('post_process' stage:
+    audio extraction, metadata, thumbnails). Returns (download opts, deferred PPs).
+    """
+    pps = opts.get("postprocessors") or []
+    deferred = [pp for pp in pps if pp.get("when", "post_process") == "post_process"]
+    if not deferred:
+        return opts, []
+    opts = dict(opts)
+    opts["postprocessors"] = [pp for pp in pps if pp not in deferred]
+    return opts, deferred
+
+
+def _post_process_worker(conn):
+    """
+    Child process: run the deferred postprocessors on downloaded files, one at a time,
+    until it is sent None. Each job is (params, info); the answer is (ok, final path or
+    error, [(postprocessor, start, end), ...]). yt-dlp is imported once, and the
+    YoutubeDL (postprocessors and archive loaded) is kept per option set.
+    """
+    if hasattr(os, "setpgrp"):
+        # Own process group, so _kill_tree() takes ffmpeg down with this process.
+        os.setpgrp()
+    timings: list[tuple[str, float, float]] = []
+    started: dict[str, float] = {}
+
+    def timing_hook(d):
+        name = d.get("postprocessor") or "?"
+        if d.get("status") == "started":
+            started[name] = time.time()
+        elif d.get("status") == "finished" and name in started:
+            timings.append((name, started.pop(name), time.time()))
+
+    sessions: dict[str, object] = {}
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break   # parent is gone
+        if job is None:
+            break
+        params, info = job
+        timings.clear()
+        started.clear()
+        try:
+            key = opts_key(params)
+            ydl = sessions.get(key)
+            if ydl is None:
+                if len(sessions) >= 4:
+                    for old in sessions.values():
+                        old.close()
+                    sessions.clear()
+                ydl = sessions[key] = ytdlp().YoutubeDL(params)
+                ydl.add_postprocessor_hook(timing_hook)
+            files_to_move = info.pop("__files_to_move", None)
+            info = ydl.post_process(info["filepath"], info, files_to_move)
+            # Deferred by the download (see YdlSessionPool.lease): a file whose
+            # postprocessors failed or were killed is not "already downloaded".
+            ydl.record_download_archive(info)
+            result = (True, info.get("filepath"), list(timings))
+        except Exception as e:
+            result = (False, str(e) or type(e).__name__, list(timings))
+        try:
+            conn.send(result)
+        except OSError:
+            break
+    for ydl in sessions.values():
+        ydl.close()
+    conn.close()
+
+
+def _kill_tree(proc: multiprocessing.process.BaseProcess):
+    """Kill a worker process and whatever it started (ffmpeg)."""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (AttributeError, OSError):
+        # No process groups (Windows), or the child has not called setpgrp() yet.
+        proc.kill()
+
+
+@dataclass
+class PostProcessJob:
+    item_id: int | None
+    params: dict
+    info: dict
+    on_timing: object = None    # callable(phase, name, start, end), e.g. for Tracer
+    submitted: float = field(default_factory=time.time)
+    future: Future = field(default_factory=Future)
+
+
+class _PostProcessProcess:
+    """Parent side of one post-processing process."""
+
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_post_process_worker, args=(child,), name="yt-dlp-postprocess",
+                                daemon=True)
+        self.proc.start()
+        child.close()
+        self.killed = False
+
+    @property
+    def usable(self) -> bool:
+        return not self.killed and self.proc.is_alive()
+
+    def run(self, params: dict, info: dict) -> tuple:
+        """(ok, final path or error, timings); raises EOFError if the process died."""
+        self.conn.send((params, info))
+        return self.conn.recv()
+
+    def kill(self):
+        self.killed = True
+        _kill_tree(self.proc)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.proc.join(2)
+        if self.proc.is_alive():
+            self.kill()
+            self.proc.join(5)
+        self.conn.close()
+
+
+class PostProcessPool:
+    """
+    Second pipeline stage: runs ffmpeg-bound postprocessors in separate processes so a
+    download worker can start its next item while the previous file is transcoded.
+
+    At most `workers` jobs run at once (default: one per core). submit() blocks while
+    `backlog` downloaded files are already waiting, which holds back the download stage
+    instead of letting unprocessed files pile up on disk. Each worker keeps one process
+    (spawned, never forked from a threaded GUI) with yt-dlp imported, so a small
+    metadata or thumbnail job does not pay for an interpreter start. cancel() and
+    cancel_all() kill a running job's whole process group, ffmpeg included; that
+    worker starts a new process for its next job.
+    """
+
+    def __init__(self, workers: int | None = None, backlog: int | None = None):
+        self.workers = max(1, workers or os.cpu_count() or 2)
+        self.backlog = max(1, backlog or self.workers)
+        self._queue: queue_mod.Queue[PostProcessJob | None] = queue_mod.Queue(maxsize=self.backlog)
+        self._threads: list[threading.Thread] = []
+        self._running: dict[Future, _PostProcessProcess] = {}
+        self._lock = threading.Lock()
+        self._ctx = multiprocessing.get_context("spawn")
+        self.started = 0
+
+    def submit(self, params: dict, info: dict, item_id: int | None = None, on_timing=None,
+               token: CancelToken | None = None) -> Future:
+        """
+        Queue one file; the future resolves to its final path. on_timing(phase, name,
+        start, end) is called for the wait in the backlog and for each postprocessor.
+        Canceling token drops or kills the job, also while submit() is still blocked
+        on a full backlog.
+        """
+        with self._lock:
+            if not self._threads:
+                self._threads = [
+                    threading.Thread(target=self._dispatch, name=f"postprocess-{i}", daemon=True)
+                    for i in range(self.workers)
+                ]
+                for t in self._threads:
+                    t.start()
+        job = PostProcessJob(item_id, params, info, on_timing)
+        if token is None:
+            self._queue.put(job)
+            return job.future
+        while not token.canceled:
+            try:
+                self._queue.put(job, timeout=0.2)
+            except queue_mod.Full:
+                continue
+            token.on_cancel(functools.partial(self.cancel, job.future))
+            return job.future
+        job.future.cancel()
+        return job.future
+
+    def _dispatch(self):
+        worker: _PostProcessProcess | None = None
+        try:
+            while True:
+                job = self._queue.get()
+                try:
+                    if job is None:
+                        return
+                    if job.future.set_running_or_notify_cancel():
+                        if worker is None or not worker.usable:
+                            if worker is not None:
+                                worker.stop()
+                            worker = _PostProcessProcess(self._ctx)
+                            with self._lock:
+                                self.started += 1
+                        self._run(job, worker)
+                except Exception as e:
+                    if job is not None and not job.future.done():
+                        job.future.set_exception(e)
+                finally:
+                    self._queue.task_done()
+        finally:
+            if worker is not None:
+                worker.stop()
+
+    def _run(self, job: PostProcessJob, worker: _PostProcessProcess):
+        if job.on_timing is not None:
+            job.on_timing("pp_wait", "", job.submitted, time.time())
+        with self._lock:
+            self._running[job.future] = worker
+        try:
+            ok, result, timings = worker.run(job.params, job.info)
+        except (EOFError, OSError):
+            # Killed (a cancel) or crashed; the next job gets a new process.
+            worker.proc.join(5)
+            ok, result, timings = False, None, []
+        finally:
+            with self._lock:
+                self._running.pop(job.future, None)
+        if job.on_timing is not None:
+            for name, start, end in timings:
+                job.on_timing("move" if name.startswith("MoveFiles") else "postprocess", name, start, end)
+        if ok:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(ytdlp().utils.PostProcessingError(
+                result or f"Post-processing process exited with code {worker.proc.exitcode}"
+            ))
+
+    def join(self):
+        """Block until every submitted file has been processed."""
+        self._queue.join()
+
+    def cancel(self, future: Future):
+        """Drop one waiting job, or kill it if it is running (its future then fails)."""
+        if future.cancel():
+            return
+        with self._lock:
+            worker = self._running.get(future)
+        if worker is not None:
+            worker.kill()
+
+    def cancel_all(self):
+        """Drop waiting jobs and kill running ones."""
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue_mod.Empty:
+                break
+            if job is not None:
+                job.future.cancel()
+            self._queue.task_done()
+        with self._lock:
+            running = list(self._running.values())
+        for worker in running:
+            worker.kill()
+
+    def close(self):
+        self.cancel_all()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+
+
+# -----------------------------
+# Staging
+# -----------------------------
+# Download leftovers that are not worth moving out of the staging area.
+_LEFTOVER_SUFFIXES = (".part", ".ytdl", ".temp")
+
+
+def output_dir(opts: dict) -> str:
+    """The folder finished files go to, from "paths" or an absolute "outtmpl"."""
+    home = (opts.get("paths") or {}).get("home")
+    if home:
+        return home
+    outtmpl = opts.get("outtmpl")
+    if isinstance(outtmpl, dict):
+        outtmpl = outtmpl.get("default")
+    return os.path.dirname(outtmpl or "") or "."
+
+
+def nearest_existing_dir(path: str) -> str:
+    """path, or its closest ancestor that exists."""
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def estimate_download_size(formats: list[dict]) -> int | None:
+    """Bytes the chosen formats take (filesize, else yt-dlp's filesize_approx), or None if unknown."""
+    total = 0
+    for f in formats:
+        for part in f.get("requested_formats") or [f]:
+            size = part.get("filesize") or part.get("filesize_approx")
+            if not size:
+                return None
+            total += size
+    return int(total)
+
+
+def estimate_info_size(info: dict) -> int | None:
+    """Bytes a processed video info will download: its formats' sizes, else bitrate x duration."""
+    size = estimate_download_size([info])
+    if size is not None:
+        return size
+    tbr = sum(f.get("tbr") or 0 for f in info.get("requested_formats") or [info])
+    if info.get("duration") and tbr:
+        return int(info["duration"] * tbr * 1000 / 8)
+    return None
+
+
+def move_tree(src: str, dest: str) -> list[str]:
+    """
+    Move every file under src to the same relative path under dest, then remove src.
+    Across filesystems a file is copied under a temporary name and renamed, so a
+    half-copied file never shows up under its final name. Returns the new paths.
+    """
+    moved = []
+    for dirpath, _, names in os.walk(src):
+        target_dir = os.path.normpath(os.path.join(dest, os.path.relpath(dirpath, src)))
+        for name in names:
+            if name.endswith(_LEFTOVER_SUFFIXES):
+                continue
+            path, target = os.path.join(dirpath, name), os.path.join(target_dir, name)
+            os.makedirs(target_dir, exist_ok=True)
+            try:
+                os.replace(path, target)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.copy2(path, target + ".moving")
+                os.replace(target + ".moving", target)
+                os.remove(path)
+            moved.append(target)
+    shutil.rmtree(src, ignore_errors=True)
+    return moved
+
+
+def _remove_if_empty(path: str):
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+class DiskBudget:
+    """
+    Free-space check before a download starts. Each item reserves its estimated size
+    on every filesystem it will write to, so parallel downloads do not all count the
+    same free bytes. On the first (download) folder the reservation shrinks as the
+    item writes; on the others it is held until release().
+    """
+
+    def __init__(self, margin: int = 64 * 1024 * 1024):
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._held: dict[object, list[tuple[int, int, bool]]] = {}   # key -> [(st_dev, size, shrinks)]
+        self._written: dict[object, dict[str, int]] = {}
+
+    def reserve(self, key, size: int, *dirs: str) -> str | None:
+        """Reserve size bytes for key in each of dirs; returns why not instead if one is too full."""
+        with self._lock:
+            self._held.pop(key, None)
+            held: list[tuple[int, int, bool]] = []
+            for d in dirs:
+                # yt-dlp creates missing folders (a new home, an outtmpl's "%(uploader)s/")
+                # itself; their free space is that of the nearest folder that exists.
+                existing = nearest_existing_dir(d)
+                dev = os.stat(existing).st_dev
+                if any(h[0] == dev for h in held):
+                    continue
+                free = shutil.disk_usage(existing).free - self._reserved(dev)
+                if free - size < self.margin:
+                    return (f"Not enough free space in {d}: about {human_bytes(size)} needed, "
+                            f"{human_bytes(max(0, free))} available")
+                held.append((dev, size, not held))
+            self._held[key] = held
+            self._written[key] = {}
+            return None
+
+    def _reserved(self, dev: int) -> int:
+        total = 0
+        for key, held in self._held.items():
+            written = sum(self._written.get(key, {}).values())
+            for d, size, shrinks in held:
+                if d == dev:
+                    total += max(0, size - written) if shrinks else size
+        return total
+
+    def consume(self, key, filename: str, downloaded: int):
+        """Progress of key's download of filename (cumulative bytes)."""
+        with self._lock:
+            written = self._written.get(key)
+            if written is not None:
+                written[filename] = downloaded
+
+    def release(self, key):
+        with self._lock:
+            self._held.pop(key, None)
+            self._written.pop(key, None)
+
+
+@dataclass
+class MoveJob:
+    src: str
+    dest: str
+    after: list[Future]
+    on_timing: object = None    # callable(phase, name, start, end), e.g. for Tracer
+    token: CancelToken | None = None
+    future: Future = field(default_factory=Future)
+
+
+class FileMover:
+    """
+    Last pipeline stage with staging on: moves each finished item's staging folder to
+    the output folder on a background thread, once its post-processing futures are
+    done. submit() blocks while `backlog` items are waiting, so downloads stop filling
+    the staging disk when the output drive cannot keep up.
+    """
+
+    def __init__(self, workers: int = 1, backlog: int = 4):
+        self.workers = max(1, workers)
+        self._queue: queue_mod.Queue[MoveJob | None] = queue_mod.Queue(maxsize=max(1, backlog))
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def submit(self, src: str, dest: str, after: list[Future] = (), on_timing=None,
+               token: CancelToken | None = None) -> Future:
+        """
+        Queue src to be moved into dest after the `after` futures; the future resolves
+        to the moved paths. A canceled item's files stay in the staging folder.
+        """
+        with self._lock:
+            if not self._threads:
+                self._threads = [
+                    threading.Thread(target=self._dispatch, name=f"mover-{i}", daemon=True)
+                    for i in range(self.workers)
+                ]
+                for t in self._threads:
+                    t.start()
+        job = MoveJob(src, dest, list(after), on_timing, token)
+        while token is None or not token.canceled:
+            try:
+                self._queue.put(job, timeout=0.2)
+            except queue_mod.Full:
+                continue
+            return job.future
+        job.future.cancel()
+        return job.future
+
+    def _dispatch(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if job.future.set_running_or_notify_cancel():
+                    self._run(job)
+            except Exception as e:
+                if job is not None and not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: MoveJob):
+        wait_futures(job.after)
+        if job.token is not None and job.token.canceled:
+            job.future.set_result([])
+            return
+        start = time.time()
+        moved = move_tree(job.src, job.dest)
+        if job.on_timing is not None:
+            job.on_timing("move", "Staging", start, time.time())
+        job.future.set_result(moved)
+
+    def join(self):
+        """Block until every submitted folder has been moved."""
+        self._queue.join()
+
+    def close(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+
+
+class StagingArea:
+    """
+    Local scratch folder for downloads and post-processing when the output folder is
+    on slow storage (a NAS, an external drive). Each URL gets its own subfolder, so
+    an interrupted download resumes from its .part file there. Finished subfolders go
+    to the output folder through `mover`; ones untouched for max_age are removed.
+    """
+
+    def __init__(self, root: str, mover: FileMover | None = None, max_age: float = 7 * 86400):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.mover = mover if mover is not None else FileMover()
+        cutoff = time.time() - max_age
+        for entry in os.scandir(root):
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def dir_for(self, url: str) -> str:
+        path = os.path.join(self.root, hashlib.sha1(normalize_url(url).encode()).hexdigest()[:16])
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def close(self):
+        self.mover.close()
+
+
+# -----------------------------
+# Format records and rules
+# -----------------------------
+_CODEC_FAMILIES = (
+    ("avc", "h264"), ("h264", "h264"), ("hvc", "h265"), ("hev", "h265"), ("h265", "h265"),
+    ("hevc", "h265"), ("vp09", "vp9"), ("vp9", "vp9"), ("vp8", "vp8"), ("av01", "av1"),
+    ("av1", "av1"), ("mp4a", "aac"), ("aac", "aac"), ("opus", "opus"), ("vorbis", "vorbis"),
+    ("mp3", "mp3"), ("flac", "flac"), ("ac-3", "ac3"), ("ac3", "ac3"), ("ec-3", "eac3"),
+    ("eac3", "eac3"),
+)
+
+
+def codec_family(codec: str | None) -> str:
+    """"avc1.64001F" -> "h264", "mp4a.40.2" -> "aac", "none" -> "none"."""
+    c = (codec or "").lower()
+    for prefix, family in _CODEC_FAMILIES:
+        if c.startswith(prefix):
+            return family
+    return c.partition(".")[0]
+
+
+def audio_format_spec(target: str, caps: FfmpegCaps) -> str:
+    """
+    Format spec for "Extract audio" to target. A stream already in the target codec
+    comes first, so FFmpegExtractAudio copies it instead of re-encoding; any other
+    audio only if this ffmpeg has an encoder for the target.
+    """
+    codec, _ = AUDIO_TARGETS.get(target, (None, ()))
+    if codec is None or caps.ffmpeg is None:
+        return "ba/b"
+    prefixes = [p for p, family in _CODEC_FAMILIES if family == codec] or [codec]
+    match = f"[acodec~='^({'|'.join(re.escape(p) for p in prefixes)})']"
+    if caps.can_encode(target):
+        return f"ba{match}/ba/b{match}/b"
+    return f"ba{match}/b{match}"
+
+
+def audio_conversion(target: str, acodec: str | None) -> str:
+    """What FFmpegExtractAudio does with an acodec source: "copy" or "re-encode"."""
+    codec, _ = AUDIO_TARGETS.get(target, (None, ()))
+    if target == "best" or (codec is not None and codec_family(acodec) == codec):
+        return "copy"
+    return "re-encode"
+
+
+def extract_audio_target(opts: dict) -> str | None:
+    """The FFmpegExtractAudio target codec in ydl opts, or None if audio is not extracted."""
+    for pp in opts.get("postprocessors") or ():
+        if pp.get("key") == "FFmpegExtractAudio":
+            return pp.get("preferredcodec") or "best"
+    return None
+
+
+@dataclass
+class FormatRecord:
+    """One entry of info["formats"], with the fields format rules and the UI need."""
+
+    format_id: str
+    ext: str = ""
+    width: int | None = None
+    height: int | None = None
+    fps: float | None = None
+    vcodec: str = ""            # codec family ("h264", "vp9", ...); "none" if no video
+    acodec: str = ""            # "none" if no audio
+    tbr: float | None = None    # kbit/s
+    abr: float | None = None
+    vbr: float | None = None
+    size: int | None = None     # bytes, exact or approximate
+    note: str = ""
+    resolution: str = ""
+
+    @classmethod
+    def from_dict(cls, f: dict) -> "FormatRecord":
+        return cls(
+            format_id=str(f.get("format_id") or ""),
+            ext=f.get("ext") or "",
+            width=f.get("width"),
+            height=f.get("height"),
+            fps=f.get("fps"),
+            vcodec=codec_family(f.get("vcodec")),
+            acodec=codec_family(f.get("acodec")),
+            tbr=f.get("tbr"),
+            abr=f.get("abr"),
+            vbr=f.get("vbr"),
+            size=f.get("filesize") or f.get("filesize_approx"),
+            note=f.get("format_note") or "",
+            resolution=f.get("resolution") or (f"{f['height']}p" if f.get("height") else ""),
+        )
+
+    @property
+    def has_video(self) -> bool:
+        return self.vcodec != "none"
+
+    @property
+    def has_audio(self) -> bool:
+        return self.acodec != "none"
+
+    def sort_key(self) -> tuple:
+        """Best first when sorted descending: resolution, then frame rate, then bitrate."""
+        return (self.height or 0, self.width or 0, self.fps or 0, self.tbr or 0)
+
+    def display(self) -> str:
+        flags = []
+        if self.vcodec and self.vcodec != "none":
+            flags.append(self.vcodec)
+        if self.acodec and self.acodec != "none":
+            flags.append(self.acodec)
+        if self.abr:
+            flags.append(f"abr:{self.abr}")
+        if self.tbr:
+            flags.append(f"tbr:{self.tbr}")
+        if self.fps:
+            flags.append(f"{self.fps}fps")
+        if self.size:
+            flags.append(human_bytes(self.size))
+        return (f"{self.format_id:>5}  {self.ext:<4}  {self.resolution:<10}  {self.note:<12}  "
+                f"{' | '.join(flags)}")
+
+
+class _Candidate:
+    """A downloadable choice: one format, or a video-only format plus an audio format."""
+
+    __slots__ = ("spec", "height", "width", "fps", "tbr", "abr", "vbr", "size", "ext",
+                 "vcodec", "acodec", "score")
+
+    def __init__(self, *parts: FormatRecord):
+        video = next((r for r in parts if r.has_video), None)
+        audio = next((r for r in parts if r.has_audio), None)
+        self.spec = "+".join(r.format_id for r in parts)
+        self.height = video.height if video else None
+        self.width = video.width if video else None
+        self.fps = video.fps if video else None
+        self.vcodec = video.vcodec if video else "none"
+        self.acodec = audio.acodec if audio else "none"
+        self.ext = parts[0].ext
+        self.vbr = video.vbr if video else None
+        self.abr = audio.abr if audio else None
+        self.tbr = sum(r.tbr for r in parts) if all(r.tbr for r in parts) else None
+        self.size = sum(r.size for r in parts) if all(r.size for r in parts) else None
+        self.score = 0
+
+    def describe(self) -> str:
+        res = f"{self.height}p" if self.height else "audio"
+        return f"{res} {self.vcodec}+{self.acodec}, ~{human_bytes(self.size)}"
+
+
+_RULE_FIELDS = ("height", "width", "fps", "size", "tbr", "abr", "vbr", "ext", "vcodec", "acodec")
+_RULE_TEXT_FIELDS = ("ext", "vcodec", "acodec")
+_RULE_CLAUSE = re.compile(
+    r"(?P<field>[a-z]+)?\s*(?P<op><=|>=|!=|=|<|>|\u2264|\u2265)\s*(?P<value>\S+)"
+)
+_RULE_OPS = {
+    "<=": lambda a, b: a <= b, ">=": lambda a, b: a >= b, "<": lambda a, b: a < b,
+    ">": lambda a, b: a > b, "=": lambda a, b: a == b, "!=": lambda a, b: a != b,
+}
+
+
+@dataclass
+class FormatRule:
+    """
+    Picks a format per item from a short rule, e.g.
+
+        height<=1080; prefer h264+aac; size<500M; else smallest
+
+    Clauses are separated by ";" or ",":
+      <field><op><value>   field: height (default), width, fps, size, tbr, abr, vbr,
+                           ext, vcodec, acodec; op: < <= > >= = !=. Sizes take K/M/G.
+      prefer a+b ...       codecs or extensions, most important first
+      else best|smallest|fail
+                           what to do when nothing meets every constraint
+      audio                audio-only formats (implied by "Extract audio")
+
+    Video-only formats are paired with the best audio format when ffmpeg can merge them.
+    Among formats that meet the constraints, preferences decide first, then resolution,
+    frame rate and bitrate. Unknown values (e.g. no size) never fail a constraint.
+    """
+
+    constraints: list[tuple[str, str, object]] = field(default_factory=list)
+    prefer: list[str] = field(default_factory=list)
+    fallback: str = "best"
+    audio_only: bool = False
+
+    @classmethod
+    def parse(cls, text: str, audio_only: bool = False) -> "FormatRule":
+        """Raises ValueError on a clause it does not understand."""
+        rule = cls(audio_only=audio_only)
+        for clause in re.split(r"[;,]", text):
+            clause = clause.strip().lower()
+            if not clause:
+                continue
+            if clause.startswith("prefer "):
+                rule.prefer += [codec_family(t) for t in re.split(r"[+\s]+", clause[7:]) if t]
+            elif clause.startswith("else "):
+                rule.fallback = clause[5:].strip()
+                if rule.fallback not in ("best", "smallest", "fail"):
+                    raise ValueError(f"Unknown fallback: {clause!r} (use best, smallest or fail)")
+            elif clause in ("audio", "audio only"):
+                rule.audio_only = True
+            else:
+                rule.constraints.append(cls._parse_constraint(clause))
+        return rule
+
+    @staticmethod
+    def _parse_constraint(clause: str) -> tuple[str, str, object]:
+        m = _RULE_CLAUSE.fullmatch(clause)
+        if not m:
+            raise ValueError(f"Cannot parse format rule clause: {clause!r}")
+        name = m.group("field") or "height"
+        op = {"\u2264": "<=", "\u2265": ">="}.get(m.group("op"), m.group("op"))
+        raw = m.group("value")
+        if name not in _RULE_FIELDS:
+            raise ValueError(f"Unknown format field: {name!r}")
+        if name in _RULE_TEXT_FIELDS:
+            if op not in ("=", "!="):
+                raise ValueError(f"{name} only supports = and !=")
+            return name, op, raw if name == "ext" else codec_family(raw)
+        if name == "size":
+            value = parse_rate_limit(raw)
+        else:
+            try:
+                value = float(raw.rstrip("p"))
+            except ValueError:
+                value = None
+        if value is None:
+            raise ValueError(f"Bad value in format rule clause: {clause!r}")
+        return name, op, value
+
+    def candidates(self, records: list[FormatRecord], can_merge: bool = True) -> list[_Candidate]:
+        audio = [r for r in records if r.has_audio and not r.has_video]
+        if self.audio_only:
+            singles = audio or [r for r in records if r.has_audio] or records
+            return [_Candidate(r) for r in singles]
+
+        cands = [_Candidate(r) for r in records if r.has_video and r.has_audio]
+        video_only = [r for r in records if r.has_video and not r.has_audio]
+        if video_only and audio and can_merge:
+            best_audio = max(audio, key=lambda r: (self._score(r.acodec, r.ext), r.abr or r.tbr or 0))
+            cands += [_Candidate(r, best_audio) for r in video_only]
+        # Nothing with both streams and nothing to merge: take what there is.
+        return cands or [_Candidate(r) for r in records]
+
+    def _score(self, *values: str) -> int:
+        n = len(self.prefer)
+        return sum(1 << (n - i - 1) for i, token in enumerate(self.prefer) if token in values)
+
+    def _allowed(self, c: _Candidate) -> bool:
+        for name, op, value in self.constraints:
+            actual = getattr(c, name)
+            if actual is None or actual == "":
+                continue
+            if not _RULE_OPS[op](actual, value):
+                return False
+        return True
+
+    def _rank_key(self, c: _Candidate) -> tuple:
+        if self.audio_only:
+            return (c.score, c.abr or c.tbr or 0)
+        return (c.score, c.height or 0, c.width or 0, c.fps or 0, c.tbr or 0)
+
+    def choose(self, records: list[FormatRecord], can_merge: bool = True) -> _Candidate | None:
+        """The best candidate under this rule, or None if there is none (fallback "fail")."""
+        cands = self.candidates(records, can_merge)
+        if not cands:
+            return None
+        for c in cands:
+            c.score = self._score(c.vcodec, c.acodec, c.ext)
+        allowed = [c for c in cands if self._allowed(c)]
+        if allowed:
+            return max(allowed, key=self._rank_key)
+        if self.fallback == "smallest":
+            return min(cands, key=lambda c: (c.size is None, c.size or 0, -(c.tbr or 0)))
+        if self.fallback == "best":
+            return max(cands, key=self._rank_key)
+        return None
+
+    def selector(self, ydl, on_choice=None):
+        """A YoutubeDL.format_selector that applies this rule to each video's formats."""
+        can_merge = ytdlp().postprocessor.FFmpegMergerPP(ydl).available
+
+        def select(ctx):
+            records = [FormatRecord.from_dict(f) for f in ctx["formats"]]
+            choice = self.choose(records, can_merge)
+            if choice is None:
+                return iter(())
+            if on_choice is not None:
+                on_choice(choice)
+            return ydl.build_format_selector(choice.spec)(ctx)
+
+        return select
+
+
+# -----------------------------
+# yt-dlp runner
+# -----------------------------
+def playlist_entries(playlist: dict):
+    """A playlist's entries, still lazy (a PagedList is read one page at a time)."""
+    entries = playlist.get("entries") or []
+    if isinstance(entries, ytdlp().utils.PagedList):
+        return _paged_entries(entries)
+    return entries
+
+
+def _paged_entries(entries):
+    # PagedList.getslice() with no end reads every page before returning; ask for
+    # one page's worth at a time instead. A short page is the last one.
+    size = entries._pagesize
+    for start in itertools.count(0, size):
+        page = entries.getslice(start, start + size)
+        yield from page
+        if len(page) < size:
+            return
+
+
+def playlist_fields(playlist: dict) -> dict:
+    """Playlist fields for the output template of each entry."""
+    return {
+        "playlist": playlist.get("title") or playlist.get("id"),
+        "playlist_id": playlist.get("id"),
+        "playlist_title": playlist.get("title"),
+        "playlist_uploader": playlist.get("uploader"),
+        "playlist_count": playlist.get("playlist_count"),
+    }
+
+
+def playlist_child(entry: dict | None, index: int, extra: dict, parent_id: int | None) -> DownloadItem | None:
+    """The queue item for one playlist entry, or None if the entry has nothing to download."""
+    if not entry:
+        return None
+    url = entry.get("url") or entry.get("webpage_url") or ""
+    full = entry.get("_type", "video") == "video" and entry.get("formats")
+    if not url and not full:
+        return None
+    return DownloadItem(
+        url=entry.get("webpage_url") or url,
+        title=entry.get("title") or "",
+        parent_id=parent_id,
+        ie_key=None if full else entry.get("ie_key"),
+        extra_info={**extra, "playlist_index": index},
+        info=dict(entry) if full else None,
+    )
+
+
+# How a cached stream URL that expired or was revoked fails: its request errors out.
+# Anything else (no space, no such format, a bad certificate) fails the same way
+# with fresh info.
+_STALE_URL_ERROR = re.compile(
+    r"HTTP Error \d{3}|unable to download|timed? ?out|connection (?:reset|refused|aborted)|"
+    r"remote end closed|incomplete ?read", re.I)
+
+
+class YtDlpRunner:
+    def __init__(self, signals: CoreSignals, get_cancel_flag, cache: InfoCache | None = None,
+                 pool: YdlSessionPool | None = None, progress: ProgressAggregator | None = None,
+                 postprocess: PostProcessPool | None = None, bandwidth: BandwidthLimiter | None = None,
+                 fragments: FragmentTuner | None = None, format_rule: FormatRule | None = None,
+                 tracer: Tracer | None = None, staging: StagingArea | None = None,
+                 disk: DiskBudget | None = None):
+        self.signals = signals
+        self.get_cancel_flag = get_cancel_flag
+        self.cache = cache
+        self.progress = progress if progress is not None else ProgressAggregator()
+        # Without a shared pool, nothing is kept warm: sessions close when released.
+        self.pool = pool if pool is not None else YdlSessionPool(max_idle=0)
+        # Without a post-processing pool, postprocessors run inline on the worker.
+        self.postprocess = postprocess
+        self.bandwidth = bandwidth
+        # None keeps whatever concurrent_fragment_downloads the options set.
+        self.fragments = fragments
+        # Overrides the "format" option per video when set.
+        self.format_rule = format_rule
+        self.tracer = tracer
+        # Downloads go to a local staging folder first when set; see StagingArea.
+        self.staging = staging
+        self.disk = disk if disk is not None else DiskBudget()
+
+    def set_state(self, item: DownloadItem | None, state: str):
+        if item is None or item.state == state:
+            return
+        item.state = state
+        self.progress.set_phase(item.id, state)
+        if self.tracer is not None:
+            self.tracer.item_state(item, state)
+        self.signals.item_state.emit(item.id, state)
+
+    def _is_canceled(self, item: DownloadItem | None) -> bool:
+        return self.get_cancel_flag() or (item is not None and item.token.canceled)
+
+    def _rule(self, opts: dict) -> FormatRule | None:
+        """The format rule for a download: its options' "format_rule", else the runner's."""
+        return opts.get("format_rule", self.format_rule)
+
+    def _check_canceled(self, item: DownloadItem | None):
+        if self._is_canceled(item):
+            raise ytdlp().utils.DownloadError("Canceled by user")
+
+    def _make_progress_hook(self, item: DownloadItem | None, audio_target: str | None = None):
+        # Runs on the worker for every chunk: record raw numbers only. The UI polls
+        # the aggregator and does all formatting in one throttled place.
+        def hook(d):
+            self._check_canceled(item)
+            if item is None:
+                return
+
+            status = d.get("status")
+            if status == "downloading":
+                self.set_state(item, ItemState.DOWNLOADING)
+                total = d.get("total_bytes") or d.get("total_bytes_estimate")
+                downloaded = d.get("downloaded_bytes") or 0
+                item.progress = (downloaded / total * 100.0) if total else 0.0
+                item.speed = d.get("speed")
+                self.progress.report(ProgressEvent(
+                    item.id, ItemState.DOWNLOADING, downloaded, total, item.speed, d.get("filename") or "",
+                ))
+                if self.bandwidth is not None:
+                    self.bandwidth.consume(item.id, downloaded, d.get("filename") or "")
+                self.disk.consume(item.id, d.get("filename") or "", downloaded)
+
+            elif status == "finished":
+                self.set_state(item, ItemState.POSTPROCESSING)
+                item.progress = 100.0
+                item.speed = None
+                if audio_target is not None:
+                    self._note_audio(item, audio_target, (d.get("info_dict") or {}).get("acodec"))
+                total = d.get("total_bytes") or d.get("downloaded_bytes")
+                self.progress.report(ProgressEvent(
+                    item.id, ItemState.POSTPROCESSING, total or 0, total, None, d.get("filename") or "",
+                ))
+                # No "elapsed" when the file was already on disk: nothing was downloaded.
+                if self.tracer is not None and d.get("elapsed") is not None:
+                    now = time.time()
+                    self.tracer.record(item.id, "download", now - d["elapsed"], now,
+                                       bytes=total, file=os.path.basename(d.get("filename") or ""))
+                    self.tracer.add_bytes(total or 0)
+
+        return hook
+
+    def _note_audio(self, item: DownloadItem, target: str, acodec: str | None):
+        # Merged downloads finish once per stream; the video-only one has no audio.
+        if not acodec or acodec == "none":
+            return
+        item.audio = audio_conversion(target, acodec)
+        how = "stream copy" if item.audio == "copy" else "re-encode"
+        self.signals.log.emit(f"Audio: {codec_family(acodec)} source to {target}, {how}: "
+                              f"{item.title or item.url}\n")
+
+    def _make_postprocessor_hook(self, item: DownloadItem | None):
+        started: dict[str, float] = {}
+
+        def hook(d):
+            name = d.get("postprocessor") or "?"
+            if d.get("status") == "started":
+                # Inline postprocessors stop between steps; _cancellable_ffmpeg kills a running ffmpeg.
+                self._check_canceled(item)
+                self.set_state(item, ItemState.POSTPROCESSING)
+                started[name] = time.time()
+            elif d.get("status") == "finished" and name in started and self.tracer is not None:
+                self._trace_pp(item, "move" if name.startswith("MoveFiles") else "postprocess",
+                               name, started.pop(name), time.time())
+
+        return hook
+
+    def _trace_pp(self, item: DownloadItem | None, phase: str, name: str, start: float, end: float):
+        if name == "Handoff":
+            return
+        label = ("postprocessor", name) if phase == "postprocess" else ("", "")
+        self.tracer.record(item.id if item else None, phase, start, end, label)
+
+    def extract(self, ydl, url: str, ie_key: str | None = None,
+                item: DownloadItem | None = None) -> tuple[dict | None, bool]:
+        """
+        Raw (unprocessed) info for url, from the cache when fresh.
+        Returns (info, from_cache); info is None if yt-dlp skipped the URL.
+        """
+        start = time.time()
+        item_id = item.id if item else None
+        if self.cache:
+            info = self.cache.get(url)
+            if info is not None:
+                if self.tracer is not None:
+                    self.tracer.record(item_id, "extract_cached", start, time.time())
+                return info, True
+        info = ydl.extract_info(url, download=False, process=False, ie_key=ie_key)
+        if self.tracer is not None:
+            extractor = (info or {}).get("extractor_key") or ie_key or "?"
+            self.tracer.record(item_id, "extract", start, time.time(), ("extractor", extractor))
+        if self.cache and info is not None:
+            self.cache.put(url, info)
+        return info, False
+
+    def list_formats(self, url: str, base_opts: dict):
+        # Same options as the download (nothing is downloaded with process=False or
+        # download=False), so the download can reuse this warm session.
+        opts = dict(base_opts)
+        opts.update({"quiet": True, "no_warnings": True})
+
+        with self.pool.lease(opts) as ydl:
+            info, _ = self.extract(ydl, url)
+            if info is None:
+                info = {}
+            elif info.get("_type", "video") != "video":
+                info = ydl.process_ie_result(info, download=False) or {}
+
+        records = [FormatRecord.from_dict(f) for f in (info.get("formats") or [])]
+        records.sort(key=FormatRecord.sort_key, reverse=True)
+        fmts = [(r.format_id, r.display()) for r in records]
+        self.signals.formats_ready.emit(fmts)
+
+    def estimate_size(self, item: DownloadItem, base_opts: dict) -> int | None:
+        """
+        Bytes item will download, by extracting it ahead of its turn (the info stays in
+        the cache for the download) and running format selection without downloading.
+        0 for a playlist: expanding it is quick and queues its entries. None if unknown.
+        """
+        opts = {**base_opts, "quiet": True, "no_warnings": True, "cancel_token": item.token}
+        with self.pool.lease(opts) as ydl:
+            if item.info is not None:
+                info = copy.deepcopy(item.info)
+            else:
+                info, _ = self.extract(ydl, item.url, item.ie_key, item)
+            if info is None or info.get("_type") in ("playlist", "multi_video"):
+                return 0
+            rule = self._rule(opts)
+            if rule is not None:
+                ydl.format_selector = rule.selector(ydl)
+            info = ydl.process_ie_result(info, download=False, extra_info=item.extra_info or {})
+        return estimate_info_size(info) if info else None
+
+    def iter_playlist(self, playlist: dict, parent: DownloadItem | None):
+        """
+        Yield a child DownloadItem per playlist entry, as the extractor produces them.
+
+        Entries are consumed lazily (generators and paged lists fetch one page at a
+        time), so the first children can start downloading long before the end of a
+        large channel has been enumerated.
+        """
+        extra = playlist_fields(playlist)
+        for index, entry in enumerate(playlist_entries(playlist), start=1):
+            self._check_canceled(parent)
+            child = playlist_child(entry, index, extra, parent.id if parent else None)
+            if child is not None:
+                yield child
+
+    def expand_playlist(self, playlist: dict, parent: DownloadItem | None, on_children,
+                        batch_size: int = 50, batch_interval: float = 0.5) -> int:
+        """Feed children to on_children(parent, items) in small batches; returns the count."""
+        batch: list[DownloadItem] = []
+        last_flush = time.monotonic()
+        count = 0
+        for child in self.iter_playlist(playlist, parent):
+            batch.append(child)
+            count += 1
+            if len(batch) >= batch_size or time.monotonic() - last_flush >= batch_interval:
+                if parent is not None:
+                    parent.children = count
+                on_children(parent, batch)
+                batch = []
+                last_flush = time.monotonic()
+        if parent is not None:
+            parent.children = count
+        if batch:
+            on_children(parent, batch)
+        return count
+
+    def download(self, url: str, opts: dict, item: DownloadItem | None = None,
+                 on_children=None) -> list[Future]:
+        """
+        Download url. If it is a playlist and on_children is given, nothing is downloaded
+        here: entries are handed to on_children as they arrive and queued separately.
+
+        With a post-processing pool, 'post_process' postprocessors are not run here;
+        the downloaded files are submitted to the pool and their futures returned.
+        """
+        opts = dict(opts)
+        deferred: list[dict] = []
+        handed_off: list[dict] = []
+        if self.postprocess is not None:
+            opts, deferred = split_post_process(opts)
+        if deferred:
+            opts["post_process_hooks"] = [lambda info: handed_off.append(self._handoff_info(info))]
+            opts["defer_download_archive"] = True
+        hooks = list(opts.get("progress_hooks", []))
+        hooks.append(self._make_progress_hook(item, extract_audio_target(opts)))
+        opts["progress_hooks"] = hooks
+        pp_hooks = list(opts.get("postprocessor_hooks", []))
+        pp_hooks.append(self._make_postprocessor_hook(item))
+        opts["postprocessor_hooks"] = pp_hooks
+        if item is not None:
+            opts["cancel_token"] = item.token
+            item.audio = ""
+        dest, stage = self._stage(url, opts)
+
+        tuning = None
+        if self.fragments is not None:
+            tuning = self.fragments.acquire(url_host(url), item.token if item is not None else None)
+        if tuning is not None:
+            opts["lease_params"] = {**opts.get("lease_params", {}), **tuning.params()}
+            opts["progress_hooks"].append(tuning.observe)
+
+        self.set_state(item, ItemState.EXTRACTING)
+        if self.bandwidth is not None and item is not None:
+            self.bandwidth.open(item.id, 2.0 ** item.priority)
+        ok = False
+        try:
+            self._download(url, opts, item, on_children)
+            ok = True
+        finally:
+            if self.bandwidth is not None and item is not None:
+                self.bandwidth.close(item.id)
+            if item is not None and not (ok and stage):
+                self.disk.release(item.id)
+            if stage and not ok:
+                _remove_if_empty(stage)   # a .part file stays, for resuming
+            if tuning is not None:
+                # A canceled download still measured something; only real failures back off.
+                line = self.fragments.release(tuning, ok or self._is_canceled(item))
+                if tuning.downloaded:
+                    self.signals.log.emit(line)
+
+        futures: list[Future] = []
+        on_timing = None
+        if self.tracer is not None:
+            on_timing = functools.partial(self._trace_pp, item)
+        if handed_off:
+            # Submitting blocks while the post-processing backlog is full (backpressure).
+            params = {k: v for k, v in opts.items() if k not in SESSION_VOLATILE_KEYS}
+            params["postprocessors"] = deferred
+            staged_paths = opts.get("lease_params", {}).get("paths")
+            if staged_paths:
+                params["paths"] = staged_paths
+            futures = [self.postprocess.submit(params, info, item.id if item else None, on_timing,
+                                               item.token if item else None)
+                       for info in handed_off]
+        if stage:
+            futures += self._finish_stage(item, stage, dest, futures, on_timing)
+        return futures
+
+    def _stage(self, url: str, opts: dict) -> tuple[str, str | None]:
+        """
+        Point the download at its staging folder, if staging is on.
+        Returns (output folder, staging folder or None).
+        """
+        dest = output_dir(opts)
+        if self.staging is None:
+            return dest, None
+        stage = self.staging.dir_for(url)
+        opts["lease_params"] = {**opts.get("lease_params", {}),
+                                "paths": {**(opts.get("paths") or {}), "home": stage}}
+        return dest, stage
+
+    def _finish_stage(self, item: DownloadItem | None, stage: str, dest: str, after: list[Future],
+                      on_timing) -> list[Future]:
+        """
+        Queue a downloaded item's staging folder for the mover, after its post-processing
+        futures; blocks while the mover's backlog is full. Returns the move's future.
+        """
+        if not after and not os.listdir(stage):
+            # Nothing was downloaded (a playlist, or already in the archive).
+            shutil.rmtree(stage, ignore_errors=True)
+            if item is not None:
+                self.disk.release(item.id)
+            return []
+        future = self.staging.mover.submit(stage, dest, after, on_timing, item.token if item else None)
+        if item is not None:
+            future.add_done_callback(lambda _: self.disk.release(item.id))
+        return [future]
+
+    def _download(self, url: str, opts: dict, item: DownloadItem | None, on_children):
+        with self.pool.lease(opts) as ydl:
+            if item is not None and item.info is not None:
+                info, from_cache = item.info, False
+                item.info = None
+            else:
+                info, from_cache = self.extract(ydl, url, item.ie_key if item else None, item)
+            if info is None:
+                self.signals.log.emit(f"Skipped (already in download archive): {url}\n")
+                return
+            self._check_canceled(item)
+            if on_children is not None and info.get("_type") in ("playlist", "multi_video"):
+                if item is not None:
+                    item.title = info.get("title") or item.title
+                # The extractor pages through the playlist with this session, so
+                # expansion has to finish before the lease is released.
+                start = time.time()
+                n = self.expand_playlist(info, item, on_children)
+                if self.tracer is not None:
+                    self.tracer.record(item.id if item else None, "expand", start, time.time(), entries=n)
+                self.signals.log.emit(f"Playlist expanded: {n} item(s) from {url}\n")
+                return
+            extra_info = item.extra_info if item else None
+            rule = self._rule(opts)
+            if rule is not None:
+                ydl.format_selector = rule.selector(
+                    ydl, lambda c: self.signals.log.emit(f"Format rule picked {c.spec} ({c.describe()})\n"))
+            if item is not None and callable(ydl.format_selector):
+                ydl.format_selector = self._space_checked_selector(ydl.format_selector, item, opts)
+            if self.tracer is not None and callable(ydl.format_selector):
+                ydl.format_selector = self._timed_selector(ydl.format_selector, item)
+            try:
+                ydl.process_ie_result(info, download=True, extra_info=extra_info)
+            except ytdlp().utils.DownloadError as e:
+                # Cached stream URLs can be revoked early; retry once with a fresh extraction.
+                if not from_cache or self._is_canceled(item) or not _STALE_URL_ERROR.search(str(e)):
+                    raise
+                self.signals.log.emit(f"Cached info failed ({e}); re-extracting…\n")
+                self.cache.invalidate(url)
+                info, _ = self.extract(ydl, url, item.ie_key if item else None, item)
+                if info is not None:
+                    ydl.process_ie_result(info, download=True, extra_info=extra_info)
+
+    def _space_checked_selector(self, selector, item: DownloadItem, opts: dict):
+        # The chosen formats' size is the first estimate worth checking against; nothing
+        # has been written yet. Staged downloads need room in both folders.
+        staged = (opts.get("lease_params") or {}).get("paths", {}).get("home")
+        dirs = [d for d in (staged, output_dir(opts)) if d]
+
+        def select(ctx):
+            chosen = list(selector(ctx))
+            size = estimate_download_size(chosen)
+            if size is not None:
+                problem = self.disk.reserve(item.id, size, *dirs)
+                if problem:
+                    raise ytdlp().utils.DownloadError(problem)
+            return iter(chosen)
+
+        return select
+
+    def _timed_selector(self, selector, item: DownloadItem | None):
+        def select(ctx):
+            start = time.time()
+            chosen = list(selector(ctx))
+            self.tracer.record(item.id if item else None, "format", start, time.time(),
+                               formats=len(ctx.get("formats") or ()),
+                               chosen="+".join(str(f.get("format_id")) for f in chosen))
+            return iter(chosen)
+
+        return select
+
+    @staticmethod
+    def _handoff_info(info: dict) -> dict:
+        """A picklable copy of a downloaded file's info for the post-processing process."""
+        info = {k: v for k, v in info.items() if k != "__postprocessors"}
+        return ytdlp().YoutubeDL.sanitize_info(info)
+
+
+# -----------------------------
+# Saved sources (incremental sync)
+# -----------------------------
+def entry_key(entry: dict, extractor: str = "") -> str:
+    """Download-archive key ("youtube ID") of a playlist entry; its normalized URL if it has no id."""
+    ie = entry.get("ie_key") or entry.get("extractor_key") or extractor
+    if entry.get("id") and ie:
+        return f"{ie.lower()} {entry['id']}"
+    return normalize_url(entry.get("webpage_url") or entry.get("url") or "")
+
+
+@dataclass
+class Source:
+    url: str
+    title: str = ""
+    last_sync: float | None = None
+    last_new: int = 0
+    known: int = 0              # entry keys remembered
+
+
+class SourceStore:
+    """
+    Channels and playlists saved for sync, with the entry keys already seen in each,
+    in a local SQLite database. Sources are keyed by normalize_url(). Every call
+    opens its own connection, so sync threads can share one store.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sources (
+            key         TEXT PRIMARY KEY,
+            url         TEXT NOT NULL,
+            title       TEXT NOT NULL DEFAULT '',
+            added_at    REAL NOT NULL,
+            last_sync   REAL,
+            last_new    INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS seen (
+            source      TEXT NOT NULL,
+            key         TEXT NOT NULL,
+            PRIMARY KEY (source, key)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def add(self, urls) -> int:
+        """Save urls as sources; returns how many were not saved already."""
+        rows: dict[str, str] = {}
+        for u in urls:
+            if u.strip():
+                rows.setdefault(normalize_url(u), u.strip())
+        conn = self._connect()
+        try:
+            with conn:
+                before = conn.total_changes
+                conn.executemany("INSERT OR IGNORE INTO sources (key, url, added_at) VALUES (?, ?, ?)",
+                                 [(k, u, time.time()) for k, u in rows.items()])
+                return conn.total_changes - before
+        finally:
+            conn.close()
+
+    def remove(self, urls) -> int:
+        """Forget sources and what was seen in them; returns how many there were."""
+        keys = [(normalize_url(u),) for u in urls if u.strip()]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("DELETE FROM seen WHERE source = ?", keys)
+                before = conn.total_changes
+                conn.executemany("DELETE FROM sources WHERE key = ?", keys)
+                return conn.total_changes - before
+        finally:
+            conn.close()
+
+    def sources(self) -> list[Source]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT s.url, s.title, s.last_sync, s.last_new, "
+                "(SELECT COUNT(*) FROM seen WHERE source = s.key) FROM sources s ORDER BY s.added_at").fetchall()
+        finally:
+            conn.close()
+        return [Source(*r) for r in rows]
+
+    def known(self, url: str) -> set[str]:
+        """Entry keys seen in earlier syncs of url."""
+        conn = self._connect()
+        try:
+            return {r[0] for r in conn.execute("SELECT key FROM seen WHERE source = ?", (normalize_url(url),))}
+        finally:
+            conn.close()
+
+    def record_sync(self, url: str, title: str, keys: list[str]):
+        """Remember a finished sync of url and the entry keys it found."""
+        source = normalize_url(url)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO sources (key, url, added_at) VALUES (?, ?, ?)",
+                             (source, url.strip(), time.time()))
+                conn.execute("UPDATE sources SET title = ?, last_sync = ?, last_new = ? WHERE key = ?",
+                             (title, time.time(), len(keys), source))
+                conn.executemany("INSERT OR IGNORE INTO seen VALUES (?, ?)", [(source, k) for k in keys])
+        finally:
+            conn.close()
+
+
+@dataclass
+class SyncResult:
+    url: str
+    title: str = ""
+    new: int = 0
+    scanned: int = 0            # entries looked at, including the known one it stopped at
+    stopped: bool = False       # stopped before the end: a known entry, or first_limit
+    elapsed: float = 0.0
+    error: str = ""
+
+    def summary(self) -> str:
+        if self.error:
+            return f"{self.url}: failed: {self.error}"
+        how = "stopped early" if self.stopped else "end of list"
+        return f"{self.title or self.url}: {self.new} new ({self.scanned} scanned, {how}, {self.elapsed:.1f}s)"
+
+
+class SourceSync:
+    """
+    Queues what is new in saved sources.
+
+    Sources are enumerated flat (no per-entry extraction). A channel's own feed (its
+    tabs: videos, shorts, ...) lists newest first, so enumeration of it stops at the
+    first entry that an earlier sync saw or that is in the download archive, as with
+    yt-dlp's break_on_existing: a channel with two new videos costs one page request.
+    Any other list is taken to be oldest first, like an ordinary playlist that grows
+    at the end, and is read to its end, skipping what is known. A channel URL without
+    a tab lists its tabs; each tab is followed and stopped separately.
+
+    New entries become top-level items (with their playlist fields for the output
+    template) passed to on_items(items) per source. Their keys are only recorded once
+    the source's enumeration has finished, so an interrupted or failed sync is simply
+    repeated next time. The first sync of a source queues at most first_limit entries
+    per list, the newest (None = all; 0 only remembers what is there); older ones are
+    never queued. `workers` sources are synced at once.
+    """
+
+    def __init__(self, runner: "YtDlpRunner", store: SourceStore, archive: set[str] | None = None,
+                 workers: int = 8, first_limit: int | None = None):
+        self.runner = runner
+        self.store = store
+        self.archive = archive or set()
+        self.workers = max(1, workers)
+        self.first_limit = first_limit
+
+    def run(self, urls, opts: dict, on_items, token: CancelToken | None = None) -> list[SyncResult]:
+        """Sync urls (e.g. every Source.url of the store); blocks until all are done."""
+        token = token if token is not None else CancelToken()
+        opts = {**opts, "quiet": True, "no_warnings": True, "cancel_token": token}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="source-sync") as pool:
+            futures = [pool.submit(self._sync, url, opts, on_items, token) for url in urls]
+        return [f.result() for f in futures]
+
+    def _sync(self, url: str, opts: dict, on_items, token: CancelToken) -> SyncResult:
+        result = SyncResult(url)
+        start = time.monotonic()
+        known = self.store.known(url)
+        limit = None if known else self.first_limit
+        known |= self.archive
+        keys: list[str] = []
+        items: list[DownloadItem] = []
+        try:
+            token.check()
+            with self.runner.pool.lease(opts) as ydl:
+                info, _ = self.runner.extract(ydl, url)
+                if info is None or info.get("_type") not in ("playlist", "multi_video"):
+                    raise ValueError("not a channel or playlist")
+                result.title = info.get("title") or info.get("id") or ""
+                for key, item in self._new_entries(ydl, info, known, result, token, limit, nested=True):
+                    keys.append(key)
+                    if item is not None:
+                        items.append(item)
+        except Exception as e:
+            result.error = str(e) or type(e).__name__
+            result.elapsed = time.monotonic() - start
+            return result
+        self.store.record_sync(url, result.title, keys)
+        result.new = len(items)
+        result.elapsed = time.monotonic() - start
+        if items:
+            on_items(items)
+        return result
+
+    @staticmethod
+    def _is_feed(playlist: dict) -> bool:
+        """A channel's own list (its id is the channel's), which sites show newest first."""
+        list_id = playlist.get("id")
+        return bool(list_id) and list_id in (playlist.get("channel_id"), playlist.get("uploader_id"))
+
+    def _new_entries(self, ydl, playlist: dict, known: set[str], result: SyncResult, token: CancelToken,
+                     limit: int | None, nested: bool, feed: bool = False):
+        """
+        (key, item) for each entry not known yet; item is None for new entries past
+        the limit, which are only remembered. A feed stops at its first known entry.
+        """
+        extractor = playlist.get("extractor_key") or ""
+        extra = playlist_fields(playlist)
+        feed = feed or self._is_feed(playlist)
+        new: list[tuple[str, DownloadItem]] = []
+        for index, entry in enumerate(playlist_entries(playlist), start=1):
+            if feed and limit is not None and len(new) >= max(limit, 1):
+                result.stopped = True
+                break
+            token.check()
+            if not entry:
+                continue
+            kind = entry.get("_type", "video")
+            if nested and (kind == "playlist" or kind == "url" and entry.get("ie_key") == extractor):
+                # A tab of the same channel: its own list, stopped separately.
+                if kind == "url":
+                    entry, _ = self.runner.extract(ydl, entry["url"], entry.get("ie_key"))
+                if entry and entry.get("_type") in ("playlist", "multi_video"):
+                    yield from self._new_entries(ydl, entry, known, result, token, limit,
+                                                 nested=False, feed=feed)
+                continue
+            result.scanned += 1
+            key = entry_key(entry, extractor)
+            if key in known:
+                if feed:
+                    result.stopped = True
+                    break
+                continue
+            known.add(key)
+            item = playlist_child(entry, index, extra, None)
+            if item is None:
+                continue
+            if limit is None:
+                yield key, item
+            else:
+                new.append((key, item))
+        if limit is None:
+            return
+        # With a limit, queue the newest: a feed's first entries, an oldest-first list's last.
+        keep = range(limit) if feed else range(len(new) - limit, len(new))
+        for i, (key, item) in enumerate(new):
+            yield key, item if i in keep else None
+
+
+# -----------------------------
+# Process-isolated downloads
+# -----------------------------
+# What a download process forwards of each progress dict: enough for the parent's
+# progress hook and FragmentLease.observe(), nothing that drags info_dict along.
+_FORWARDED_PROGRESS = ("status", "downloaded_bytes", "total_bytes", "total_bytes_estimate", "speed",
+                       "elapsed", "filename", "fragment_index", "fragment_count")
+
+
+def _item_fields(item: DownloadItem, with_id: bool = True) -> dict:
+    fields_ = {"url": item.url, "title": item.title, "parent_id": item.parent_id, "ie_key": item.ie_key,
+               "extra_info": item.extra_info, "info": item.info, "priority": item.priority}
+    if with_id:
+        fields_["id"] = item.id
+    return fields_
+
+
+class _Channel:
+    """Child side of a download process's pipes; send() is safe from any thread."""
+
+    def __init__(self, events):
+        self._events = events
+        self._lock = threading.Lock()
+        self.acks: queue_mod.SimpleQueue = queue_mod.SimpleQueue()
+
+    def send(self, *msg):
+        with self._lock:
+            self._events.send(msg)
+
+    def ask(self, *msg) -> bool:
+        """Send and wait for the parent's ("ack", ok)."""
+        self.send(*msg)
+        return self.acks.get()
+
+
+class _PipeSignals(CoreSignals):
+    def __init__(self, channel: _Channel):
+        super().__init__()
+        self.log.connect(lambda text: channel.send("log", text))
+        self.item_state.connect(lambda item_id, state: channel.send("state", state))
+        self.error.connect(lambda msg: channel.send("error", msg))
+
+
+class _PipeTracer:
+    """Tracer stand-in in a download process: spans go to the parent's Tracer."""
+
+    def __init__(self, channel: _Channel):
+        self.channel = channel
+
+    def record(self, item_id: int | None, phase: str, start: float, end: float,
+               label: tuple[str, str] = ("", ""), **attrs):
+        # The parent records downloads (and bytes) itself, from the forwarded progress.
+        if phase != "download":
+            self.channel.send("record", item_id, phase, start, end, label, attrs)
+
+    def add_bytes(self, n: int):
+        pass
+
+    def item_state(self, item: DownloadItem, state: str):
+        pass
+
+
+class _PipeDisk:
+    """DiskBudget stand-in in a download process: the parent holds the reservations."""
+
+    def __init__(self, channel: _Channel):
+        self.channel = channel
+
+    def reserve(self, key, size: int, *dirs: str) -> str | None:
+        return self.channel.ask("space", size, dirs)
+
+    def consume(self, key, filename: str, downloaded: int):
+        pass
+
+    def release(self, key):
+        pass
+
+
+class _PipeHandoff:
+    """PostProcessPool stand-in in a download process: hands files to the parent's pool."""
+
+    def __init__(self, channel: _Channel):
+        self.channel = channel
+
+    def submit(self, params: dict, info: dict, item_id=None, on_timing=None, token=None) -> Future:
+        self.channel.send("pp", params, info)
+        f = Future()
+        f.set_result(None)
+        return f
+
+
+def _download_process(control, events, heartbeat: float):
+    """
+    Child process: run download jobs one at a time with a warm session pool.
+    Events go to the parent as tuples on `events`; `control` carries jobs, acks and
+    cancel requests. A heartbeat is sent every `heartbeat` seconds, so a process
+    stuck holding the GIL (e.g. a runaway regex) goes quiet and gets killed.
+    """
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()   # see _kill_tree()
+    channel = _Channel(events)
+    jobs: queue_mod.SimpleQueue = queue_mod.SimpleQueue()
+    current: list[CancelToken] = []
+
+    def read_control():
+        try:
+            while True:
+                msg = control.recv()
+                if msg is None:
+                    jobs.put(None)
+                    return
+                if msg[0] == "job":
+                    jobs.put(msg[1])
+                elif msg[0] == "ack":
+                    channel.acks.put(msg[1])
+                elif msg[0] == "cancel" and current:
+                    current[0].cancel()
+        except (EOFError, OSError):
+            os._exit(0)   # parent is gone
+
+    def beat():
+        while True:
+            time.sleep(heartbeat)
+            channel.send("beat")
+
+    threading.Thread(target=read_control, daemon=True).start()
+    threading.Thread(target=beat, daemon=True).start()
+    pool = YdlSessionPool()
+    caches: dict[str | None, InfoCache] = {}
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        item = DownloadItem(**job["item"])
+        current[:] = [item.token]
+        cache = None
+        if job["cache"]:
+            cache = caches.setdefault(job["cache_dir"], InfoCache(disk_dir=job["cache_dir"]))
+        runner = YtDlpRunner(_PipeSignals(channel), lambda: False, cache=cache, pool=pool,
+                             postprocess=_PipeHandoff(channel) if job["handoff"] else None,
+                             format_rule=job["format_rule"],
+                             tracer=_PipeTracer(channel) if job["trace"] else None,
+                             disk=_PipeDisk(channel))
+
+        def forward(d, sync=job["sync"]):
+            small = {k: d[k] for k in _FORWARDED_PROGRESS if d.get(k) is not None}
+            if not sync:
+                channel.send("hook", small)
+            elif not channel.ask("hook", small):
+                raise ytdlp().utils.DownloadError("Canceled by user")
+
+        def on_children(parent, batch):
+            channel.send("children", [_item_fields(c, with_id=False) for c in batch])
+
+        opts = dict(job["opts"], progress_hooks=[forward])
+        try:
+            runner.download(item.url, opts, item, on_children if job["expand"] else None)
+            result = (True, None)
+        except BaseException as e:
+            result = (False, str(e) or type(e).__name__)
+        current.clear()
+        channel.send("done", *result,
+                     {"title": item.title, "children": item.children, "audio": item.audio})
+    pool.close_all()
+
+
+class DownloadProcess:
+    """Parent side of one download process."""
+
+    def __init__(self, ctx, heartbeat: float):
+        child_control, self.control = ctx.Pipe(duplex=False)
+        self.events, child_events = ctx.Pipe(duplex=False)
+        self.proc = ctx.Process(target=_download_process, args=(child_control, child_events, heartbeat),
+                                name="yt-dlp-download", daemon=True)
+        self.proc.start()
+        child_control.close()
+        child_events.close()
+        self.usable = True
+
+    def run(self, job: dict, on_event, is_canceled, hang_timeout: float, cancel_grace: float) -> tuple:
+        """
+        Run one job, passing its events to on_event(msg) (whose result acks a synchronous
+        "hook"). Returns the job's ("done", ok, error, item updates) fields. Raises
+        DownloadError if the process dies, goes quiet for hang_timeout seconds, or
+        ignores a cancel for cancel_grace seconds; it is killed in the last two cases.
+        """
+        DownloadError = ytdlp().utils.DownloadError
+        self.control.send(("job", job))
+        last = time.monotonic()
+        cancel_sent = None
+        while True:
+            if self.events.poll(0.25):
+                try:
+                    msg = self.events.recv()
+                except (EOFError, OSError):
+                    self.usable = False
+                    self.proc.join(1)
+                    raise DownloadError(f"Download process exited (code {self.proc.exitcode})")
+                last = time.monotonic()
+                if msg[0] == "done":
+                    return msg[1:]
+                if msg[0] != "beat":
+                    reply = on_event(msg)
+                    if msg[0] == "space" or (msg[0] == "hook" and job["sync"]):
+                        self.control.send(("ack", reply))
+            now = time.monotonic()
+            if cancel_sent is None and is_canceled():
+                self.control.send(("cancel",))
+                cancel_sent = now
+            if cancel_sent is not None and now - cancel_sent > cancel_grace:
+                self.kill()
+                raise DownloadError("Canceled by user")
+            if now - last > hang_timeout:
+                self.kill()
+                raise DownloadError(f"Download process did not respond for {hang_timeout:.0f}s; killed")
+
+    def kill(self):
+        self.usable = False
+        _kill_tree(self.proc)
+        self.proc.join(5)
+
+    def stop(self):
+        try:
+            self.control.send(None)
+        except OSError:
+            pass
+        self.proc.join(2)
+        if self.proc.is_alive():
+            self.kill()
+
+
+class DownloadProcessPool:
+    """
+    Download processes kept warm between items (yt-dlp imported, sessions open), one
+    per concurrent download. A process that died or was killed is replaced by a new
+    one on the next acquire().
+    """
+
+    def __init__(self, hang_timeout: float = 60.0, cancel_grace: float = 3.0, heartbeat: float = 1.0):
+        self.hang_timeout = hang_timeout
+        self.cancel_grace = cancel_grace
+        self.heartbeat = heartbeat
+        self._idle: list[DownloadProcess] = []
+        self._busy: set[DownloadProcess] = set()
+        self._lock = threading.Lock()
+        self._ctx = multiprocessing.get_context("spawn")
+        self.started = 0
+
+    def acquire(self) -> DownloadProcess:
+        with self._lock:
+            while self._idle:
+                p = self._idle.pop()
+                if p.proc.is_alive():
+                    self._busy.add(p)
+                    return p
+            self.started += 1
+        p = DownloadProcess(self._ctx, self.heartbeat)
+        with self._lock:
+            self._busy.add(p)
+        return p
+
+    def release(self, p: DownloadProcess):
+        with self._lock:
+            self._busy.discard(p)
+            if p.usable:
+                self._idle.append(p)
+                return
+        p.kill()
+
+    def close(self):
+        with self._lock:
+            procs = [*self._idle, *self._busy]
+            self._idle, self._busy = [], set()
+        for p in procs:
+            p.stop()
+
+
+class ProcessRunner(YtDlpRunner):
+    """
+    YtDlpRunner whose downloads each run in a DownloadProcessPool process, so
+    extraction and yt-dlp's hooks do not compete with the UI for this process's GIL,
+    and a wedged extractor can be killed.
+
+    Progress, state, log lines, playlist entries, trace spans and handed-off files
+    stream back and go through the same code as in-process downloads: this process
+    still owns the queue, the bandwidth budget (the child waits for an ack per chunk
+    while a limit is active), fragment tuning and post-processing.
+    """
+
+    def __init__(self, *args, processes: DownloadProcessPool, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.processes = processes
+
+    def download(self, url: str, opts: dict, item: DownloadItem | None = None,
+                 on_children=None) -> list[Future]:
+        if item is None:
+            item = DownloadItem(url=url)
+        rule = self._rule(opts)
+        opts = {k: v for k, v in opts.items() if k not in SESSION_VOLATILE_KEYS}
+        dest, stage = self._stage(url, opts)
+        tuning = self.fragments.acquire(url_host(url), item.token) if self.fragments is not None else None
+        if tuning is not None:
+            opts["lease_params"] = {**opts.get("lease_params", {}), **tuning.params()}
+        job = {
+            "item": _item_fields(item), "opts": opts, "format_rule": rule,
+            "expand": on_children is not None, "handoff": self.postprocess is not None,
+            "trace": self.tracer is not None, "cache": self.cache is not None,
+            "cache_dir": self.cache.disk_dir if self.cache is not None else None,
+            "sync": self.bandwidth is not None and self.bandwidth.active,
+        }
+        item.info = None
+        # No audio target: the process sees the info dict and reports item.audio in "done".
+        hook = self._make_progress_hook(item)
+        handed_off: list[tuple[dict, dict]] = []
+        expanded = [0]
+        DownloadError = ytdlp().utils.DownloadError
+
+        def on_event(msg):
+            kind = msg[0]
+            if kind == "hook":
+                if tuning is not None:
+                    tuning.observe(msg[1])
+                try:
+                    hook(msg[1])
+                except DownloadError:
+                    return False
+                return True
+            if kind == "state":
+                self.set_state(item, msg[1])
+            elif kind == "log":
+                self.signals.log.emit(msg[1])
+            elif kind == "error":
+                self.signals.error.emit(msg[1])
+            elif kind == "children":
+                children = [DownloadItem(**f) for f in msg[1]]
+                for child in children:
+                    child.parent_id = item.id
+                expanded[0] += len(children)
+                item.children = expanded[0]
+                on_children(item, children)
+            elif kind == "record" and self.tracer is not None:
+                _, item_id, phase, start, end, label, attrs = msg
+                self.tracer.record(item_id, phase, start, end, tuple(label), **attrs)
+            elif kind == "pp":
+                handed_off.append((msg[1], msg[2]))
+            elif kind == "space":
+                return self.disk.reserve(item.id, msg[1], *msg[2])
+            return None
+
+        self.set_state(item, ItemState.EXTRACTING)
+        if self.bandwidth is not None:
+            self.bandwidth.open(item.id, 2.0 ** item.priority)
+        proc = self.processes.acquire()
+        ok = False
+        try:
+            done, error, updates = proc.run(job, on_event, lambda: self._is_canceled(item),
+                                            self.processes.hang_timeout, self.processes.cancel_grace)
+            item.title = updates["title"] or item.title
+            item.children = updates["children"]
+            item.audio = updates["audio"]
+            if not done:
+                raise DownloadError(error)
+            ok = True
+        finally:
+            self.processes.release(proc)
+            if self.bandwidth is not None:
+                self.bandwidth.close(item.id)
+            if not (ok and stage):
+                self.disk.release(item.id)
+            if stage and not ok:
+                _remove_if_empty(stage)
+            if tuning is not None:
+                line = self.fragments.release(tuning, ok or self._is_canceled(item))
+                if tuning.downloaded:
+                    self.signals.log.emit(line)
+
+        on_timing = functools.partial(self._trace_pp, item) if self.tracer is not None else None
+        futures = [self.postprocess.submit(params, info, item.id, on_timing, item.token)
+                   for params, info in handed_off]
+        if stage:
+            futures += self._finish_stage(item, stage, dest, futures, on_timing)
+        return futures
+
+
+# -----------------------------
+# Download scheduler
+# -----------------------------
+# Status codes only count after "HTTP Error" or "status", never as a bare number (a
+# size, an id, a format code).
+_THROTTLED_ERROR = re.compile(r"(?:HTTP Error|status(?: code)?:?) 429\b|too many requests|rate[- ]?limit", re.I)
+_PERMANENT_ERROR = re.compile(
+    r"(?:HTTP Error|status(?: code)?:?) 4(?!29)\d\d\b|certificate|not enough free space|"
+    r"requested format is not available", re.I)
+_TRANSIENT_ERROR = re.compile(
+    r"(?:HTTP Error|status(?: code)?:?) 5\d\d\b|timed? ?out|connection (?:reset|refused|aborted)|"
+    r"remote end closed|temporary failure|name resolution|network is unreachable|incomplete ?read|"
+    r"eof occurred|unexpected[_ ]eof|handshake|did not respond|process exited", re.I)
+
+
+def classify_error(msg: str) -> str:
+    """
+    "throttled" (HTTP 429), "transient" (5xx, timeouts, dropped connections, a TLS
+    connection cut short) or "permanent" (4xx, certificate errors, no free space, no
+    such format, private or removed videos, unsupported URLs, anything unknown).
+    """
+    if _THROTTLED_ERROR.search(msg):
+        return "throttled"
+    if _PERMANENT_ERROR.search(msg):
+        return "permanent"
+    if _TRANSIENT_ERROR.search(msg):
+        return "transient"
+    return "permanent"
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How DownloadScheduler retries failed items. A transient or throttled failure goes
+    back into the queue after base_delay * 2**(n-1) seconds (at most max_delay, give
+    or take `jitter`), up to `attempts` times, while other items keep running. A 429
+    also pauses its whole site for `cooldown` seconds, doubling while the site keeps
+    answering 429. Items that still fail get one last try once the rest of the queue
+    is done (final_pass). attempts=0 turns retrying off.
+    """
+
+    attempts: int = 3
+    base_delay: float = 5.0
+    max_delay: float = 300.0
+    jitter: float = 0.25
+    cooldown: float = 60.0
+    final_pass: bool = True
+
+    def delay(self, attempt: int) -> float:
+        base = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return base * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def host_cooldown(self, strikes: int) -> float:
+        return min(self.max_delay, self.cooldown * 2 ** (strikes - 1))
+
+
+SCHEDULE_POLICIES = ("fifo", "priority", "shortest", "mix")
+
+
+class JobQueue:
+    """
+    Pending items in the order a scheduling policy runs them:
+      fifo      queue order
+      priority  higher item.priority first, then queue order
+      shortest  higher priority first, then smallest estimated size (item.size)
+      mix       as shortest, but while no large item (size >= large) is running the
+                largest one goes next, so one big transfer keeps the link busy
+                while the small ones finish quickly around it
+    Items without an estimate count as `unknown` bytes. push_front() items (due
+    retries, items of a site that freed a slot) go before everything else.
+
+    Entries are never removed in place: requeue() (a new estimate or priority) and
+    append() of a queued item leave the old entry behind, and pop() skips entries
+    that are no longer the item's latest.
+    """
+
+    def __init__(self, policy: str = "fifo", large: int = 256 * 1024 * 1024, unknown: int = 64 * 1024 * 1024):
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError(f"unknown scheduling policy {policy!r}")
+        self.policy = policy
+        self.large = large
+        self.unknown = unknown
+        self._front: deque = deque()           # (seq, item)
+        self._fifo: deque = deque()            # (seq, item)
+        self._small: list = []                 # heap of (-priority, size or seq, seq, item)
+        self._big: list = []                   # mix only: heap of (-priority, -size, seq, item)
+        self._latest: dict[int, int] = {}      # item id -> seq of its live entry
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._latest)
+
+    def size_of(self, item) -> int:
+        return item.size if item.size is not None else self.unknown
+
+    def is_large(self, item) -> bool:
+        return self.policy == "mix" and self.size_of(item) >= self.large
+
+    def append(self, item):
+        seq = next(self._seq)
+        self._latest[item.id] = seq
+        if self.policy == "fifo":
+            self._fifo.append((seq, item))
+            return
+        order = seq if self.policy == "priority" else self.size_of(item)
+        heapq.heappush(self._small, (-item.priority, order, seq, item))
+        if self.policy == "mix":
+            heapq.heappush(self._big, (-item.priority, -self.size_of(item), seq, item))
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def push_front(self, items):
+        for item in items:
+            seq = next(self._seq)
+            self._latest[item.id] = seq
+            self._front.append((seq, item))
+
+    def requeue(self, item):
+        """Re-sort a queued item after its size or priority changed."""
+        if item.id in self._latest:
+            self.append(item)
+
+    def pop(self, large_running: bool = False):
+        """The next item, or None if the queue is empty."""
+        item = self._pop_from(self._front, deque.popleft)
+        if item is not None:
+            return item
+        if self.policy == "fifo":
+            return self._pop_from(self._fifo, deque.popleft)
+        if self.policy == "mix" and not large_running:
+            big = self._peek(self._big)
+            if big is not None and self.is_large(big):
+                return self._pop_from(self._big, heapq.heappop)
+        return self._pop_from(self._small, heapq.heappop)
+
+    def _peek(self, heap: list):
+        while heap and self._latest.get(heap[0][-1].id) != heap[0][-2]:
+            heapq.heappop(heap)
+        return heap[0][-1] if heap else None
+
+    def _pop_from(self, entries, pop):
+        while entries:
+            entry = pop(entries)
+            seq, item = entry[-2], entry[-1]
+            if self._latest.get(item.id) == seq:
+                del self._latest[item.id]
+                return item
+        return None
+
+
+def completion_stats(times: list[float]) -> tuple[float, float]:
+    """Mean and 95th percentile (nearest rank) of completion times."""
+    if not times:
+        return 0.0, 0.0
+    ordered = sorted(times)
+    return sum(ordered) / len(ordered), ordered[max(0, -(-len(ordered) * 95 // 100) - 1)]
+
+
+def simulate_schedule(jobs: list[tuple[int | None, int, int]], policy: str, workers: int,
+                      link_rate: float, stream_rate: float, overhead: float) -> list[float]:
+    """
+    Completion times (seconds from the start) of jobs, each (estimated size or None,
+    actual bytes, priority), queued at once and run by `workers` under policy. A job
+    spends `overhead` seconds (extraction, post-processing) and then transfers its
+    bytes at min(stream_rate, link_rate / transfers running).
+    """
+    queue = JobQueue(policy)
+    queue.extend(types.SimpleNamespace(id=i, size=est, priority=prio) for i, (est, _, prio) in enumerate(jobs))
+    running: dict[int, list] = {}          # id -> [overhead left, bytes left, large]
+    done: list[float] = []
+    now = 0.0
+    while len(queue) or running:
+        while len(running) < workers:
+            job = queue.pop(large_running=any(r[2] for r in running.values()))
+            if job is None:
+                break
+            running[job.id] = [overhead, float(jobs[job.id][1]), queue.is_large(job)]
+        transfers = sum(1 for r in running.values() if r[0] <= 0)
+        rate = min(stream_rate, link_rate / transfers) if transfers else 0.0
+        dt = min(r[0] if r[0] > 0 else r[1] / rate for r in running.values())
+        now += dt
+        for job_id, r in list(running.items()):
+            if r[0] > 0:
+                r[0] -= dt
+            else:
+                r[1] -= rate * dt
+            if r[0] <= 1e-9 and r[1] <= 1e-6:
+                del running[job_id]
+                done.append(now)
+    return done
+
+
+@dataclass
+class Completion:
+    queued: float               # monotonic times
+    started: float
+    finished: float
+    size: int | None            # the estimate it was scheduled with
+    downloaded: int
+    priority: int
+
+
+def schedule_report(completions: list[Completion], policy: str, workers: int) -> dict:
+    """
+    Measured mean/p95 completion time (queued to done) of a run, and the same for every
+    policy, simulated on the run's items with rates and overhead measured from it.
+    """
+    if not completions:
+        return {}
+    first = min(c.started for c in completions)
+    span = max(c.finished for c in completions) - first
+    total = sum(c.downloaded for c in completions)
+    busy = [max(1e-3, c.finished - c.started) for c in completions]
+    stream = max((c.downloaded / b for c, b in zip(completions, busy)), default=0.0) or 1.0
+    link = max(stream, total / span if span > 0 else 0.0)
+    overhead = statistics.median(max(0.0, b - c.downloaded / stream) for c, b in zip(completions, busy))
+    jobs = [(c.size, c.downloaded, c.priority) for c in completions]
+    mean, p95 = completion_stats([c.finished - c.queued for c in completions])
+    report = {"policy": policy, "items": len(completions), "mean": mean, "p95": p95,
+              "link_rate": link, "stream_rate": stream, "overhead": overhead, "simulated": {}}
+    for name in SCHEDULE_POLICIES:
+        sim_mean, sim_p95 = completion_stats(simulate_schedule(jobs, name, workers, link, stream, overhead))
+        report["simulated"][name] = {"mean": sim_mean, "p95": sim_p95}
+    return report
+
+
+def format_schedule_report(report: dict) -> str:
+    if not report:
+        return ""
+    lines = [
+        f"Completion time ({report['policy']}, {report['items']} item(s)): mean "
+        f"{human_duration(report['mean'])}, p95 {human_duration(report['p95'])}",
+        f"Simulated at {human_bytes(report['link_rate'])}/s total, {human_bytes(report['stream_rate'])}/s "
+        f"per download, {report['overhead']:.1f}s overhead:",
+    ]
+    lines += [f"  {name:<9} mean {human_duration(s['mean'])}, p95 {human_duration(s['p95'])}"
+              for name, s in report["simulated"].items()]
+    return "\n".join(lines) + "\n"
+
+
+class DownloadScheduler:
+    """
+    Runs queued items on a pool of worker threads.
+
+    Items may be submitted or discarded while the pool is draining. Workers exit once
+    the job queue is empty and no item is running; after that, submit() returns False.
+    Discarding is O(1): the item leaves the pending set and its stale queue entry is
+    skipped when it reaches the front.
+
+    With host_limit, at most that many items per site run at once. An item whose site
+    is full is parked on a per-host deque and goes back to the front of the queue when
+    one of that site's items finishes, so other sites are not held up behind it.
+
+    Each submitted item gets a CancelToken under the scheduler's queue token. Cancel
+    latency (request to CANCELED) is logged and traced as the "cancel" phase.
+
+    Failures are retried per `retry` (see RetryPolicy): a retry waits on a heap of
+    due times and rejoins the front of the queue when due; an item of a site in 429
+    cool-down waits there until the cool-down ends. Workers stay up while retries are
+    waiting, and run() ends with a summary of what still failed.
+
+    `policy` orders the queue (see JobQueue). For "shortest" and "mix", `estimators`
+    threads extract queued items ahead of their turn to estimate their size
+    (YtDlpRunner.estimate_size); an item is re-sorted when its estimate arrives.
+    run() ends with a completion-time report (see schedule_report).
+
+    An item with its own `opts` runs with those instead of run()'s base_opts; its
+    playlist entries inherit them. With keep_alive, workers wait for more items
+    instead of exiting when the queue is empty, and run() only returns after
+    cancel_all() - for a long-lived queue such as the daemon's (see ytdlp_daemon).
+    Each time the queue goes idle, the items that ran out of retries get their
+    final pass.
+    """
+
+    def __init__(self, signals: CoreSignals, workers: int = 3, host_limit: int = 0,
+                 retry: RetryPolicy | None = None, policy: str = "fifo", estimators: int = 4,
+                 keep_alive: bool = False):
+        self.signals = signals
+        self.workers = max(1, workers)
+        self.host_limit = max(0, host_limit)
+        self.retry = retry if retry is not None else RetryPolicy()
+        self._jobs = JobQueue(policy)
+        self.estimators = estimators if policy in ("shortest", "mix") else 0
+        self.keep_alive = keep_alive
+        self._pending: set[int] = set()
+        lock = threading.RLock()
+        self._cond = threading.Condition(lock)
+        self._estimate_ready = threading.Condition(lock)
+        self._to_estimate: deque[DownloadItem] = deque()
+        self._large_running: set[int] = set()
+        self._queued_at: dict[int, float] = {}
+        self._started_at: dict[int, float] = {}
+        self._completions: list[Completion] = []
+        self.report: dict = {}
+        self._active: dict[int, DownloadItem] = {}
+        self._finishing: dict[int, DownloadItem] = {}   # downloaded, in post-processing
+        self.token = CancelToken()
+        self._host_active: dict[str, int] = {}
+        self._parked: dict[str, deque[DownloadItem]] = {}
+        self._canceled = False
+        self._drained = False
+        self._counter = itertools.count(1)
+        self._delayed: list[tuple[float, int, DownloadItem]] = []   # (due, seq, item) heap
+        self._delay_seq = itertools.count()
+        self._cooldown: dict[str, float] = {}      # host -> monotonic end of its 429 pause
+        self._strikes: dict[str, int] = {}         # host -> 429s in a row
+        self._retry_later: dict[int, DownloadItem] = {}   # out of retries, for the final pass
+        self._final_pass = False
+        self._failed: dict[int, DownloadItem] = {}
+        # Playlist parent id -> keys of the entries it queued, so a retried expansion
+        # only queues what an earlier attempt did not get to. Kept while it may retry.
+        self._children_seen: dict[int, set[str]] = {}
+
+    def submit(self, item: DownloadItem) -> bool:
+        with self._cond:
+            if self._drained or self._canceled:
+                return False
+            if item.id in self._pending or item.id in self._active:
+                return True
+            item.token = CancelToken(self.token)
+            item.progress = 0.0
+            item.attempts = 0
+            self._pending.add(item.id)
+            self._queued_at[item.id] = time.monotonic()
+            self._jobs.append(item)
+            self._want_estimates([item])
+            self._cond.notify()
+        if item.state != ItemState.PENDING:
+            item.state = ItemState.PENDING
+            self.signals.item_state.emit(item.id, ItemState.PENDING)
+        return True
+
+    def discard(self, item: DownloadItem):
+        """Drop a pending item, or cancel it if it is already running."""
+        with self._cond:
+            if self._unqueue(item):
+                return
+        self.cancel_item(item)
+
+    def cancel_item(self, item: DownloadItem):
+        with self._cond:
+            pending = self._unqueue(item)
+            if not pending and item.id not in self._active and item.id not in self._finishing:
+                return
+        item.token.cancel()
+        if pending:
+            item.state = ItemState.CANCELED
+            self.signals.item_state.emit(item.id, ItemState.CANCELED)
+
+    def _unqueue(self, item: DownloadItem) -> bool:
+        """
+        Take item out of wherever it waits: the queue, the retry backoff or the final
+        pass. Returns whether it was pending. Holds _cond.
+        """
+        self._retry_later.pop(item.id, None)
+        if item.id not in self._pending:
+            return False
+        self._pending.discard(item.id)
+        if any(entry[2] is item for entry in self._delayed):
+            # Workers may be sleeping until this retry is due; let them see it is gone.
+            self._delayed = [entry for entry in self._delayed if entry[2] is not item]
+            heapq.heapify(self._delayed)
+            self._cond.notify_all()
+        return True
+
+    def reprioritize(self, item: DownloadItem):
+        """Re-sort a pending item after its priority changed."""
+        with self._cond:
+            if item.id in self._pending:
+                self._jobs.requeue(item)
+
+    def _want_estimates(self, items: list[DownloadItem]):
+        """Hand items without a size estimate to the estimator threads. Holds _cond."""
+        if self.estimators:
+            self._to_estimate.extend(it for it in items if it.size is None)
+            self._estimate_ready.notify_all()
+
+    def _add_children(self, parent: DownloadItem, children: list[DownloadItem]):
+        with self._cond:
+            if self._canceled or parent.token.canceled:
+                return
+            seen = self._children_seen.setdefault(parent.id, set())
+            fresh = []
+            for child in children:
+                key = normalize_url(child.url) if child.url else f"id:{(child.info or {}).get('id')}"
+                if key not in seen:
+                    seen.add(key)
+                    fresh.append(child)
+            children = fresh
+            if not children:
+                return
+            now = time.monotonic()
+            for child in children:
+                child.opts = parent.opts
+            self._queued_at.update((child.id, now) for child in children)
+            self._jobs.extend(children)
+            self._pending.update(child.id for child in children)
+            self._want_estimates(children)
+            self._cond.notify_all()
+        self.signals.items_added.emit(parent.id, children)
+
+    def cancel_all(self):
+        with self._cond:
+            self._canceled = True
+            running = [*self._active.values(), *self._finishing.values()]
+            self._cond.notify_all()
+            self._estimate_ready.notify_all()
+        self.token.cancel()
+        # Running items already see the queue token; this runs their callbacks (ffmpeg).
+        for item in running:
+            item.token.cancel()
+
+    def _take_runnable(self) -> DownloadItem | None:
+        now = time.monotonic()
+        due = []
+        while self._delayed and self._delayed[0][0] <= now:
+            due.append(heapq.heappop(self._delayed)[2])
+        self._jobs.push_front(due)
+        while (item := self._jobs.pop(large_running=bool(self._large_running))) is not None:
+            if item.id not in self._pending:
+                continue
+            if self._cooldown:
+                host = url_host(item.url)
+                until = self._cooldown.get(host, 0.0)
+                if until > now:
+                    heapq.heappush(self._delayed, (until, next(self._delay_seq), item))
+                    continue
+                self._cooldown.pop(host, None)
+            if self.host_limit:
+                host = url_host(item.url)
+                if self._host_active.get(host, 0) >= self.host_limit:
+                    self._parked.setdefault(host, deque()).append(item)
+                    continue
+            return item
+        return None
+
+    def _next_job(self) -> DownloadItem | None:
+        with self._cond:
+            while True:
+                item = None if self._canceled else self._take_runnable()
+                if item is not None:
+                    break
+                # Nothing runnable: wait for running items (they may add playlist entries
+                # or free a host slot) and for retries to come due, or finish when none
+                # are left - after one last pass over the items that ran out of retries.
+                if self._canceled or not (self._active or self._delayed or self._start_final_pass()):
+                    if self.keep_alive and not self._canceled:
+                        self._final_pass = False   # later failures get a final pass of their own
+                        self._cond.wait()
+                        continue
+                    self._drained = True
+                    self._cond.notify_all()
+                    self._estimate_ready.notify_all()
+                    return None
+                if self._jobs:
+                    continue   # the final pass just started
+                self._cond.wait(max(0.0, self._delayed[0][0] - time.monotonic()) if self._delayed else None)
+            self._pending.discard(item.id)
+            self._active[item.id] = item
+            self._started_at[item.id] = time.monotonic()
+            if self._jobs.is_large(item):
+                self._large_running.add(item.id)
+            if self.host_limit:
+                host = url_host(item.url)
+                self._host_active[host] = self._host_active.get(host, 0) + 1
+            return item
+
+    def _start_final_pass(self) -> bool:
+        """Queue the final retry pass, once; False if there is nothing to retry. Holds _cond."""
+        if self._final_pass or not self._retry_later:
+            return False
+        self._final_pass = True
+        items, self._retry_later = list(self._retry_later.values()), {}
+        self._jobs.extend(items)
+        self._pending.update(item.id for item in items)
+        self._cooldown.clear()
+        self.signals.log.emit(f"Final retry pass: {len(items)} item(s).\n")
+        return True
+
+    def _release_host(self, item: DownloadItem):
+        host = url_host(item.url)
+        left = self._host_active.get(host, 0) - 1
+        if left > 0:
+            self._host_active[host] = left
+        else:
+            self._host_active.pop(host, None)
+        parked = self._parked.pop(host, None)
+        if parked:
+            self._jobs.push_front(parked)
+
+    def _worker(self, runner: YtDlpRunner, base_opts: dict):
+        while True:
+            item = self._next_job()
+            if item is None:
+                return
+            try:
+                self._run_item(runner, base_opts, item)
+            finally:
+                with self._cond:
+                    self._active.pop(item.id, None)
+                    self._large_running.discard(item.id)
+                    if self.host_limit:
+                        self._release_host(item)
+                    self._cond.notify_all()
+
+    def _run_item(self, runner: YtDlpRunner, base_opts: dict, item: DownloadItem):
+        n = next(self._counter)
+        self.signals.item_started.emit(item.url)
+        self.signals.log.emit(f"\n--- [#{n}] {item.url} ---\n")
+
+        opts = dict(base_opts if item.opts is None else item.opts)
+        try:
+            deferred = runner.download(item.url, opts, item, on_children=self._add_children)
+        except ytdlp().utils.DownloadError as e:
+            msg = str(e)
+            if "Canceled by user" in msg or item.token.canceled:
+                # Also whatever a killed ffmpeg made the postprocessor report.
+                self._settle_canceled(runner, item)
+                return
+            self._failed_attempt(runner, item, msg)
+            return
+        except Exception as e:
+            if item.token.canceled:
+                self._settle_canceled(runner, item)
+                return
+            self._failed_attempt(runner, item, str(e) or type(e).__name__)
+            return
+
+        with self._cond:
+            self._strikes.pop(url_host(item.url), None)
+            self._failed.pop(item.id, None)
+        item.error = ""
+        if deferred:
+            self._finish_after(runner, item, deferred)
+            return
+        self._settle_done(runner, item)
+
+    def _failed_attempt(self, runner: YtDlpRunner, item: DownloadItem, msg: str):
+        """Requeue item after a backoff if the error looks temporary, else fail it."""
+        kind = classify_error(msg)
+        item.attempts += 1
+        item.error = msg
+        self.signals.log.emit(f"Error: {msg}\n")
+        policy = self.retry
+        now = time.monotonic()
+        with self._cond:
+            wait = 0.0
+            if kind == "throttled":
+                host = url_host(item.url)
+                strikes = self._strikes[host] = self._strikes.get(host, 0) + 1
+                until = max(self._cooldown.get(host, 0.0), now + policy.host_cooldown(strikes))
+                self._cooldown[host] = until
+                wait = until - now
+            retry = (kind != "permanent" and not self._canceled and not item.token.canceled
+                     and not self._final_pass)
+            if retry and item.attempts <= policy.attempts:
+                wait = max(wait, policy.delay(item.attempts))
+                self._pending.add(item.id)
+                heapq.heappush(self._delayed, (now + wait, next(self._delay_seq), item))
+                self._cond.notify_all()
+            else:
+                wait = None
+                if retry and policy.attempts and policy.final_pass:
+                    self._retry_later[item.id] = item
+                self._failed[item.id] = item
+                self._forget(item)
+        if wait is None:
+            runner.set_state(item, ItemState.FAILED)
+            return
+        runner.set_state(item, ItemState.PENDING)
+        self.signals.log.emit(f"Retrying in {wait:.0f}s ({kind}, attempt {item.attempts + 1} of "
+                              f"{policy.attempts + 1}): {item.url}\n")
+
+    def failure_summary(self) -> str:
+        """What is still failed, one line per item, after run()."""
+        failed = [it for it in self._failed.values() if it.state == ItemState.FAILED]
+        if not failed:
+            return ""
+        lines = [f"Still failed: {len(failed)} item(s)"]
+        lines += [f"  {it.url} ({classify_error(it.error)}, {it.attempts} attempt(s)): {it.error}"
+                  for it in failed]
+        return "\n".join(lines) + "\n"
+
+    def _finish_after(self, runner: YtDlpRunner, item: DownloadItem, futures: list[Future]):
+        """Settle item once its files are through the post-processing stage; the worker moves on."""
+        remaining = [len(futures)]
+        lock = threading.Lock()
+        with self._cond:
+            self._finishing[item.id] = item
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            with self._cond:
+                self._finishing.pop(item.id, None)
+            if any(f.cancelled() for f in futures) or item.token.canceled:
+                self._settle_canceled(runner, item)
+                return
+            errors = [f.exception() for f in futures if f.exception() is not None]
+            if errors:
+                item.error = str(errors[0])
+                with self._cond:
+                    self._failed[item.id] = item
+                runner.set_state(item, ItemState.FAILED)
+                self.signals.log.emit(f"Post-processing failed: {item.url}: {errors[0]}\n")
+                return
+            self._settle_done(runner, item)
+
+        for f in futures:
+            f.add_done_callback(on_done)
+
+    def _settle_done(self, runner: YtDlpRunner, item: DownloadItem):
+        downloaded, _ = runner.progress.item_bytes(item.id)
+        now = time.monotonic()
+        with self._cond:
+            self._completions.append(Completion(
+                self._queued_at.get(item.id, now), self._started_at.get(item.id, now), now,
+                item.size, downloaded, item.priority))
+            self._forget(item)
+            self._children_seen.pop(item.id, None)
+        item.progress = 100.0
+        runner.set_state(item, ItemState.DONE)
+        self.signals.item_done.emit(item.url)
+
+    def _estimator(self, runner: YtDlpRunner, base_opts: dict):
+        while True:
+            with self._cond:
+                while not (self._to_estimate or self._drained or self._canceled):
+                    self._estimate_ready.wait()
+                if self._drained or self._canceled:
+                    return
+                item = self._to_estimate.popleft()
+                if item.id not in self._pending or item.size is not None:
+                    continue
+            try:
+                size = runner.estimate_size(item, base_opts if item.opts is None else item.opts)
+            except Exception:
+                size = None   # the download will report what is wrong
+            with self._cond:
+                item.size = size
+                if item.id in self._pending:
+                    self._jobs.requeue(item)
+            self.signals.item_estimated.emit(item.id, size)
+
+    def _forget(self, item: DownloadItem):
+        """Drop item's timestamps once it is settled; a long-lived queue would keep them all. Holds _cond."""
+        self._queued_at.pop(item.id, None)
+        self._started_at.pop(item.id, None)
+
+    def _settle_canceled(self, runner: YtDlpRunner, item: DownloadItem):
+        with self._cond:
+            self._forget(item)
+            self._children_seen.pop(item.id, None)
+        phase = item.state
+        runner.set_state(item, ItemState.CANCELED)
+        since = item.token.canceled_at
+        if since is None:
+            self.signals.log.emit(f"Canceled: {item.url}\n")
+            return
+        now = time.time()
+        self.signals.log.emit(f"Canceled: {item.url} ({now - since:.2f}s after the request, while {phase})\n")
+        if runner.tracer is not None:
+            runner.tracer.record(item.id, "cancel", since, now, ("phase", phase))
+
+    def run(self, runner: YtDlpRunner, base_opts: dict):
+        """
+        Block until every submitted item has finished (or the run was canceled);
+        with keep_alive, until cancel_all().
+        """
+        threads = [
+            threading.Thread(target=self._worker, args=(runner, base_opts), daemon=True)
+            for _ in range(self.workers)
+        ]
+        for _ in range(self.estimators):
+            threading.Thread(target=self._estimator, args=(runner, base_opts), name="size-estimate",
+                             daemon=True).start()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if runner.postprocess is not None:
+            if self._canceled:
+                runner.postprocess.cancel_all()
+            runner.postprocess.join()
+        if runner.staging is not None:
+            runner.staging.mover.join()
+        if self._canceled:
+            self.signals.log.emit("Canceled before next item.\n")
+        summary = self.failure_summary()
+        if summary:
+            self.signals.log.emit(summary)
+        self.report = schedule_report(self._completions, self._jobs.policy, self.workers)
+        if self.report:
+            self.signals.log.emit(format_schedule_report(self.report))
+
+
+# -----------------------------
+# Download options
+# -----------------------------
+@dataclass
+class DownloadOptions:
+    """
+    Everything the user can configure, independent of any widgets.
+    Saved and loaded as a JSON "profile" so the GUI and batch mode share settings.
+    """
+
+    out_dir: str = os.path.expanduser("~/Downloads")
+    format: str = "best"
+    format_rule: str = ""            # e.g. "height<=1080; prefer h264+aac"; overrides format
+    allow_playlists: bool = True
+    rate_limit: str = ""             # total for all downloads, e.g. "2M"
+    rate_schedule: str = ""          # time-of-day overrides, e.g. "09:00-18:00=1M"
+    cookies: str = ""
+    workers: int = 3
+    host_limit: int = 0              # parallel downloads per site; 0 = no cap
+    fragments: int = 0               # parallel HLS/DASH fragments; 0 = auto-tune
+    isolate_downloads: bool = False  # each download in a worker process (ProcessRunner)
+    staging: bool = False            # download to local scratch, then move (StagingArea)
+    retries: int = 3                 # yt-dlp's own retries per request and per fragment
+    retry_attempts: int = 3          # requeues after a transient failure; 0 = off (RetryPolicy)
+    schedule: str = "fifo"           # queue order: fifo, priority, shortest or mix (JobQueue)
+    staging_dir: str = ""            # default: app data "staging"
+
+    subtitles: bool = False
+    auto_subtitles: bool = False
+    sub_langs: str = "en"
+
+    embed_metadata: bool = False
+    embed_thumbnail: bool = False
+    write_info_json: bool = False
+    use_archive: bool = True
+    record_metrics: bool = False     # phase trace and Prometheus metrics (see Tracer)
+
+    extract_audio: bool = False
+    audio_format: str = "mp3"
+    audio_bitrate: str = "192K"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DownloadOptions":
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def load(cls, path: str) -> "DownloadOptions":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def parsed_format_rule(self) -> FormatRule | None:
+        """The format rule, or None if there is none. Raises ValueError if it is invalid."""
+        if not self.format_rule.strip():
+            return None
+        rule = FormatRule.parse(self.format_rule, audio_only=self.extract_audio)
+        # After the rule's own preferences: a source ffmpeg can copy instead of re-encoding.
+        codec = AUDIO_TARGETS.get(self.audio_format, (None,))[0] if self.extract_audio else None
+        if codec and codec not in rule.prefer:
+            rule.prefer.append(codec)
+        return rule
+
+    def audio_warning(self) -> str | None:
+        """Why "Extract audio" may fail with the ffmpeg at hand, or None."""
+        if not self.extract_audio:
+            return None
+        caps = ffmpeg_caps(default_ffmpeg_dir())
+        if caps.ffmpeg is None:
+            return "Extract audio needs ffmpeg, which was not found."
+        if caps.can_encode(self.audio_format):
+            return None
+        codec = AUDIO_TARGETS.get(self.audio_format, (None,))[0]
+        if codec is None:
+            return f"ffmpeg {caps.version} has no {self.audio_format} encoder; audio extraction will fail."
+        return (f"ffmpeg {caps.version} has no {self.audio_format} encoder; only videos with "
+                f"{codec} audio can be extracted (by copying the stream).")
+
+    def rate_budget(self) -> tuple[int | None, list[tuple[int, int, int | None]]]:
+        """Arguments for BandwidthLimiter.configure()."""
+        return parse_rate_limit(self.rate_limit), parse_rate_schedule(self.rate_schedule)
+
+    def retry_policy(self) -> RetryPolicy:
+        return RetryPolicy(attempts=max(0, self.retry_attempts))
+
+    def staging_root(self) -> str | None:
+        return (self.staging_dir.strip() or app_data_dir("staging")) if self.staging else None
+
+    def archive_path(self) -> str | None:
+        return os.path.join(app_data_dir(), "archive.txt") if self.use_archive else None
+
+    def to_ydl_opts(self) -> dict:
+        """yt-dlp options. With extract_audio, the first call probes ffmpeg: keep it off the UI thread."""
+        outdir = self.out_dir.strip()
+
+        opts: dict = {
+            # Relative to "home", which a staged download swaps for its staging folder.
+            "paths": {"home": outdir},
+            "outtmpl": "%(title)s.%(ext)s",
+            "noplaylist": not self.allow_playlists,
+            "retries": self.retries,
+            "fragment_retries": self.retries,
+            "continuedl": True,
+            "quiet": True,
+            "no_warnings": True,
+        }
+
+        # ffmpeg/ffprobe location (bundled preferred)
+        ffdir = default_ffmpeg_dir()
+        if ffdir:
+            opts["ffmpeg_location"] = ffdir
+
+        # Rate limit: enforced across all downloads by BandwidthLimiter, not per download
+        # with yt-dlp's "ratelimit". Small fixed reads keep its sleeps short and even.
+        if parse_rate_limit(self.rate_limit) is not None or parse_rate_schedule(self.rate_schedule):
+            opts["buffersize"] = 64 * 1024
+            opts["noresizebuffer"] = True
+
+        # Fragment concurrency; when 0, FragmentTuner sets it per download
+        if self.fragments > 0:
+            opts["concurrent_fragment_downloads"] = self.fragments
+
+        # Cookies
+        cookies = self.cookies.strip()
+        if cookies:
+            opts["cookiefile"] = cookies
+
+        # Format choice
+        if self.format and self.format != "best":
+            # An ID picked from one video's list; other items may not have it.
+            opts["format"] = f"{self.format}/bv*+ba/b"
+        else:
+            opts["format"] = "bv*+ba/b"
+
+        # Subtitles
+        if self.subtitles:
+            langs = [s.strip() for s in self.sub_langs.split(",") if s.strip()]
+            if langs:
+                opts["subtitleslangs"] = langs
+            opts["writesubtitles"] = True
+            if self.auto_subtitles:
+                opts["writeautomaticsub"] = True
+
+        if self.embed_thumbnail:
+            opts["writethumbnail"] = True
+        if self.write_info_json:
+            opts["writeinfojson"] = True
+
+        # Download archive: finished IDs are skipped before any network extraction
+        if self.use_archive:
+            opts["download_archive"] = self.archive_path()
+
+        # Postprocessors, in the order yt-dlp's CLI applies them: audio extraction,
+        # then metadata, then the thumbnail (which needs the final container).
+        postprocessors = []
+        if self.extract_audio:
+            abr = self.audio_bitrate.replace("K", "")
+            opts["format"] = audio_format_spec(self.audio_format, ffmpeg_caps(ffdir))
+            postprocessors.append({
+                "key": "FFmpegExtractAudio",
+                "preferredcodec": self.audio_format,
+                "preferredquality": abr,
+            })
+        if self.embed_metadata:
+            postprocessors.append({"key": "FFmpegMetadata", "add_metadata": True, "add_chapters": True})
+        if self.embed_thumbnail:
+            postprocessors.append({"key": "EmbedThumbnail"})
+        if postprocessors:
+            opts["postprocessors"] = postprocessors
+
+        return opts
@@ -0,0 +1,493 @@
+# ytdlp_daemon.py
+# Background download service: one long-lived pipeline (yt-dlp imported once, warm
+# YoutubeDL sessions, info cache, worker pools) that takes jobs over a small JSON HTTP
+# API on localhost, so a script or the GUI does not pay for a fresh process per download.
+#
+#   python ytdlp_gui.py --daemon --profile profile.json [--port 8765]
+#
+# The port and an access token are written to <app data>/daemon.json, readable by this
+# user only; every request needs "Authorization: Bearer <token>".
+#
+#   POST   /jobs              {"url": ..., "profile": {...}, "priority": 0} -> job
+#   GET    /jobs[?ids=1,2]    jobs, oldest first
+#   GET    /jobs/<id>         one job
+#   POST   /jobs/<id>/cancel  cancel a job and its playlist entries
+#   DELETE /jobs/<id>         cancel a job if it is still running, then forget it
+#   GET    /status            queue totals and throughput
+#
+# A job's profile is laid over the daemon's and sets what is downloaded (format, rule,
+# output folder, audio, subtitles...); parallelism, rate limits, staging and separate
+# processes are the daemon's. The log goes to stderr.
+
+import os
+import sys
+import json
+import time
+import signal
+import secrets
+import argparse
+import threading
+import http.client
+import http.server
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit, parse_qs
+
+from ytdlp_core import (
+    app_data_dir, preload_yt_dlp,
+    CoreSignals, ItemState, DownloadItem, DownloadOptions, InfoCache, ProgressAggregator, SCHEDULE_POLICIES,
+    YdlSessionPool, PostProcessPool, BandwidthLimiter, FragmentTuner, Tracer, YtDlpRunner, DownloadScheduler,
+    DownloadProcessPool, ProcessRunner, StagingArea,
+)
+
+MAX_BODY = 1024 * 1024
+FINISHED = (ItemState.DONE, ItemState.FAILED, ItemState.CANCELED)
+
+
+def daemon_file() -> str:
+    return os.path.join(app_data_dir(), "daemon.json")
+
+
+@dataclass
+class Job:
+    item: DownloadItem                  # the submitted URL
+    submitted: float                    # time.time()
+    entries: list[DownloadItem] = field(default_factory=list)   # playlist entries, nested ones too
+    downloaded: dict[int, int] = field(default_factory=dict)    # item id -> bytes, once its files are down
+
+    def state(self) -> str:
+        root = self.item
+        if not self.entries or root.state != ItemState.DONE:
+            return root.state   # a single video, a playlist still expanding, or failed/canceled as a whole
+        states = {e.state for e in self.entries}
+        if states & set(ItemState.ACTIVE):
+            return ItemState.DOWNLOADING
+        if ItemState.PENDING in states:
+            return ItemState.PENDING
+        if ItemState.FAILED in states:
+            return ItemState.FAILED
+        if states == {ItemState.CANCELED}:
+            return ItemState.CANCELED
+        return ItemState.DONE
+
+
+class DownloadDaemon:
+    """
+    A DownloadScheduler in keep_alive mode plus the job bookkeeping behind the HTTP API.
+
+    Each job is one queue item; a playlist's entries are tracked under the job that
+    queued them. Finished jobs are kept for status queries, up to `keep` of them.
+    """
+
+    def __init__(self, options: DownloadOptions, keep: int = 1000, tracer: Tracer | None = None):
+        self.options = options
+        self.keep = keep
+        self.started = time.time()
+        self.signals = CoreSignals()
+        self.signals.log.connect(lambda text: (sys.stderr.write(text), sys.stderr.flush()))
+        self.signals.error.connect(lambda msg: sys.stderr.write(f"ERROR: {msg}\n"))
+        self.signals.items_added.connect(self._on_added)
+        self.signals.item_state.connect(self._on_state)
+        self._lock = threading.Lock()
+        self._jobs: dict[int, Job] = {}          # job id (its item's id) -> job, oldest first
+        self._job_of: dict[int, Job] = {}        # item id -> job, entries included
+        self._profiles: dict[str, dict] = {}     # profile JSON -> yt-dlp options
+
+        self.pool = YdlSessionPool()
+        self.progress = ProgressAggregator()
+        self.postprocess = PostProcessPool()
+        self.processes = DownloadProcessPool() if options.isolate_downloads else None
+        self.staging = StagingArea(options.staging_root()) if options.staging else None
+        self.tracer = tracer
+        runner_cls, isolate = (
+            (ProcessRunner, {"processes": self.processes}) if self.processes else (YtDlpRunner, {}))
+        cache = InfoCache(disk_dir=app_data_dir("info-cache"))
+        self.runner = runner_cls(self.signals, lambda: False, cache=cache, pool=self.pool,
+                                 progress=self.progress, postprocess=self.postprocess,
+                                 bandwidth=BandwidthLimiter(*options.rate_budget()),
+                                 fragments=FragmentTuner() if options.fragments == 0 else None,
+                                 format_rule=options.parsed_format_rule(), tracer=tracer,
+                                 staging=self.staging, **isolate)
+        self.scheduler = DownloadScheduler(self.signals, workers=options.workers, host_limit=options.host_limit,
+                                           retry=options.retry_policy(), policy=options.schedule,
+                                           keep_alive=True)
+        self._thread = threading.Thread(target=self.scheduler.run, args=(self.runner, options.to_ydl_opts()),
+                                        name="daemon-queue", daemon=True)
+
+    def start(self):
+        preload_yt_dlp()
+        self._thread.start()
+
+    def close(self):
+        self.scheduler.cancel_all()
+        self._thread.join()
+        self.pool.close_all()
+        self.postprocess.close()
+        if self.processes is not None:
+            self.processes.close()
+        if self.staging is not None:
+            self.staging.close()
+        if self.tracer is not None:
+            self.tracer.close()
+
+    def _job_opts(self, profile: dict) -> dict:
+        """
+        yt-dlp options for a job's profile, laid over the daemon's. Raises ValueError
+        if the profile is invalid. Cached: clients tend to send the same few profiles.
+        """
+        key = json.dumps(profile, sort_keys=True)
+        with self._lock:
+            opts = self._profiles.get(key)
+        if opts is not None:
+            return opts
+        try:
+            options = DownloadOptions.from_dict({**self.options.to_dict(), **profile})
+            rule = options.parsed_format_rule()
+            if not os.path.isdir(options.out_dir):
+                raise ValueError(f"output folder does not exist: {options.out_dir}")
+            opts = {**options.to_ydl_opts(), "format_rule": rule}
+        except (TypeError, AttributeError) as e:
+            raise ValueError(f"invalid profile: {e}") from e
+        with self._lock:
+            if len(self._profiles) >= 64:
+                self._profiles.clear()
+            self._profiles[key] = opts
+        return opts
+
+    def submit(self, url: str, profile: dict | None = None, priority: int = 0) -> dict:
+        """Queue url as a new job. Raises ValueError for a bad request."""
+        if not isinstance(url, str) or not url.strip():
+            raise ValueError("url is required")
+        if profile is not None and not isinstance(profile, dict):
+            raise ValueError("profile must be an object")
+        if isinstance(priority, bool) or not isinstance(priority, int):
+            raise ValueError("priority must be an integer")
+        item = DownloadItem(url=url.strip(), priority=priority)
+        if profile:
+            item.opts = self._job_opts(profile)
+        job = Job(item, time.time())
+        with self._lock:
+            self._jobs[item.id] = job
+            self._job_of[item.id] = job
+            self._prune()
+        if not self.scheduler.submit(item):
+            raise ValueError("the daemon is shutting down")
+        return self.describe(job)
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond `keep`. Holds _lock."""
+        excess = len(self._jobs) - self.keep
+        if excess <= 0:
+            return
+        for job_id, job in list(self._jobs.items()):
+            if excess <= 0:
+                break
+            if job.state() in FINISHED:
+                self._forget(job)
+                excess -= 1
+
+    def _forget(self, job: Job):
+        self._jobs.pop(job.item.id, None)
+        for item in (job.item, *job.entries):
+            self._job_of.pop(item.id, None)
+
+    def _on_added(self, parent_id: int, children: list):
+        with self._lock:
+            job = self._job_of.get(parent_id)
+            if job is None:
+                return
+            job.entries.extend(children)
+            for child in children:
+                self._job_of[child.id] = job
+
+    def _on_state(self, item_id: int, state: str):
+        # The aggregator forgets an item once it settles; keep its byte count for the job.
+        if state != ItemState.POSTPROCESSING:
+            return
+        downloaded, _ = self.progress.item_bytes(item_id)
+        with self._lock:
+            job = self._job_of.get(item_id)
+            if job is not None and downloaded:
+                job.downloaded[item_id] = downloaded
+
+    def describe(self, job: Job) -> dict:
+        root = job.item
+        videos = [e for e in job.entries if not e.children] if job.entries else [root]
+        downloaded = sum(self.progress.item_bytes(it.id)[0] or job.downloaded.get(it.id, 0)
+                         for it in (root, *job.entries))
+        speed = sum(it.speed or 0.0 for it in videos if it.state == ItemState.DOWNLOADING)
+        progress = sum(it.progress for it in videos) / len(videos) if videos else 0.0
+        entries: dict[str, int] = {}
+        for e in job.entries:
+            entries[e.state] = entries.get(e.state, 0) + 1
+        failed = [e for e in videos if e.state == ItemState.FAILED]
+        return {
+            "id": root.id, "url": root.url, "title": root.title, "state": job.state(),
+            "progress": round(progress, 1), "downloaded": downloaded, "speed": speed or None,
+            "priority": root.priority, "entries": entries, "submitted": job.submitted,
+            "error": root.error or (failed[0].error if failed else ""),
+        }
+
+    def jobs(self, ids: list[int] | None = None) -> list[dict]:
+        with self._lock:
+            jobs = list(self._jobs.values()) if ids is None else [self._jobs[i] for i in ids if i in self._jobs]
+        return [self.describe(job) for job in jobs]
+
+    def job(self, job_id: int) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return self.describe(job) if job is not None else None
+
+    def cancel(self, job_id: int, forget: bool = False) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if forget:
+                self._forget(job)
+        # The job's item first, so an expanding playlist stops adding entries.
+        for item in (job.item, *list(job.entries)):
+            self.scheduler.cancel_item(item)
+        return self.describe(job)
+
+    def status(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        states: dict[str, int] = {}
+        for job in jobs:
+            state = job.state()
+            states[state] = states.get(state, 0) + 1
+        pending = sum(1 for job in jobs for it in (job.item, *job.entries) if it.state == ItemState.PENDING)
+        st = self.progress.snapshot(pending_items=pending)
+        return {"pid": os.getpid(), "uptime": round(time.time() - self.started, 1), "jobs": states,
+                "workers": self.scheduler.workers, "active": st.active, "pending": pending,
+                "completed": st.completed, "bytes_done": st.bytes_done, "throughput": round(st.throughput, 1),
+                "eta": st.eta and round(st.eta, 1)}
+
+
+class ApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "DaemonServer"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            raise ValueError("request body too large")
+        data = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(data, dict):
+            raise ValueError("expected a JSON object")
+        return data
+
+    def _handle(self, method: str):
+        if not secrets.compare_digest(self.headers.get("Authorization", ""), f"Bearer {self.server.token}"):
+            self._reply(401, {"error": "missing or wrong token (see daemon.json)"})
+            return
+        daemon = self.server.daemon
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        try:
+            if parts == ["status"] and method == "GET":
+                self._reply(200, daemon.status())
+            elif parts == ["jobs"] and method == "GET":
+                ids = parse_qs(url.query).get("ids")
+                self._reply(200, {"jobs": daemon.jobs(
+                    [int(i) for i in ids[0].split(",") if i] if ids else None)})
+            elif parts == ["jobs"] and method == "POST":
+                body = self._body()
+                self._reply(201, daemon.submit(body.get("url"), body.get("profile"), body.get("priority", 0)))
+            elif len(parts) in (2, 3) and parts[0] == "jobs" and parts[1].isdigit():
+                job_id = int(parts[1])
+                if len(parts) == 2 and method == "GET":
+                    job = daemon.job(job_id)
+                elif len(parts) == 2 and method == "DELETE":
+                    job = daemon.cancel(job_id, forget=True)
+                elif parts[2:] == ["cancel"] and method == "POST":
+                    job = daemon.cancel(job_id)
+                else:
+                    self._reply(405, {"error": f"{method} not allowed on {url.path}"})
+                    return
+                if job is None:
+                    self._reply(404, {"error": f"no job {job_id}"})
+                else:
+                    self._reply(200, job)
+            else:
+                self._reply(404, {"error": f"no such endpoint: {method} {url.path}"})
+        except ValueError as e:   # also bad JSON
+            self._reply(400, {"error": str(e)})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class DaemonServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, daemon: DownloadDaemon, port: int = 0):
+        super().__init__(("127.0.0.1", port), ApiHandler)
+        self.daemon = daemon
+        self.token = secrets.token_urlsafe(24)
+
+    def publish(self, path: str):
+        """Write the address and token for clients, readable by this user only."""
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"port": self.server_address[1], "token": self.token, "pid": os.getpid()}, f)
+
+
+class DaemonClient:
+    """
+    Client for a running daemon; stdlib only, so the GUI can use it without extra deps.
+    Network problems raise OSError; a request the daemon rejects raises ValueError.
+    """
+
+    def __init__(self, port: int, token: str, host: str = "127.0.0.1", timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.timeout = timeout
+
+    @classmethod
+    def find(cls, timeout: float = 1.0) -> "DaemonClient | None":
+        """A client for the daemon in daemon.json, or None if none is running."""
+        try:
+            with open(daemon_file(), encoding="utf-8") as f:
+                info = json.load(f)
+            client = cls(info["port"], info["token"], timeout=timeout)
+            client.status()
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        client.timeout = 5.0
+        return client
+
+    def _call(self, method: str, path: str, body: dict | None = None) -> dict:
+        # One connection per call: cheap on localhost, and safe from any thread.
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            data = json.dumps(body).encode() if body is not None else None
+            headers = {"Authorization": f"Bearer {self.token}"}
+            if data is not None:
+                headers["Content-Type"] = "application/json"
+            conn.request(method, path, data, headers)
+            resp = conn.getresponse()
+            result = json.loads(resp.read() or b"{}")
+        finally:
+            conn.close()
+        if resp.status >= 400:
+            raise ValueError(result.get("error") or f"HTTP {resp.status}")
+        return result
+
+    def status(self) -> dict:
+        return self._call("GET", "/status")
+
+    def submit(self, url: str, profile: dict | None = None, priority: int = 0) -> dict:
+        return self._call("POST", "/jobs", {"url": url, "profile": profile, "priority": priority})
+
+    def jobs(self, ids: list[int] | None = None) -> list[dict]:
+        query = f"?ids={','.join(map(str, ids))}" if ids is not None else ""
+        return self._call("GET", f"/jobs{query}")["jobs"]
+
+    def job(self, job_id: int) -> dict:
+        return self._call("GET", f"/jobs/{job_id}")
+
+    def cancel(self, job_id: int) -> dict:
+        return self._call("POST", f"/jobs/{job_id}/cancel")
+
+    def forget(self, job_id: int) -> dict:
+        return self._call("DELETE", f"/jobs/{job_id}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="ytdlp_gui.py --daemon",
+        description="Run downloads for local clients over a JSON HTTP API.",
+    )
+    parser.add_argument("--daemon", action="store_true", help="run the daemon (the default here)")
+    parser.add_argument("--port", type=int, default=0, help="port on 127.0.0.1 (default: any free one)")
+    parser.add_argument("--profile", metavar="JSON",
+                        help="default options, and the daemon's workers, rate limits and staging")
+    parser.add_argument("--workers", type=int, help="override the number of parallel downloads")
+    parser.add_argument("--schedule", choices=SCHEDULE_POLICIES, help="queue order (default: the profile's)")
+    parser.add_argument("--keep", type=int, default=1000, metavar="N",
+                        help="finished jobs kept for status queries (default: 1000)")
+    parser.add_argument("--trace", metavar="FILE", help="append per-phase timing spans (JSON lines)")
+    parser.add_argument("--metrics", metavar="FILE", help="write Prometheus-format metrics")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        options = DownloadOptions.load(args.profile) if args.profile else DownloadOptions()
+        if args.workers:
+            options.workers = args.workers
+        if args.schedule:
+            options.schedule = args.schedule
+        options.parsed_format_rule()
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Invalid profile: {e}", file=sys.stderr)
+        return 2
+    if options.schedule not in SCHEDULE_POLICIES:
+        print(f"Invalid profile: unknown schedule {options.schedule!r}", file=sys.stderr)
+        return 2
+    if not os.path.isdir(options.out_dir):
+        print(f"Output folder does not exist: {options.out_dir}", file=sys.stderr)
+        return 2
+    if args.trace or args.metrics:
+        tracer = Tracer(args.trace, args.metrics)
+    elif options.record_metrics:
+        tracer = Tracer.in_app_data()
+    else:
+        tracer = None
+
+    running = DaemonClient.find()
+    if running is not None:
+        print(f"A daemon is already running on port {running.port}.", file=sys.stderr)
+        return 1
+    try:
+        daemon = DownloadDaemon(options, keep=args.keep, tracer=tracer)
+        server = DaemonServer(daemon, args.port)
+    except OSError as e:
+        print(f"Cannot start the daemon: {e}", file=sys.stderr)
+        return 2
+    path = daemon_file()
+    server.publish(path)
+    daemon.start()
+    print(f"Listening on http://127.0.0.1:{server.server_address[1]} (token in {path})", file=sys.stderr)
+
+    def on_term(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, on_term)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        print("Shutting down…", file=sys.stderr)
+        daemon.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
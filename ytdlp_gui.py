@@ -14,93 +14,53 @@
 #     --add-binary "vendor/ffmpeg/ffmpeg:." \
 #     --add-binary "vendor/ffmpeg/ffprobe:." \
 #     ytdlp_gui.py
+#
+# Headless (no Qt is imported):
+#   python ytdlp_gui.py --batch urls.txt --profile profile.json
+#   python ytdlp_gui.py --sync --profile profile.json
+#   python ytdlp_gui.py --daemon --profile profile.json   # JSON HTTP API on localhost
 
+import io
 import os
-import re
 import sys
+
+if __name__ == "__main__":
+    # Post-processing runs in spawned processes; a frozen app must hand those off first.
+    import multiprocessing
+    multiprocessing.freeze_support()
+    # Dispatch batch and daemon mode before anything pulls in PySide6.
+    if "--daemon" in sys.argv[1:]:
+        from ytdlp_daemon import main as daemon_main
+        sys.exit(daemon_main(sys.argv[1:]))
+    if {"--batch", "--sync", "--add-source", "--remove-source", "--list-sources"} & set(sys.argv[1:]):
+        from ytdlp_batch import main as batch_main
+        sys.exit(batch_main(sys.argv[1:]))
+
 import time
-import shutil
+import logging
 import threading
-from dataclasses import dataclass
+import logging.handlers
+import queue as queue_mod
+from collections import deque
 
-from PySide6.QtCore import Qt, Signal, QObject
+from PySide6.QtCore import Qt, Signal, QObject, QTimer, QAbstractItemModel, QModelIndex
 from PySide6.QtGui import QTextCursor
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout,
-    QLabel, QLineEdit, QTextEdit, QPushButton, QFileDialog, QComboBox, QCheckBox,
-    QProgressBar, QListWidget, QListWidgetItem, QMessageBox, QGroupBox
+    QLabel, QLineEdit, QTextEdit, QPlainTextEdit, QPushButton, QFileDialog, QComboBox,
+    QCheckBox, QProgressBar, QTreeView, QMessageBox, QGroupBox, QSpinBox,
+    QAbstractItemView
 )
 
-import yt_dlp
-
-
-# -----------------------------
-# Utilities
-# -----------------------------
-def safe_strip_lines(text: str) -> list[str]:
-    return [ln.strip() for ln in text.splitlines() if ln.strip()]
-
-
-def human_bytes(n: float | None) -> str:
-    if n is None:
-        return "?"
-    units = ["B", "KB", "MB", "GB", "TB"]
-    u = 0
-    n = float(n)
-    while n >= 1024 and u < len(units) - 1:
-        n /= 1024
-        u += 1
-    return f"{n:.2f} {units[u]}"
-
-
-def parse_rate_limit(s: str) -> int | None:
-    """
-    Convert strings like "500K", "2M", "1.5M", "3G" to bytes/sec.
-    Returns None if empty/invalid.
-    """
-    s = s.strip()
-    if not s:
-        return None
-    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMG])?B?", s, re.IGNORECASE)
-    if not m:
-        return None
-    val = float(m.group(1))
-    unit = (m.group(2) or "").upper()
-    mult = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}.get(unit, 1)
-    return int(val * mult)
-
-
-def bundled_ffmpeg_dir() -> str | None:
-    """
-    If packaged (PyInstaller), returns the directory containing bundled ffmpeg/ffprobe.
-    If running from source, returns None.
-
-    Expected bundled locations:
-      .../YourApp.app/Contents/MacOS/ffmpeg
-      .../YourApp.app/Contents/MacOS/ffprobe
-    """
-    exe_dir = os.path.dirname(sys.executable)  # .../.app/Contents/MacOS
-    ffmpeg_path = os.path.join(exe_dir, "ffmpeg")
-    ffprobe_path = os.path.join(exe_dir, "ffprobe")
-
-    if os.path.exists(ffmpeg_path) and os.access(ffmpeg_path, os.X_OK):
-        # ffprobe is optional, but recommended to bundle as well
-        if os.path.exists(ffprobe_path) and os.access(ffprobe_path, os.X_OK):
-            return exe_dir
-        # still usable with ffmpeg alone:
-        return exe_dir
-
-    return None
-
-
-def best_effort_system_ffmpeg_dir() -> str | None:
-    """
-    Dev fallback: if system ffmpeg exists, return its directory (for yt-dlp 'ffmpeg_location').
-    """
-    sys_ffmpeg = shutil.which("ffmpeg")
-    if not sys_ffmpeg:
-        return None
-    return os.path.dirname(sys_ffmpeg)
+from ytdlp_core import (
+    safe_strip_lines, human_bytes, app_data_dir, normalize_url, iter_urls, url_list_kind, read_archive,
+    ItemState, DownloadItem, CancelToken, ExtractorMatcher, UrlImporter, InfoCache, QueueJournal,
+    ProgressAggregator, format_queue_stats, SourceStore, SourceSync, SCHEDULE_POLICIES,
+    YdlSessionPool, PostProcessPool, BandwidthLimiter, FragmentTuner, Tracer, opts_key,
+    YtDlpRunner, DownloadScheduler, DownloadOptions, preload_yt_dlp, preload_ffmpeg_caps,
+    DownloadProcessPool, ProcessRunner, StagingArea,
+)
+from ytdlp_daemon import DaemonClient
 
 
 # -----------------------------
@@ -108,115 +68,340 @@ def best_effort_system_ffmpeg_dir() -> str | None:
 # -----------------------------
 class WorkerSignals(QObject):
     log = Signal(str)
-    progress = Signal(float, str)  # percent, status
     formats_ready = Signal(list)   # list of (format_id, display)
     item_started = Signal(str)
     item_done = Signal(str)
+    item_state = Signal(int, str)            # item id, ItemState value
+    items_added = Signal(int, list)          # parent item id, list[DownloadItem]
+    item_estimated = Signal(int, object)     # item id, estimated bytes or None
     error = Signal(str)
     finished = Signal()
 
 
-@dataclass
-class DownloadItem:
-    url: str
-
-
 # -----------------------------
-# yt-dlp runner
+# Log buffering
 # -----------------------------
-class YtDlpRunner:
-    def __init__(self, signals: WorkerSignals, get_cancel_flag):
-        self.signals = signals
-        self.get_cancel_flag = get_cancel_flag
-        self._last_update = 0.0
-
-    def _progress_hook(self, d):
-        if self.get_cancel_flag():
-            raise yt_dlp.utils.DownloadError("Canceled by user")
-
-        status = d.get("status")
-        if status == "downloading":
-            now = time.time()
-            if now - self._last_update < 0.15:
-                return
-            self._last_update = now
+LOG_MAX_LINES = 5000
+LOG_PENDING_CHARS = 1024 * 1024   # log text held between flushes
+LOG_FLUSH_MS = 100
+LOG_FILE_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+PROGRESS_REFRESH_MS = 250
+# Imported items are inserted on a timer. QTreeView lays out every row again after a
+# top-level insert (~8 µs per row here), so the interval grows with the queue to keep
+# that to about a third of the UI thread's time.
+IMPORT_FLUSH_MS = 250
+IMPORT_FLUSH_ROWS_PER_MS = 50
+DAEMON_POLL_S = 0.5
+
+
+class LogBuffer:
+    """
+    Collects log text from any thread without touching the UI.
 
-            total = d.get("total_bytes") or d.get("total_bytes_estimate")
-            downloaded = d.get("downloaded_bytes", 0)
-            pct = (downloaded / total * 100.0) if total else 0.0
+    The GUI drains it on a timer and appends the batch in one go. Every line is also
+    handed to a rotating log file on a background thread, so the on-screen view can
+    drop old lines without losing anything. Text waiting for the next drain is capped
+    at max_chars; the oldest goes first, and drain() says how much was skipped.
+    """
 
-            speed = d.get("speed")
-            eta = d.get("eta")
-            msg = (
-                f"{pct:5.1f}%  |  {human_bytes(downloaded)} / {human_bytes(total)}"
-                f"  |  {human_bytes(speed)}/s  |  ETA {eta if eta is not None else '?'}s"
+    def __init__(self, max_chars: int = LOG_PENDING_CHARS, log_path: str | None = None):
+        self._pending: deque[str] = deque()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.max_chars = max_chars
+        self.dropped = 0   # characters dropped since the last drain
+        self.log_path = log_path
+        self._listener: logging.handlers.QueueListener | None = None
+        self._logger: logging.Logger | None = None
+        if log_path:
+            handler = logging.handlers.RotatingFileHandler(
+                log_path, maxBytes=LOG_FILE_BYTES, backupCount=LOG_FILE_BACKUPS, encoding="utf-8"
             )
-            self.signals.progress.emit(pct, msg)
-
-        elif status == "finished":
-            self.signals.progress.emit(100.0, "Download finished. Post-processing…")
-
-    def list_formats(self, url: str, base_opts: dict):
-        opts = dict(base_opts)
-        opts.update({"skip_download": True, "quiet": True, "no_warnings": True})
-
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-
-        fmts = []
-        for f in (info.get("formats") or []):
-            fid = f.get("format_id", "")
-            ext = f.get("ext", "")
-            res = f.get("resolution") or ""
-            note = f.get("format_note") or ""
-
-            acodec = f.get("acodec") or ""
-            vcodec = f.get("vcodec") or ""
-            abr = f.get("abr")
-            tbr = f.get("tbr")
-            fps = f.get("fps")
-            filesize = f.get("filesize") or f.get("filesize_approx")
-
-            flags = []
-            if vcodec and vcodec != "none":
-                flags.append(vcodec)
-            if acodec and acodec != "none":
-                flags.append(acodec)
-            if abr:
-                flags.append(f"abr:{abr}")
-            if tbr:
-                flags.append(f"tbr:{tbr}")
-            if fps:
-                flags.append(f"{fps}fps")
-            if filesize:
-                flags.append(human_bytes(filesize))
-
-            flags_txt = " | ".join(flags)
-            display = f"{fid:>5}  {ext:<4}  {res:<10}  {note:<12}  {flags_txt}"
-            fmts.append((fid, display))
-
-        def sort_key(tup):
-            _, display = tup
-            m = re.search(r"(\d{3,4})p", display)
-            p = int(m.group(1)) if m else 0
-            return (-p, display)
-
-        fmts.sort(key=sort_key)
-        self.signals.formats_ready.emit(fmts)
-
-    def download(self, url: str, opts: dict):
-        opts = dict(opts)
-        hooks = list(opts.get("progress_hooks", []))
-        hooks.append(self._progress_hook)
-        opts["progress_hooks"] = hooks
-
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            ydl.download([url])
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            records: queue_mod.SimpleQueue = queue_mod.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(records, handler)
+            self._listener.start()
+            self._logger = logging.getLogger(f"yt-dlp-gui.log.{id(self)}")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            self._logger.addHandler(logging.handlers.QueueHandler(records))
+
+    def write(self, text: str):
+        if not text:
+            return
+        with self._lock:
+            if len(text) > self.max_chars:
+                self.dropped += len(text) - self.max_chars
+                text = text[-self.max_chars:]
+            self._pending.append(text)
+            self._chars += len(text)
+            while self._chars > self.max_chars:
+                old = self._pending.popleft()
+                self._chars -= len(old)
+                self.dropped += len(old)
+        if self._logger:
+            for line in text.splitlines():
+                if line.strip():
+                    self._logger.info(line)
+
+    def drain(self) -> str:
+        """Pending text, after a note of how much was dropped since the last drain."""
+        with self._lock:
+            if not self._pending and not self.dropped:
+                return ""
+            text = "".join(self._pending)
+            dropped, self.dropped = self.dropped, 0
+            self._pending.clear()
+            self._chars = 0
+        if dropped:
+            where = f"; the full log is in {self.log_path}" if self.log_path else ""
+            text = f"[{dropped:,} characters of log output skipped{where}]\n" + text
+        return text
+
+    def close(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
 
 
 # -----------------------------
 # GUI
 # -----------------------------
+class QueueModel(QAbstractItemModel):
+    """
+    Queue items as a tree (playlist entries under their parent), addressed by item id.
+
+    Rows live in one list per parent, with an id -> row map so index()/parent() are
+    O(1). Inserts are batched into one beginInsertRows per call, and removals into
+    one beginRemoveRows per contiguous run followed by a single compaction pass.
+    A normalized-URL index rejects duplicates.
+    """
+
+    FINISHED = (ItemState.DONE, ItemState.FAILED, ItemState.CANCELED)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._items: dict[int, DownloadItem] = {}
+        self._rows: dict[int | None, list[DownloadItem]] = {None: []}
+        self._row_of: dict[int, int] = {}
+        self._keys: dict[str, int] = {}
+        self._key_of: dict[int, str] = {}
+        # Running totals so overall progress doesn't need a full scan.
+        self._states: dict[int, str] = {}
+        self._finished = 0
+        self._active: set[int] = set()
+
+    # --- Qt model interface
+    def index(self, row, column, parent=QModelIndex()):
+        parent_id = parent.internalId() if parent.isValid() else None
+        rows = self._rows.get(parent_id)
+        if rows is None or not 0 <= row < len(rows) or column != 0:
+            return QModelIndex()
+        return self.createIndex(row, column, rows[row].id)
+
+    def parent(self, index=None):
+        if index is None:
+            return QObject.parent(self)
+        if not index.isValid():
+            return QModelIndex()
+        item = self._items.get(index.internalId())
+        if item is None or item.parent_id is None or item.parent_id not in self._items:
+            return QModelIndex()
+        return self.createIndex(self._row_of[item.parent_id], 0, item.parent_id)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() and parent.column() != 0:
+            return 0
+        return len(self._rows.get(parent.internalId() if parent.isValid() else None, ()))
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item = self._items.get(index.internalId())
+        if item is None:
+            return None
+        if role == Qt.DisplayRole:
+            return self.row_text(item)
+        if role == Qt.ToolTipRole:
+            return item.url
+        return None
+
+    @staticmethod
+    def row_text(item: DownloadItem) -> str:
+        label = item.title or item.url
+        if item.children:
+            return f"[playlist, {item.children} items] {label}"
+        if item.state == ItemState.DOWNLOADING:
+            speed = f" {human_bytes(item.speed)}/s" if item.speed else ""
+            return f"[{item.progress:5.1f}%{speed}] {label}"
+        if item.state == ItemState.PENDING:
+            hints = []
+            if item.size:
+                hints.append(f"~{human_bytes(item.size)}")
+            if item.priority:
+                hints.append(f"priority {item.priority:+d}")
+            return f"{label}  ({', '.join(hints)})" if hints else label
+        return f"[{item.state}] {label}"
+
+    # --- queue operations
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def get(self, item_id: int) -> DownloadItem | None:
+        return self._items.get(item_id)
+
+    def first(self) -> DownloadItem | None:
+        top = self._rows[None]
+        return top[0] if top else None
+
+    def index_of(self, item: DownloadItem) -> QModelIndex:
+        row = self._row_of.get(item.id)
+        if row is None:
+            return QModelIndex()
+        return self.createIndex(row, 0, item.id)
+
+    def contains_url(self, url: str) -> bool:
+        return normalize_url(url) in self._keys
+
+    def add_items(self, items: list[DownloadItem], parent_id: int | None = None) -> list[DownloadItem]:
+        """Append items under parent_id (None = top level); returns the ones that weren't duplicates."""
+        if parent_id is not None and parent_id not in self._items:
+            return []
+        fresh = []
+        keys = []
+        seen: set[str] = set()
+        for item in items:
+            key = normalize_url(item.url)
+            if key in self._keys or key in seen:
+                continue
+            seen.add(key)
+            fresh.append(item)
+            keys.append(key)
+        if not fresh:
+            return []
+
+        rows = self._rows[parent_id]
+        start = len(rows)
+        parent_index = self.index_of(self._items[parent_id]) if parent_id is not None else QModelIndex()
+        self.beginInsertRows(parent_index, start, start + len(fresh) - 1)
+        for offset, (item, key) in enumerate(zip(fresh, keys)):
+            item.parent_id = parent_id
+            rows.append(item)
+            self._rows[item.id] = []
+            self._items[item.id] = item
+            self._row_of[item.id] = start + offset
+            self._keys[key] = item.id
+            self._key_of[item.id] = key
+            self._track(item)
+        self.endInsertRows()
+        return fresh
+
+    def remove_items(self, items: list[DownloadItem]) -> list[DownloadItem]:
+        """Remove items and their descendants; returns everything that was removed."""
+        doomed: dict[int, DownloadItem] = {}
+        stack = [it for it in items if it.id in self._items]
+        while stack:
+            item = stack.pop()
+            if item.id in doomed:
+                continue
+            doomed[item.id] = item
+            stack.extend(self._rows.get(item.id, ()))
+        if not doomed:
+            return []
+
+        by_parent: dict[int | None, list[int]] = {}
+        for item in doomed.values():
+            # Descendants of a removed item go away with their parent's row.
+            if item.parent_id is None or item.parent_id not in doomed:
+                by_parent.setdefault(item.parent_id, []).append(self._row_of[item.id])
+
+        # Deepest lists first, so parent rows are still valid while children are removed.
+        for parent_id in sorted(by_parent, key=self._depth, reverse=True):
+            rows_to_drop = sorted(by_parent[parent_id], reverse=True)
+            parent_index = self.index_of(self._items[parent_id]) if parent_id is not None else QModelIndex()
+            rows = self._rows[parent_id]
+            # One notification per contiguous run, highest rows first.
+            run_end = run_start = rows_to_drop[0]
+            for row in rows_to_drop[1:] + [None]:
+                if row is not None and row == run_start - 1:
+                    run_start = row
+                    continue
+                self.beginRemoveRows(parent_index, run_start, run_end)
+                del rows[run_start:run_end + 1]
+                self.endRemoveRows()
+                if row is not None:
+                    run_end = run_start = row
+            for i in range(rows_to_drop[-1], len(rows)):
+                self._row_of[rows[i].id] = i
+
+        for item in doomed.values():
+            self._items.pop(item.id, None)
+            self._rows.pop(item.id, None)
+            self._row_of.pop(item.id, None)
+            key = self._key_of.pop(item.id, None)
+            if self._keys.get(key) == item.id:
+                del self._keys[key]
+            self._untrack(item)
+        return list(doomed.values())
+
+    def _depth(self, item_id: int | None) -> int:
+        depth = 0
+        while item_id is not None:
+            depth += 1
+            item_id = self._items[item_id].parent_id
+        return depth
+
+    def clear(self):
+        self.beginResetModel()
+        self._items.clear()
+        self._rows = {None: []}
+        self._row_of.clear()
+        self._keys.clear()
+        self._key_of.clear()
+        self._states.clear()
+        self._finished = 0
+        self._active.clear()
+        self.endResetModel()
+
+    def item_changed(self, item_id: int):
+        item = self._items.get(item_id)
+        if item is None:
+            return
+        self._untrack(item)
+        self._track(item)
+        index = self.createIndex(self._row_of[item_id], 0, item_id)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def _track(self, item: DownloadItem):
+        self._states[item.id] = item.state
+        if item.state in self.FINISHED:
+            self._finished += 1
+        elif item.state in ItemState.ACTIVE:
+            self._active.add(item.id)
+
+    def _untrack(self, item: DownloadItem):
+        state = self._states.pop(item.id, None)
+        if state in self.FINISHED:
+            self._finished -= 1
+        self._active.discard(item.id)
+
+    def pending_count(self) -> int:
+        return len(self._items) - self._finished - len(self._active)
+
+    def overall_progress(self) -> float:
+        if not self._items:
+            return 0.0
+        running = sum(self._items[i].progress for i in self._active)
+        return (self._finished * 100.0 + running) / len(self._items)
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -226,7 +411,27 @@ class MainWindow(QMainWindow):
         self.signals = WorkerSignals()
         self.cancel_flag = False
         self.current_thread: threading.Thread | None = None
-        self.queue: list[DownloadItem] = []
+        self.import_thread: threading.Thread | None = None
+        self.import_token = CancelToken()
+        self.imported: deque[list[DownloadItem]] = deque()   # batches from the import thread
+        self.url_matcher = ExtractorMatcher()   # kept warm across imports
+        self.queue = QueueModel(self)
+        self.scheduler: DownloadScheduler | None = None
+        self.daemon: DaemonClient | None = None    # set while the queue runs in a daemon
+        self.daemon_jobs: dict[int, int] = {}      # item id -> daemon job id
+        self.daemon_cancel = False                 # Cancel clicked; closing the window leaves the jobs running
+        self.info_cache = InfoCache(disk_dir=app_data_dir("info-cache"))
+        self.session_pool = YdlSessionPool()
+        self.postprocess_pool = PostProcessPool()
+        self.download_processes = DownloadProcessPool()
+        self.bandwidth = BandwidthLimiter()
+        self.fragment_tuner = FragmentTuner()
+        self.tracer: Tracer | None = None     # opened on first use of "Record timings"
+        self.staging: StagingArea | None = None   # opened on first use of "Stage locally"
+        self.staging_dir = ""                 # from a loaded profile; no widget
+        self.progress_stats = ProgressAggregator()
+        self.journal = QueueJournal(os.path.join(app_data_dir(), "queue.db"))
+        self.sources = SourceStore(os.path.join(app_data_dir(), "sources.db"))
 
         root = QWidget()
         self.setCentralWidget(root)
@@ -247,24 +452,55 @@ class MainWindow(QMainWindow):
         add_row = QHBoxLayout()
         left.addLayout(add_row)
         self.btn_add = QPushButton("Add to queue")
+        self.btn_import = QPushButton("Import file…")
         self.btn_clear_input = QPushButton("Clear input")
+        self.btn_save_sources = QPushButton("Save as sources")
+        self.btn_save_sources.setToolTip("Remember these channel/playlist URLs for \"Sync sources\"")
+        self.btn_sync = QPushButton("Sync sources")
+        self.btn_sync.setToolTip("Queue only what is new in the saved channels and playlists since the last sync")
         add_row.addWidget(self.btn_add)
+        add_row.addWidget(self.btn_import)
         add_row.addWidget(self.btn_clear_input)
+        add_row.addWidget(self.btn_save_sources)
+        add_row.addWidget(self.btn_sync)
 
         right = QVBoxLayout()
         top.addLayout(right, 1)
 
         right.addWidget(QLabel("Queue"))
-        self.queue_list = QListWidget()
+        self.queue_list = QTreeView()
+        self.queue_list.setModel(self.queue)
+        self.queue_list.setHeaderHidden(True)
+        self.queue_list.setUniformRowHeights(True)
+        self.queue_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
         right.addWidget(self.queue_list)
 
         qbtns = QHBoxLayout()
         right.addLayout(qbtns)
         self.btn_remove = QPushButton("Remove selected")
+        self.btn_cancel_selected = QPushButton("Cancel selected")
         self.btn_clear_queue = QPushButton("Clear queue")
         qbtns.addWidget(self.btn_remove)
+        qbtns.addWidget(self.btn_cancel_selected)
         qbtns.addWidget(self.btn_clear_queue)
 
+        order_row = QHBoxLayout()
+        right.addLayout(order_row)
+        self.schedule = QComboBox()
+        labels = ("Queue order", "Priority", "Smallest first", "Mix large + small")
+        for policy, text in zip(SCHEDULE_POLICIES, labels):
+            self.schedule.addItem(text, policy)
+        self.schedule.setToolTip(
+            "Which item runs next. Smallest first and Mix estimate each item's size ahead of\n"
+            "its download; Mix keeps one large download running alongside small ones."
+        )
+        self.btn_priority_up = QPushButton("Priority +")
+        self.btn_priority_down = QPushButton("Priority −")
+        order_row.addWidget(QLabel("Order:"))
+        order_row.addWidget(self.schedule, 1)
+        order_row.addWidget(self.btn_priority_up)
+        order_row.addWidget(self.btn_priority_down)
+
         # Options
         opts_box = QGroupBox("Options")
         main.addWidget(opts_box)
@@ -274,9 +510,15 @@ class MainWindow(QMainWindow):
         grid.addWidget(QLabel("Output folder"), 0, 0)
         self.out_dir = QLineEdit(os.path.expanduser("~/Downloads"))
         self.btn_browse = QPushButton("Browse")
+        self.chk_staging = QCheckBox("Stage locally")
+        self.chk_staging.setToolTip(
+            "Download and post-process on the local disk, then move finished files to the\n"
+            "output folder in the background (for network or external drives)."
+        )
         out_row = QHBoxLayout()
         out_row.addWidget(self.out_dir)
         out_row.addWidget(self.btn_browse)
+        out_row.addWidget(self.chk_staging)
         out_wrap = QWidget()
         out_wrap.setLayout(out_row)
         grid.addWidget(out_wrap, 0, 1, 1, 3)
@@ -286,9 +528,18 @@ class MainWindow(QMainWindow):
         self.format_combo = QComboBox()
         self.format_combo.addItem("best (default)", "best")
         self.btn_list_formats = QPushButton("List formats for first URL")
+        self.format_rule = QLineEdit("")
+        self.format_rule.setPlaceholderText(
+            "Rule per item, e.g. height<=1080; prefer h264+aac; size<500M; else smallest")
+        self.format_rule.setToolTip(
+            "Picks a format for each item from its own format list; overrides the format above.\n"
+            "Constraints: height, width, fps, size, tbr, abr, vbr (< <= > >= = !=), ext/vcodec/acodec (= !=).\n"
+            "prefer <codecs or exts>   else best|smallest|fail   audio"
+        )
         fmt_row = QHBoxLayout()
         fmt_row.addWidget(self.format_combo, 2)
         fmt_row.addWidget(self.btn_list_formats, 1)
+        fmt_row.addWidget(self.format_rule, 3)
         fmt_wrap = QWidget()
         fmt_wrap.setLayout(fmt_row)
         grid.addWidget(fmt_wrap, 1, 1, 1, 3)
@@ -326,10 +577,16 @@ class MainWindow(QMainWindow):
         self.chk_metadata = QCheckBox("Embed metadata")
         self.chk_thumbnail = QCheckBox("Embed thumbnail")
         self.chk_infojson = QCheckBox("Write info JSON (chapters/metadata)")
+        self.chk_archive = QCheckBox("Skip already downloaded (archive)")
+        self.chk_archive.setChecked(True)
+        self.chk_metrics = QCheckBox("Record timings")
+        self.chk_metrics.setToolTip("Write a per-phase trace (trace.jsonl) and Prometheus metrics (metrics.prom)")
         extras_row = QHBoxLayout()
         extras_row.addWidget(self.chk_metadata)
         extras_row.addWidget(self.chk_thumbnail)
         extras_row.addWidget(self.chk_infojson)
+        extras_row.addWidget(self.chk_archive)
+        extras_row.addWidget(self.chk_metrics)
         extras_wrap = QWidget()
         extras_wrap.setLayout(extras_row)
         grid.addWidget(extras_wrap, 4, 1, 1, 3)
@@ -339,10 +596,50 @@ class MainWindow(QMainWindow):
         self.chk_playlist.setChecked(True)
         self.rate_limit = QLineEdit("")
         self.rate_limit.setPlaceholderText("e.g. 2M (optional)")
+        self.rate_limit.setToolTip("Total for all downloads together")
+        self.rate_schedule = QLineEdit("")
+        self.rate_schedule.setPlaceholderText("e.g. 09:00-18:00=1M")
+        self.rate_schedule.setToolTip(
+            "Time-of-day limits, comma-separated: HH:MM-HH:MM=RATE (or =unlimited).\n"
+            "Outside these windows the rate limit applies."
+        )
+        self.workers = QSpinBox()
+        self.workers.setRange(1, 16)
+        self.workers.setValue(3)
+        self.host_limit = QSpinBox()
+        self.host_limit.setRange(0, 16)
+        self.host_limit.setSpecialValueText("any")
+        self.host_limit.setToolTip("Parallel downloads from the same site")
+        self.fragments = QSpinBox()
+        self.fragments.setRange(0, 16)
+        self.fragments.setSpecialValueText("auto")
+        self.fragments.setToolTip("Parallel fragments for HLS/DASH streams; auto tunes per site")
+        self.retries = QSpinBox()
+        self.retries.setRange(0, 10)
+        self.retries.setValue(3)
+        self.retries.setSpecialValueText("off")
+        self.retries.setToolTip("Retries for timeouts, server errors and 429s, with growing delays;\n"
+                                "what still fails gets one more try at the end of the queue")
+        self.chk_isolate = QCheckBox("Separate processes")
+        self.chk_isolate.setToolTip(
+            "Run each download in its own worker process: keeps the window responsive\n"
+            "under load, and a stuck download is killed and its worker restarted."
+        )
         perf_row = QHBoxLayout()
         perf_row.addWidget(self.chk_playlist)
         perf_row.addWidget(QLabel("Rate limit:"))
         perf_row.addWidget(self.rate_limit)
+        perf_row.addWidget(QLabel("Schedule:"))
+        perf_row.addWidget(self.rate_schedule)
+        perf_row.addWidget(QLabel("Parallel downloads:"))
+        perf_row.addWidget(self.workers)
+        perf_row.addWidget(QLabel("Per site:"))
+        perf_row.addWidget(self.host_limit)
+        perf_row.addWidget(QLabel("Fragments:"))
+        perf_row.addWidget(self.fragments)
+        perf_row.addWidget(QLabel("Retries:"))
+        perf_row.addWidget(self.retries)
+        perf_row.addWidget(self.chk_isolate)
         perf_wrap = QWidget()
         perf_wrap.setLayout(perf_row)
         grid.addWidget(perf_wrap, 5, 1, 1, 3)
@@ -359,14 +656,32 @@ class MainWindow(QMainWindow):
         cookies_wrap.setLayout(cookies_row)
         grid.addWidget(cookies_wrap, 6, 1, 1, 3)
 
+        # Profiles (same JSON the headless --batch mode reads)
+        grid.addWidget(QLabel("Profile"), 7, 0)
+        self.btn_save_profile = QPushButton("Save profile…")
+        self.btn_load_profile = QPushButton("Load profile…")
+        profile_row = QHBoxLayout()
+        profile_row.addWidget(self.btn_save_profile)
+        profile_row.addWidget(self.btn_load_profile)
+        profile_row.addStretch(1)
+        profile_wrap = QWidget()
+        profile_wrap.setLayout(profile_row)
+        grid.addWidget(profile_wrap, 7, 1, 1, 3)
+
         # Run buttons
         run_row = QHBoxLayout()
         main.addLayout(run_row)
         self.btn_download = QPushButton("Download queue")
         self.btn_cancel = QPushButton("Cancel")
         self.btn_cancel.setEnabled(False)
+        self.chk_daemon = QCheckBox("Send to daemon")
+        self.chk_daemon.setToolTip(
+            "Hand the queue to a running download daemon (ytdlp_gui.py --daemon) and follow\n"
+            "its progress here; downloads go on after this window is closed."
+        )
         run_row.addWidget(self.btn_download)
         run_row.addWidget(self.btn_cancel)
+        run_row.addWidget(self.chk_daemon)
 
         # Progress + status
         self.progress = QProgressBar()
@@ -378,42 +693,150 @@ class MainWindow(QMainWindow):
 
         # Log
         main.addWidget(QLabel("Log"))
-        self.log = QTextEdit()
+        self.log = QPlainTextEdit()
         self.log.setReadOnly(True)
+        self.log.setMaximumBlockCount(LOG_MAX_LINES)
         main.addWidget(self.log, 1)
+        self.log_buffer = LogBuffer(log_path=os.path.join(app_data_dir("logs"), "yt-dlp-gui.log"))
+        self.log_timer = QTimer(self)
+        self.log_timer.setInterval(LOG_FLUSH_MS)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start()
+        self.progress_timer = QTimer(self)
+        self.progress_timer.setInterval(PROGRESS_REFRESH_MS)
+        self.progress_timer.timeout.connect(self.refresh_progress)
+        self.progress_timer.start()
+        self.import_timer = QTimer(self)
+        self.import_timer.setInterval(IMPORT_FLUSH_MS)
+        self.import_timer.timeout.connect(self.flush_imports)
 
         # Wire UI
         self.btn_browse.clicked.connect(self.choose_outdir)
         self.btn_cookies.clicked.connect(self.choose_cookies)
+        self.btn_save_profile.clicked.connect(self.save_profile)
+        self.btn_load_profile.clicked.connect(self.load_profile)
         self.btn_add.clicked.connect(self.add_to_queue)
+        self.btn_import.clicked.connect(self.import_file)
         self.btn_clear_input.clicked.connect(lambda: self.url_box.setPlainText(""))
+        self.btn_save_sources.clicked.connect(self.save_sources)
+        self.btn_sync.clicked.connect(self.sync_sources)
         self.btn_remove.clicked.connect(self.remove_selected)
+        self.btn_cancel_selected.clicked.connect(self.cancel_selected)
         self.btn_clear_queue.clicked.connect(self.clear_queue)
+        self.btn_priority_up.clicked.connect(lambda: self.change_priority(1))
+        self.btn_priority_down.clicked.connect(lambda: self.change_priority(-1))
         self.btn_list_formats.clicked.connect(self.list_formats_for_first_url)
         self.btn_download.clicked.connect(self.start_download)
         self.btn_cancel.clicked.connect(self.cancel)
+        self.rate_limit.editingFinished.connect(self.apply_rate_budget)
+        self.rate_schedule.editingFinished.connect(self.apply_rate_budget)
 
         # Wire signals
-        self.signals.log.connect(self.append_log)
-        self.signals.progress.connect(self.update_progress)
+        # Direct connection: worker threads write straight into the buffer instead of
+        # posting one event per line to the UI thread.
+        self.signals.log.connect(self.log_buffer.write, Qt.DirectConnection)
+        self.signals.item_state.connect(self.on_item_state)
+        self.signals.items_added.connect(self.on_items_added)
+        self.signals.item_estimated.connect(lambda item_id, _: self.queue.item_changed(item_id))
         self.signals.formats_ready.connect(self.populate_formats)
         self.signals.item_started.connect(self.on_item_started)
         self.signals.item_done.connect(self.on_item_done)
         self.signals.error.connect(self.on_error)
         self.signals.finished.connect(self.on_finished)
 
+        self.restore_queue()
+
+    def restore_queue(self):
+        """Bring back whatever was still queued when the app last quit (or crashed)."""
+        items = self.journal.load_unfinished()
+        if not items:
+            return
+        by_parent: dict[int | None, list[DownloadItem]] = {}
+        for item in items:
+            by_parent.setdefault(item.parent_id, []).append(item)
+        # Parents have lower ids than their entries, so each group's parent already exists.
+        for parent_id, group in sorted(by_parent.items(), key=lambda kv: min(it.id for it in kv[1])):
+            self.queue.add_items(group, parent_id)
+        self.queue_list.expandAll()
+        unfinished = sum(1 for it in items if it.state != ItemState.DONE)
+        self.signals.log.emit(f"Restored {unfinished} unfinished item(s) from the last session.\n")
+
+    def closeEvent(self, event):
+        self.cancel_flag = True
+        self.import_token.cancel()
+        if self.scheduler:
+            self.scheduler.cancel_all()
+        self.session_pool.close_all()
+        self.postprocess_pool.close()
+        self.download_processes.close()
+        if self.staging is not None:
+            self.staging.close()
+        if self.tracer is not None:
+            self.tracer.close()
+        self.flush_log()
+        self.log_buffer.close()
+        self.journal.close()
+        super().closeEvent(event)
+
     # -----------------------------
     # UI helpers
     # -----------------------------
     def append_log(self, text: str):
-        self.log.moveCursor(QTextCursor.End)
-        self.log.insertPlainText(text)
-        self.log.moveCursor(QTextCursor.End)
+        bar = self.log.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum() - 4
+        cursor = QTextCursor(self.log.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+        if at_bottom:
+            bar.setValue(bar.maximum())
+
+    def flush_log(self):
+        text = self.log_buffer.drain()
+        if text:
+            self.append_log(text)
 
     def update_progress(self, pct: float, status: str):
         self.progress.setValue(max(0, min(100, int(pct))))
         self.status.setText(status)
 
+    def on_item_state(self, item_id: int, state: str):
+        self.queue.item_changed(item_id)
+        item = self.queue.get(item_id)
+        if item is not None:
+            self.journal.update(item)
+        self.progress.setValue(int(self.queue.overall_progress()))
+
+    def refresh_progress(self):
+        if not self.scheduler:
+            return
+        st = self.progress_stats.snapshot(pending_items=self.queue.pending_count())
+        for item_id in st.changed:
+            self.queue.item_changed(item_id)
+        self.update_progress(self.queue.overall_progress(), format_queue_stats(st))
+
+    def on_items_added(self, parent_id: int, children: list):
+        added = self.queue.add_items(children, parent_id)
+        self.journal.add(added)
+        # Parent removed mid-expansion, or entries already queued elsewhere.
+        if self.scheduler and len(added) != len(children):
+            kept = {child.id for child in added}
+            for child in children:
+                if child.id not in kept:
+                    self.scheduler.discard(child)
+        parent = self.queue.get(parent_id)
+        if parent is not None:
+            self.journal.update(parent)
+            self.queue.item_changed(parent_id)
+            self.queue_list.expand(self.queue.index_of(parent))
+
+    def selected_queue_items(self) -> list[DownloadItem]:
+        items = []
+        for index in self.queue_list.selectionModel().selectedRows():
+            item = self.queue.get(index.internalId())
+            if item is not None:
+                items.append(item)
+        return items
+
     def on_item_started(self, url: str):
         self.status.setText(f"Downloading: {url}")
 
@@ -427,6 +850,8 @@ class MainWindow(QMainWindow):
         self.btn_cancel.setEnabled(False)
         self.btn_download.setEnabled(True)
         self.btn_list_formats.setEnabled(True)
+        self.scheduler = None
+        self.daemon = None
         self.status.setText("Canceled" if self.cancel_flag else "Idle")
         self.signals.log.emit("=== Task finished ===\n")
 
@@ -446,31 +871,182 @@ class MainWindow(QMainWindow):
         if path:
             self.cookies_path.setText(path)
 
+    def save_profile(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save profile", os.path.join(app_data_dir(), "profile.json"),
+            "JSON Files (*.json);;All Files (*)"
+        )
+        if path:
+            self.collect_options().save(path)
+            self.signals.log.emit(f"Profile saved: {path}\n")
+
+    def load_profile(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Load profile", app_data_dir(), "JSON Files (*.json);;All Files (*)"
+        )
+        if not path:
+            return
+        try:
+            self.apply_options(DownloadOptions.load(path))
+        except (OSError, ValueError, TypeError) as e:
+            QMessageBox.warning(self, "Invalid profile", str(e))
+            return
+        self.signals.log.emit(f"Profile loaded: {path}\n")
+
     def add_to_queue(self):
+        text = self.url_box.toPlainText()
+        if not text.strip():
+            return
+        if self.start_import(lambda: iter_urls(io.StringIO(text)), "the input box"):
+            self.url_box.setPlainText("")
+
+    def import_file(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Import URL list", os.path.expanduser("~"),
+            "URL lists (*.txt *.csv *.tsv *.json *.jsonl);;All Files (*)"
+        )
+        if not path:
+            return
+
+        def source():
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                yield from iter_urls(f, url_list_kind(path))
+
+        self.start_import(source, os.path.basename(path))
+
+    def start_import(self, source, label: str) -> bool:
+        """
+        Parse, canonicalize and dedupe URLs from source() on a worker thread; new items
+        are picked up in batches by flush_imports. Returns False if an import is running.
+        """
+        if self.import_thread and self.import_thread.is_alive():
+            QMessageBox.information(self, "Busy", "An import is already running.")
+            return False
+        known = [item.url for item in self.queue]
+        archive_path = self.collect_options().archive_path()
+        token = self.import_token
+
+        def worker():
+            try:
+                importer = UrlImporter(self.url_matcher, known, read_archive(archive_path))
+                stats = importer.run(source(), self.imported.append, token)
+            except Exception as e:
+                self.signals.error.emit(f"Import from {label} failed: {e}")
+                return
+            self.signals.log.emit(f"Imported {stats.read} URL(s) from {label}: {stats.summary()}\n")
+
+        self.import_thread = threading.Thread(target=worker, name="url-import", daemon=True)
+        self.import_thread.start()
+        self.import_timer.start()
+        return True
+
+    def save_sources(self):
         urls = safe_strip_lines(self.url_box.toPlainText())
         if not urls:
+            QMessageBox.warning(self, "No URL", "Paste channel or playlist URLs in the input box.")
             return
-        for u in urls:
-            self.queue.append(DownloadItem(url=u))
-            self.queue_list.addItem(QListWidgetItem(u))
+        n = self.sources.add(urls)
         self.url_box.setPlainText("")
+        self.signals.log.emit(f"Saved {n} new source(s); {len(self.sources.sources())} in total.\n")
+
+    def sync_sources(self):
+        """Enumerate the saved sources on a worker thread; new entries arrive like an import."""
+        if self.import_thread and self.import_thread.is_alive():
+            QMessageBox.information(self, "Busy", "An import is already running.")
+            return
+        urls = [src.url for src in self.sources.sources()]
+        if not urls:
+            QMessageBox.information(self, "No sources",
+                                    "Paste channel or playlist URLs and click \"Save as sources\".")
+            return
+        options = self.collect_options()
+        archive_path = options.archive_path()
+        token = self.import_token
+
+        def worker():
+            opts = options.to_ydl_opts()
+            runner = YtDlpRunner(self.signals, lambda: self.cancel_flag, cache=self.info_cache,
+                                 pool=self.session_pool)
+            started = time.monotonic()
+            try:
+                sync = SourceSync(runner, self.sources, read_archive(archive_path))
+                results = sync.run(urls, opts, self.imported.append, token)
+            except Exception as e:
+                self.signals.error.emit(f"Sync failed: {e}")
+                return
+            for r in results:
+                if r.error or r.new:
+                    self.signals.log.emit(f"Sync: {r.summary()}\n")
+            self.signals.log.emit(
+                f"Synced {len(results)} source(s) in {time.monotonic() - started:.1f}s: "
+                f"{sum(r.new for r in results)} new item(s), {sum(1 for r in results if r.error)} failed.\n")
+
+        self.signals.log.emit(f"Syncing {len(urls)} source(s)…\n")
+        self.import_thread = threading.Thread(target=worker, name="source-sync", daemon=True)
+        self.import_thread.start()
+        self.import_timer.start()
+
+    def flush_imports(self):
+        items: list[DownloadItem] = []
+        while self.imported:
+            items.extend(self.imported.popleft())
+        if not (self.import_thread and self.import_thread.is_alive()) and not self.imported:
+            self.import_timer.stop()
+        if not items:
+            return
+        added = self.queue.add_items(items)
+        self.journal.add(added)
+        skipped = len(items) - len(added)
+        if skipped:
+            self.signals.log.emit(f"Skipped {skipped} duplicate URL(s).\n")
+        # Picked up by the running pool, if any; otherwise they wait for the next run.
+        if self.scheduler:
+            for item in added:
+                self.scheduler.submit(item)
+        self.import_timer.setInterval(max(IMPORT_FLUSH_MS, len(self.queue) // IMPORT_FLUSH_ROWS_PER_MS))
 
     def remove_selected(self):
-        idxs = sorted([i.row() for i in self.queue_list.selectedIndexes()], reverse=True)
-        for idx in idxs:
-            self.queue.pop(idx)
-            self.queue_list.takeItem(idx)
+        items = self.selected_queue_items()
+        # Drop the selection first; otherwise the selection model re-maps every
+        # selected row on each removal notification.
+        self.queue_list.selectionModel().clear()
+        # Removing a playlist removes its entries too.
+        removed = self.queue.remove_items(items)
+        self.journal.remove(removed)
+        if self.scheduler:
+            for item in removed:
+                self.scheduler.discard(item)
+
+    def cancel_selected(self):
+        if self.daemon:
+            self.cancel_in_daemon(self.selected_queue_items())
+            return
+        if not self.scheduler:
+            return
+        for item in self.selected_queue_items():
+            self.scheduler.cancel_item(item)
+
+    def change_priority(self, step: int):
+        for item in self.selected_queue_items():
+            item.priority += step
+            self.queue.item_changed(item.id)
+            self.journal.update(item)
+            if self.scheduler:
+                self.scheduler.reprioritize(item)
 
     def clear_queue(self):
+        if self.scheduler:
+            for item in self.queue:
+                self.scheduler.discard(item)
         self.queue.clear()
-        self.queue_list.clear()
+        self.journal.clear()
 
     def list_formats_for_first_url(self):
         urls = safe_strip_lines(self.url_box.toPlainText())
         if urls:
             url = urls[0]
-        elif self.queue:
-            url = self.queue[0].url
+        elif self.queue.first():
+            url = self.queue.first().url
         else:
             QMessageBox.warning(self, "No URL", "Paste a URL in the input box or add something to the queue.")
             return
@@ -486,19 +1062,118 @@ class MainWindow(QMainWindow):
         if not outdir or not os.path.isdir(outdir):
             QMessageBox.warning(self, "Invalid output folder", "Choose a valid output folder.")
             return
+        options = self.collect_options()
+        try:
+            options.parsed_format_rule()
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid format rule", str(e))
+            return
+
+        if self.current_thread and self.current_thread.is_alive():
+            QMessageBox.information(self, "Busy", "A task is already running.")
+            return
+
+        pending = [it for it in self.queue if it.state != ItemState.DONE]
+        if not pending:
+            QMessageBox.information(self, "Nothing to do", "Every queued item is already done.")
+            return
 
         self.cancel_flag = False
+        if self.chk_daemon.isChecked():
+            self.start_in_daemon(pending, options)
+            return
+        self.scheduler = DownloadScheduler(self.signals, workers=self.workers.value(),
+                                           host_limit=self.host_limit.value(), retry=options.retry_policy(),
+                                           policy=options.schedule)
+        self.apply_rate_budget()
+        self.progress_stats = ProgressAggregator()
+        for item in pending:
+            self.scheduler.submit(item)
+
         self.btn_cancel.setEnabled(True)
         self.btn_download.setEnabled(False)
         self.btn_list_formats.setEnabled(False)
         self.progress.setValue(0)
         self.status.setText("Starting…")
         self.signals.log.emit("=== Download started ===\n")
-
         self.run_in_thread(target="download_queue")
 
+    def start_in_daemon(self, pending: list[DownloadItem], options: DownloadOptions):
+        # Playlists expand in the daemon; their rows show the progress of all entries.
+        client = DaemonClient.find()
+        if client is None:
+            QMessageBox.warning(self, "No daemon",
+                                "No download daemon is running. Start one with:\n"
+                                "python ytdlp_gui.py --daemon --profile profile.json")
+            return
+        self.daemon = client
+        self.daemon_jobs = {}
+        self.daemon_cancel = False
+        self.btn_cancel.setEnabled(True)
+        self.btn_download.setEnabled(False)
+        self.btn_list_formats.setEnabled(False)
+        self.progress.setValue(0)
+        self.status.setText(f"Sending to the daemon on port {client.port}…")
+        self.signals.log.emit("=== Download started (daemon) ===\n")
+        self.current_thread = threading.Thread(target=self.daemon_queue,
+                                               args=(client, pending, options.to_dict()), daemon=True)
+        self.current_thread.start()
+
+    def daemon_queue(self, client: DaemonClient, items: list[DownloadItem], profile: dict):
+        """Worker thread: submit items as daemon jobs and mirror their state until all are finished."""
+        finished = (ItemState.DONE, ItemState.FAILED, ItemState.CANCELED)
+        watching: dict[int, DownloadItem] = {}
+        canceled = False
+        try:
+            for item in items:
+                if self.daemon_cancel:
+                    break
+                job = client.submit(item.url, profile, item.priority)
+                self.daemon_jobs[item.id] = job["id"]
+                watching[job["id"]] = item
+            self.signals.log.emit(f"Sent {len(watching)} item(s) to the daemon on port {client.port}.\n")
+            while watching:
+                if self.daemon_cancel and not canceled:
+                    canceled = True
+                    for job_id in list(watching):
+                        client.cancel(job_id)
+                for job in client.jobs(list(watching)):
+                    item = watching[job["id"]]
+                    changed = job["state"] != item.state or job["progress"] != item.progress
+                    item.title = job["title"] or item.title
+                    item.progress = job["progress"]
+                    item.speed = job["speed"]
+                    item.error = job["error"]
+                    if changed:
+                        item.state = job["state"]
+                        self.signals.item_state.emit(item.id, item.state)
+                    if item.state in finished:
+                        del watching[job["id"]]
+                        if item.state == ItemState.FAILED:
+                            self.signals.log.emit(f"Failed: {item.url}: {item.error}\n")
+                        elif item.state == ItemState.DONE:
+                            self.signals.item_done.emit(item.url)
+                if watching:
+                    time.sleep(DAEMON_POLL_S)
+        except (OSError, ValueError) as e:
+            self.signals.error.emit(f"Daemon: {e}")
+        finally:
+            self.signals.finished.emit()
+
+    def cancel_in_daemon(self, items: list[DownloadItem]):
+        try:
+            for item in items:
+                job_id = self.daemon_jobs.get(item.id)
+                if job_id is not None:
+                    self.daemon.cancel(job_id)
+        except (OSError, ValueError) as e:
+            self.signals.error.emit(f"Daemon: {e}")
+
     def cancel(self):
         self.cancel_flag = True
+        self.daemon_cancel = True
+        if self.scheduler:
+            self.scheduler.cancel_all()
         self.signals.log.emit("Cancel requested…\n")
         self.btn_cancel.setEnabled(False)
 
@@ -510,9 +1185,42 @@ class MainWindow(QMainWindow):
             QMessageBox.information(self, "Busy", "A task is already running.")
             return
 
+        options = self.collect_options()
+        tuner = self.fragment_tuner if self.fragments.value() == 0 else None
+        # Validated by start_download; listing formats shows them all.
+        rule = options.parsed_format_rule() if target == "download_queue" else None
+        tracer = None
+        if self.chk_metrics.isChecked():
+            if self.tracer is None:
+                self.tracer = Tracer.in_app_data()
+                self.signals.log.emit(f"Recording timings to {self.tracer.trace_path} and "
+                                      f"{self.tracer.metrics_path}\n")
+            tracer = self.tracer
+        isolate = {"processes": self.download_processes} if self.chk_isolate.isChecked() else None
+        staging = None
+        if target == "download_queue":
+            root = options.staging_root()
+            if root is not None and (self.staging is None or self.staging.root != root):
+                if self.staging is not None:
+                    self.staging.close()
+                self.staging = StagingArea(root)
+            staging = self.staging if root is not None else None
+
         def worker():
-            runner = YtDlpRunner(self.signals, lambda: self.cancel_flag)
-            base_opts = self.build_base_opts()
+            # to_ydl_opts() and audio_warning() may run ffmpeg to probe it; not on the UI thread.
+            base_opts = options.to_ydl_opts()
+            if target == "download_queue":
+                warning = options.audio_warning()
+                if warning:
+                    self.signals.log.emit(f"WARNING: {warning}\n")
+            runner_cls = ProcessRunner if isolate else YtDlpRunner
+            runner = runner_cls(self.signals, lambda: self.cancel_flag, cache=self.info_cache,
+                                pool=self.session_pool, progress=self.progress_stats,
+                                postprocess=self.postprocess_pool, bandwidth=self.bandwidth,
+                                fragments=tuner, format_rule=rule, tracer=tracer, staging=staging,
+                                **(isolate or {}))
+            # Sessions built for other option sets won't be leased again.
+            self.session_pool.evict(keep=opts_key(base_opts))
             try:
                 if target == "list_formats":
                     runner.list_formats(url, base_opts)
@@ -523,6 +1231,8 @@ class MainWindow(QMainWindow):
             except Exception as e:
                 self.signals.error.emit(str(e))
             finally:
+                if tracer is not None:
+                    tracer.flush()
                 self.signals.finished.emit()
 
         self.current_thread = threading.Thread(target=worker, daemon=True)
@@ -535,108 +1245,94 @@ class MainWindow(QMainWindow):
             self.format_combo.addItem(display, fid)
         self.signals.log.emit(f"Loaded {len(formats)} formats.\n")
 
-    def build_base_opts(self) -> dict:
-        outdir = self.out_dir.text().strip()
-        outtmpl = os.path.join(outdir, "%(title)s.%(ext)s")
-
-        opts: dict = {
-            "outtmpl": outtmpl,
-            "noplaylist": not self.chk_playlist.isChecked(),
-            "retries": 3,
-            "fragment_retries": 3,
-            "continuedl": True,
-            "quiet": True,
-            "no_warnings": True,
-        }
-
-        # ffmpeg/ffprobe location (bundled preferred)
-        ffdir = bundled_ffmpeg_dir()
-        if ffdir:
-            opts["ffmpeg_location"] = ffdir
-        else:
-            sys_ffdir = best_effort_system_ffmpeg_dir()
-            if sys_ffdir:
-                opts["ffmpeg_location"] = sys_ffdir
-
-        # Rate limit
-        rl = parse_rate_limit(self.rate_limit.text())
-        if rl is not None:
-            opts["ratelimit"] = rl
-
-        # Cookies
-        cookies = self.cookies_path.text().strip()
-        if cookies:
-            opts["cookiefile"] = cookies
-
-        # Format choice
-        chosen = self.format_combo.currentData()
-        if chosen and chosen != "best":
-            opts["format"] = str(chosen)
-        else:
-            opts["format"] = "bv*+ba/b"
-
-        # Subtitles
-        if self.chk_subs.isChecked():
-            langs = [s.strip() for s in self.sub_lang.text().split(",") if s.strip()]
-            if langs:
-                opts["subtitleslangs"] = langs
-            opts["writesubtitles"] = True
-            if self.chk_auto_subs.isChecked():
-                opts["writeautomaticsub"] = True
-
-        # Metadata / thumbnail / info json
-        if self.chk_metadata.isChecked():
-            opts["embedmetadata"] = True
-            opts["addmetadata"] = True
-        if self.chk_thumbnail.isChecked():
-            opts["writethumbnail"] = True
-            opts["embedthumbnail"] = True
-        if self.chk_infojson.isChecked():
-            opts["writeinfojson"] = True
+    def collect_options(self) -> DownloadOptions:
+        """Snapshot the option widgets (UI thread only)."""
+        return DownloadOptions(
+            out_dir=self.out_dir.text().strip(),
+            format=str(self.format_combo.currentData() or "best"),
+            format_rule=self.format_rule.text().strip(),
+            allow_playlists=self.chk_playlist.isChecked(),
+            rate_limit=self.rate_limit.text(),
+            rate_schedule=self.rate_schedule.text(),
+            cookies=self.cookies_path.text().strip(),
+            workers=self.workers.value(),
+            host_limit=self.host_limit.value(),
+            fragments=self.fragments.value(),
+            isolate_downloads=self.chk_isolate.isChecked(),
+            retry_attempts=self.retries.value(),
+            schedule=str(self.schedule.currentData()),
+            staging=self.chk_staging.isChecked(),
+            staging_dir=self.staging_dir,
+            subtitles=self.chk_subs.isChecked(),
+            auto_subtitles=self.chk_auto_subs.isChecked(),
+            sub_langs=self.sub_lang.text(),
+            embed_metadata=self.chk_metadata.isChecked(),
+            embed_thumbnail=self.chk_thumbnail.isChecked(),
+            write_info_json=self.chk_infojson.isChecked(),
+            use_archive=self.chk_archive.isChecked(),
+            record_metrics=self.chk_metrics.isChecked(),
+            extract_audio=self.chk_extract_audio.isChecked(),
+            audio_format=self.audio_fmt.currentText(),
+            audio_bitrate=self.audio_bitrate.currentText(),
+        )
 
-        # Audio extraction
-        if self.chk_extract_audio.isChecked():
-            afmt = self.audio_fmt.currentText()
-            abr = self.audio_bitrate.currentText().replace("K", "")
-            opts["format"] = "ba/b"
-            opts["postprocessors"] = [
-                {
-                    "key": "FFmpegExtractAudio",
-                    "preferredcodec": afmt,
-                    "preferredquality": abr,
-                }
-            ]
-
-        return opts
+    def apply_options(self, o: DownloadOptions):
+        self.out_dir.setText(o.out_dir)
+        i = self.format_combo.findData(o.format)
+        if i < 0:
+            self.format_combo.addItem(o.format, o.format)
+            i = self.format_combo.count() - 1
+        self.format_combo.setCurrentIndex(i)
+        self.format_rule.setText(o.format_rule)
+        self.chk_playlist.setChecked(o.allow_playlists)
+        self.rate_limit.setText(o.rate_limit)
+        self.rate_schedule.setText(o.rate_schedule)
+        self.cookies_path.setText(o.cookies)
+        self.workers.setValue(o.workers)
+        self.host_limit.setValue(o.host_limit)
+        self.fragments.setValue(o.fragments)
+        self.chk_isolate.setChecked(o.isolate_downloads)
+        self.retries.setValue(o.retry_attempts)
+        self.schedule.setCurrentIndex(max(0, self.schedule.findData(o.schedule)))
+        self.chk_staging.setChecked(o.staging)
+        self.staging_dir = o.staging_dir
+        self.apply_rate_budget()
+        self.chk_subs.setChecked(o.subtitles)
+        self.chk_auto_subs.setChecked(o.auto_subtitles)
+        self.sub_lang.setText(o.sub_langs)
+        self.chk_metadata.setChecked(o.embed_metadata)
+        self.chk_thumbnail.setChecked(o.embed_thumbnail)
+        self.chk_infojson.setChecked(o.write_info_json)
+        self.chk_archive.setChecked(o.use_archive)
+        self.chk_metrics.setChecked(o.record_metrics)
+        self.chk_extract_audio.setChecked(o.extract_audio)
+        self.audio_fmt.setCurrentText(o.audio_format)
+        self.audio_bitrate.setCurrentText(o.audio_bitrate)
+
+    def apply_rate_budget(self):
+        """Push the rate fields to the shared limiter; running downloads adjust within a second."""
+        self.bandwidth.configure(*self.collect_options().rate_budget())
 
     def download_queue(self, runner: YtDlpRunner, base_opts: dict):
-        total = len(self.queue)
-        for i, item in enumerate(self.queue, start=1):
-            if self.cancel_flag:
-                self.signals.log.emit("Canceled before next item.\n")
-                return
-
-            self.signals.item_started.emit(item.url)
-            self.signals.log.emit(f"\n--- [{i}/{total}] {item.url} ---\n")
-
-            opts = dict(base_opts)
-            try:
-                runner.download(item.url, opts)
-                self.signals.item_done.emit(item.url)
-            except yt_dlp.utils.DownloadError as e:
-                msg = str(e)
-                if "Canceled by user" in msg:
-                    self.signals.log.emit("Canceled.\n")
-                    return
-                self.signals.log.emit(f"Error: {msg}\n")
-            except Exception as e:
-                self.signals.log.emit(f"Error: {e}\n")
+        scheduler = self.scheduler
+        if scheduler is None:
+            return
+        self.signals.log.emit(f"Running with {scheduler.workers} parallel download(s).\n")
+        scheduler.run(runner, base_opts)
+        st = self.info_cache.stats()
+        self.signals.log.emit(
+            f"Info cache: {st['hits'] + st['disk_hits']} hit(s), {st['misses']} miss(es), "
+            f"{st['entries']} in memory.\n"
+        )
 
 
 def main():
     app = QApplication(sys.argv)
     w = MainWindow()
     w.show()
+    # yt-dlp is imported lazily and ffmpeg probed once; warm both up once the window is on screen.
+    QTimer.singleShot(0, preload_yt_dlp)
+    QTimer.singleShot(0, preload_ffmpeg_caps)
     sys.exit(app.exec())
 
 